@@ -0,0 +1,117 @@
+"""Per tick state of the actors as contiguous arrays.
+
+A carla.WorldSnapshot holds the transform and velocity of every actor for one
+frame and is read locally, while every getter on a carla.Actor is a round trip
+to the server. ActorStateTable copies what the controllers need out of one
+snapshot into NumPy arrays. Bounding box extents never change for an actor and
+are fetched once per id by ExtentCache, which also tells the vehicles apart.
+"""
+
+import numpy as np
+
+
+class ExtentCache(object):
+    """Bounding box extents and types by actor id, unknown ids are fetched in one call"""
+
+    def __init__(self, world):
+        self.world = world
+        self._extents = {}
+        self._vehicles = set()
+
+    def _fetch(self, ids):
+        missing = [actor_id for actor_id in ids if actor_id not in self._extents]
+        if missing:
+            for actor in self.world.get_actors(missing):
+                bounding_box = getattr(actor, 'bounding_box', None)
+                extent = bounding_box.extent if bounding_box is not None else None
+                self._extents[actor.id] = (extent.x, extent.y, extent.z) if extent is not None else (0.0, 0.0, 0.0)
+                if actor.type_id.startswith('vehicle.'):
+                    self._vehicles.add(actor.id)
+            for actor_id in missing:
+                # destroyed actors are not asked for again
+                self._extents.setdefault(actor_id, (0.0, 0.0, 0.0))
+
+    def vehicles(self, ids):
+        """The ids of vehicles among ids, in their order"""
+        ids = list(ids)
+        self._fetch(ids)
+        return [actor_id for actor_id in ids if actor_id in self._vehicles]
+
+    def lookup(self, ids):
+        '''
+        ids: actor ids
+        return: (n, 3) half extents, 0 for actors without a bounding box
+        '''
+        self._fetch(ids)
+        return np.array([self._extents.get(actor_id, (0.0, 0.0, 0.0)) for actor_id in ids],
+                        dtype=np.float64).reshape(-1, 3)
+
+
+class ActorStateTable(object):
+    """Ids, locations, velocities, rotations and extents of the actors in one snapshot, one row per actor"""
+
+    def __init__(self, frame, timestamp, ids, location, velocity, rotation, extent, angular_velocity=None):
+        '''
+        location, velocity: (n, 3) x, y, z in the world frame
+        rotation: (n, 3) pitch, yaw, roll in degrees
+        extent: (n, 3) half extents of the bounding boxes
+        angular_velocity: (n, 3) degrees per second about x, y, z, 0 if None
+        '''
+        self.frame = frame
+        self.timestamp = timestamp
+        self.ids = ids
+        self.location = location
+        self.velocity = velocity
+        self.rotation = rotation
+        self.extent = extent
+        self.angular_velocity = angular_velocity if angular_velocity is not None else np.zeros_like(location)
+        self._rows = {actor_id: row for row, actor_id in enumerate(ids.tolist())}
+
+    @classmethod
+    def from_snapshot(cls, snapshot, ids=None, extents=None):
+        '''
+        snapshot: carla.WorldSnapshot, e.g. world.get_snapshot() or the return of world.wait_for_tick()
+        ids: actor ids to keep, in this order, ids missing from the snapshot are skipped; all actors if None
+        extents: optional ExtentCache, extents are 0 without one
+        '''
+        if ids is None:
+            actors = list(snapshot)
+        else:
+            actors = [actor for actor in (snapshot.find(actor_id) for actor_id in ids) if actor is not None]
+        n = len(actors)
+        state = np.empty((n, 12), dtype=np.float64)
+        for row, actor in enumerate(actors):
+            transform = actor.get_transform()
+            location, rotation = transform.location, transform.rotation
+            velocity = actor.get_velocity()
+            angular_velocity = actor.get_angular_velocity()
+            state[row] = (location.x, location.y, location.z, velocity.x, velocity.y, velocity.z,
+                          rotation.pitch, rotation.yaw, rotation.roll,
+                          angular_velocity.x, angular_velocity.y, angular_velocity.z)
+        table_ids = np.array([actor.id for actor in actors], dtype=np.int64)
+        extent = extents.lookup(table_ids.tolist()) if extents is not None else np.zeros((n, 3))
+        timestamp = snapshot.timestamp.elapsed_seconds
+        return cls(snapshot.frame, timestamp, table_ids, state[:, 0:3], state[:, 3:6], state[:, 6:9], extent,
+                   state[:, 9:12])
+
+    def __len__(self):
+        return self.ids.shape[0]
+
+    @property
+    def yaw(self):
+        return self.rotation[:, 1]
+
+    @property
+    def yaw_rate(self):
+        """Degrees per second, same sign as the yaw"""
+        return self.angular_velocity[:, 2]
+
+    def row(self, actor_id):
+        """Row of an actor, None if it is not in the table"""
+        return self._rows.get(actor_id)
+
+    def select(self, rows):
+        """Table of a subset of the rows, by index array or boolean mask"""
+        return ActorStateTable(self.frame, self.timestamp, self.ids[rows], self.location[rows],
+                               self.velocity[rows], self.rotation[rows], self.extent[rows],
+                               self.angular_velocity[rows])
@@ -0,0 +1,42 @@
+"""Array backend used by the APF lidar pipeline.
+
+NumPy is used by default. CuPy can be selected at startup if it is installed;
+every module reads the backend through ``apf_backend.xp`` so the force, mask and
+colorization code only has one implementation.
+"""
+
+import logging
+
+import numpy as np
+
+try:
+    import cupy
+except ImportError:
+    cupy = None
+
+BACKENDS = ('numpy', 'cupy', 'auto')
+
+xp = np
+
+
+def select_backend(name='numpy'):
+    '''
+    select the array module used by the lidar pipeline, must be called at startup
+    name: 'numpy', 'cupy', or 'auto' (cupy if it is installed, numpy otherwise)
+    return: the selected array module
+    '''
+    global xp
+    if name not in BACKENDS:
+        raise ValueError('unknown array backend %r, expected one of %s' % (name, BACKENDS))
+    if name == 'cupy' and cupy is None:
+        raise RuntimeError('cannot import cupy, make sure cupy package is installed')
+    xp = cupy if name == 'cupy' or (name == 'auto' and cupy is not None) else np
+    logging.info('using %s array backend', xp.__name__)
+    return xp
+
+
+def asnumpy(array):
+    """Returns a host (NumPy) copy of an array of any backend, or the array itself"""
+    if cupy is not None and isinstance(array, cupy.ndarray):
+        return cupy.asnumpy(array)
+    return np.asarray(array)
@@ -0,0 +1,243 @@
+#!/usr/bin/env python
+
+"""APFPlanner.plan of many independent scenarios in one vectorized loop.
+
+A batch of m scenarios is stacked: starts and goals (m, 2), obstacles (m, k, 2)
+padded to the largest obstacle count with a boolean (m, k) mask, and one lane
+width per scenario. Every iteration advances all the scenarios still running
+with a handful of array operations over the running rows, so a batch costs
+about as many numpy calls as a single plan of its longest scenario. A scenario
+leaves the running rows when it reaches its goal, gives up on a stall or runs
+out of iterations. The steps are those of APFPlanner.plan up to rounding,
+escapes included, only the random draws of the escapes come in another order.
+Virtual obstacles are extra masked columns of the obstacle array.
+
+random_scenarios() draws randomized lane change scenes, the command line scores
+the planner on them:
+
+    python apf_batch.py --scenarios 5000 --obstacles 8 --lane-width 3:4.5
+"""
+
+import argparse
+import collections
+import time
+
+import numpy as np
+
+from apf_planner import APFPlanner, Plan
+
+Scenarios = collections.namedtuple('Scenarios', [
+    'start',        # (m, 2) points in the road frame
+    'goal',         # (m, 2) points
+    'obstacles',    # (m, k, 2) points, padded
+    'mask',         # (m, k) the real obstacles
+    'lane_width',   # (m,) meters
+])
+BatchPlan = collections.namedtuple('BatchPlan', [
+    'path',         # (m, max_iter + 1, 2) positions, NaN past the end of each path
+    'converged',    # (m,) the goal was reached
+    'iterations',   # (m,) steps taken, the path of a scenario has iterations + 1 points
+    'escapes',      # (m,) local minima escaped from
+])
+
+
+def random_scenarios(count, max_obstacles=8, lane_width=(3.0, 4.5), length=(60.0, 120.0), seed=None):
+    '''
+    draw lane change scenes, the start in one lane and the goal ahead in either lane
+    max_obstacles: each scene has 0 to max_obstacles obstacles between start and goal
+    lane_width, length: (low, high) ranges of the lane width and of the distance to the goal
+    return: Scenarios
+    '''
+    rng = np.random.default_rng(seed)
+    d = rng.uniform(lane_width[0], lane_width[1], count)
+    start = np.stack((np.zeros(count), rng.choice((-0.5, 0.5), count) * d), axis=1)
+    goal = np.stack((rng.uniform(length[0], length[1], count), rng.choice((-0.5, 0.5), count) * d), axis=1)
+    # obstacles near the lane centres, anywhere from a few meters ahead of the start to the goal
+    x = 5.0 + rng.uniform(size=(count, max_obstacles)) * (goal[:, 0, None] - 5.0)
+    y = (rng.choice((-0.5, 0.5), (count, max_obstacles)) + rng.uniform(-0.2, 0.2, (count, max_obstacles))) * d[:, None]
+    mask = np.arange(max_obstacles) < rng.integers(0, max_obstacles + 1, count)[:, None]
+    return Scenarios(start, goal, np.stack((x, y), axis=-1), mask, d)
+
+
+def plan_batch(planner, start, goal, obstacles, mask=None, lane_width=None):
+    '''
+    APFPlanner.plan of m scenarios at once
+    start, goal: (m, 2) points in the road frame
+    obstacles: (m, k, 2) points
+    mask: optional boolean (m, k), padding obstacles are False
+    lane_width: optional (m,) lane widths, defaults to the planner's
+    return: BatchPlan
+    '''
+    start = np.asarray(start, dtype=np.float64)
+    goal = np.asarray(goal, dtype=np.float64)
+    m, k = np.shape(obstacles)[:2]
+    extra = planner.max_escapes if planner.escape == 'virtual' else 0
+    others = np.zeros((m, k + extra, 2))
+    others[:, :k] = obstacles
+    known = np.zeros((m, k + extra), dtype=bool)
+    known[:, :k] = True if mask is None else mask
+    lane_width = np.full(m, planner.lane_width, dtype=np.float64) if lane_width is None else \
+        np.asarray(lane_width, dtype=np.float64)
+
+    step2 = planner.step * planner.step
+    stall2 = (planner.min_progress * planner.window * planner.step) ** 2
+    path = np.full((m, planner.max_iter + 1, 2), np.nan)
+    path[:, 0] = start
+    converged = np.zeros(m, dtype=bool)
+    iterations = np.full(m, planner.max_iter)
+    escapes = np.zeros(m, dtype=np.int64)
+    watched = np.zeros(m, dtype=np.int64)
+    escaping = np.zeros(m, dtype=np.int64)
+    walk = np.zeros((m, planner.escape_steps), dtype=np.complex128) if planner.escape == 'random' else None
+    rows = np.arange(m)     # the scenarios still running
+    for i in range(planner.max_iter):
+        if rows.shape[0] == 0:
+            break
+        position = path[rows, i]
+        to_goal = goal[rows] - position
+        rho_g2 = np.sum(to_goal * to_goal, axis=1)
+        arrived = rho_g2 <= step2
+        converged[rows[arrived]] = True
+        iterations[rows[arrived]] = i
+        running = ~arrived
+
+        # progress over the window, restarted after every escape
+        stalled = (escaping[rows] == 0) & (watched[rows] >= planner.window) & running
+        if np.any(stalled):
+            progress = position[stalled] - path[rows[stalled], i - planner.window]
+            stalled[stalled] = np.sum(progress * progress, axis=1) < stall2
+        if np.any(stalled):
+            done = stalled if planner.escape is None else stalled & (escapes[rows] == planner.max_escapes)
+            iterations[rows[done]] = i
+            running &= ~done
+            escape = stalled & ~done
+            s = rows[escape]
+            escapes[s] += 1
+            watched[s] = 0
+            if planner.escape == 'virtual':
+                # beside the stall point, on a random side, so that a symmetric stall is broken as well
+                center = np.mean(path[s, i - planner.window:i + 1], axis=1)
+                side = planner.step * planner.rng.choice((-1.0, 1.0), s.shape[0]) / \
+                    np.maximum(np.sqrt(rho_g2[escape]), 1e-9)
+                tangent = np.stack((-to_goal[escape, 1], to_goal[escape, 0]), axis=1)
+                others[s, k + escapes[s] - 1] = center + side[:, None] * tangent
+                known[s, k + escapes[s] - 1] = True
+            elif s.shape[0]:
+                escaping[s] = planner.escape_steps
+                if planner.escape == 'random':
+                    walk[s] = np.exp(1j * planner.rng.uniform(-np.pi, np.pi, (s.shape[0], planner.escape_steps)))
+
+        rows, position, to_goal, rho_g2 = rows[running], position[running], to_goal[running], rho_g2[running]
+        sums, squares = planner.obstacle_sums(position, others[rows], known[rows])
+        rho_g = np.maximum(np.sqrt(rho_g2), 1e-9)
+        push = (planner.eta_rep_ob * rho_g ** planner.n)[:, None] * sums
+        pull = (0.5 * planner.n * planner.eta_rep_ob * squares * rho_g ** (planner.n - 2))[:, None] * to_goal
+        force = planner.eta_att * to_goal + push + pull
+        force[:, 1] += planner.edge_force(position[:, 1], lane_width[rows])
+
+        active = escaping[rows] > 0
+        if np.any(active):
+            escaping[rows[active]] -= 1
+            if planner.escape == 'random':
+                # the forces still keep the vehicle off the obstacles, the walk only shakes it loose
+                shake = walk[rows[active], escaping[rows[active]]]
+                # where they cancel the walk alone
+                norm = np.linalg.norm(force[active], axis=1)[:, None]
+                direction = np.where(norm < 1e-12, 0.0, force[active] / np.maximum(norm, 1e-12))
+                force[active] = direction + np.stack((shake.real, shake.imag), axis=1)
+            else:
+                # perpendicular to the push of the obstacles, until they stop standing between vehicle and goal
+                blocking = active & (np.sum(push * to_goal, axis=1) <= 0)
+                escaping[rows[active & ~blocking]] = 0
+                normal = np.where((np.sum(push * push, axis=1) > 1e-24)[:, None], push, force)[blocking]
+                towards = to_goal[blocking]
+                turn = np.where(normal[:, 0] * towards[:, 1] - normal[:, 1] * towards[:, 0] > 0, 1.0, -1.0)
+                force[blocking] = turn[:, None] * np.stack((-normal[:, 1], normal[:, 0]), axis=1)
+
+        norm = np.linalg.norm(force, axis=1)
+        stuck = norm < 1e-12
+        iterations[rows[stuck]] = i
+        rows, position, force, norm = rows[~stuck], position[~stuck], force[~stuck], norm[~stuck]
+        path[rows, i + 1] = position + planner.step * force / norm[:, None]
+        watched[rows] += 1
+    if rows.shape[0]:
+        to_goal = goal[rows] - path[rows, -1]
+        converged[rows] = np.sum(to_goal * to_goal, axis=1) <= step2
+    return BatchPlan(path, converged, iterations, escapes)
+
+
+def unstack(batch):
+    """The Plan of every scenario of a BatchPlan"""
+    return [Plan(batch.path[j, :batch.iterations[j] + 1], bool(batch.converged[j]), int(batch.iterations[j]),
+                 int(batch.escapes[j])) for j in range(batch.path.shape[0])]
+
+
+def main():
+    argparser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    argparser.add_argument(
+        '-n', '--scenarios',
+        default=1000,
+        type=int,
+        help='randomized scenarios (default: 1000)')
+    argparser.add_argument(
+        '--obstacles',
+        default=8,
+        type=int,
+        help='obstacles per scenario at most (default: 8)')
+    argparser.add_argument(
+        '--lane-width',
+        default='3:4.5',
+        help='low:high range of the lane width (default: 3:4.5)')
+    argparser.add_argument(
+        '--batch',
+        default=1024,
+        type=int,
+        help='scenarios planned together (default: 1024)')
+    argparser.add_argument(
+        '--escape',
+        default='virtual',
+        choices=['virtual', 'random', 'wall', 'none'],
+        help='local minimum escape (default: virtual)')
+    argparser.add_argument(
+        '--seed',
+        default=0,
+        type=int,
+        help='seed of the scenarios and the escapes (default: 0)')
+    argparser.add_argument(
+        '--compare',
+        action='store_true',
+        help='also plan every scenario on its own with APFPlanner.plan and time both')
+    args = argparser.parse_args()
+
+    low, high = (float(v) for v in args.lane_width.split(':'))
+    scenarios = random_scenarios(args.scenarios, args.obstacles, (low, high), seed=args.seed)
+    planner = APFPlanner(escape=None if args.escape == 'none' else args.escape, seed=args.seed)
+    started = time.perf_counter()
+    batches = []
+    for first in range(0, args.scenarios, args.batch):
+        part = slice(first, first + args.batch)
+        batches.append(plan_batch(planner, scenarios.start[part], scenarios.goal[part], scenarios.obstacles[part],
+                                  scenarios.mask[part], scenarios.lane_width[part]))
+    seconds = time.perf_counter() - started
+    converged = np.concatenate([b.converged for b in batches])
+    iterations = np.concatenate([b.iterations for b in batches])
+    escapes = np.concatenate([b.escapes for b in batches])
+    print('%d scenarios in %.2f s, %.1f us per scenario' % (args.scenarios, seconds, 1e6 * seconds / args.scenarios))
+    print('converged: %.1f %%  iterations: mean %.1f max %d  escapes: mean %.2f' % (
+        100.0 * np.mean(converged), np.mean(iterations), np.max(iterations), np.mean(escapes)))
+
+    if args.compare:
+        started = time.perf_counter()
+        single = []
+        for j in range(args.scenarios):
+            planner.lane_width = scenarios.lane_width[j]
+            single.append(planner.plan(scenarios.start[j], scenarios.goal[j],
+                                       scenarios.obstacles[j][scenarios.mask[j]].reshape(-1, 2)))
+        loop = time.perf_counter() - started
+        print('one at a time: %.2f s, %.1fx slower, converged: %.1f %%' % (
+            loop, loop / seconds, 100.0 * np.mean([plan.converged for plan in single])))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,154 @@
+"""Ground truth artificial potential field (APF) controller for every vehicle at once.
+
+The hero car computes its repulsive force from its own lidar. Here the force of
+every vehicle comes from the positions of all the others in one snapshot: a
+vehicle ahead in the own lane corridor pushes back with the classic APF
+potential gain * (1 / d - 1 / d0) / d, d being the gap between the boxes,
+projected on the heading. The forces of all N vehicles are one (N, N) array
+pass, in row blocks for large N, and go through the same sigmoid throttle law
+as the lidar controller. Every vehicle in the snapshot pushes, the hero and the
+vehicles of other clients included, but only the vehicles this client spawned
+are driven. Steering follows the lane with pure pursuit to a waypoint ahead,
+and all controls are sent in one batch.
+
+The gain is calibrated against the lidar force. Over the points of one car
+the lidar force is about 1e5 * (1 - r / d0) / r^3, r the range from the
+sensor, which sits about 2.9 m behind the front bumper of the hero. Through
+throttle_control with attr=2 and threshold=4 the hero brakes fully once the
+force passes attr + threshold = 6, at a gap of about 12.6 m, and is at half
+throttle, a force of 2, at about 14.9 m. gain=2500 puts the same full brake
+at 12.6 m and half throttle at 16 m, so the fleet keeps the gaps the hero
+keeps, attr and threshold are shared as they are.
+"""
+
+import math
+
+import numpy as np
+
+WHEELBASE_RATIO = 0.6               # wheelbase over the length of the bounding box, close for most cars
+MAX_STEER_ANGLE = math.radians(70)  # wheel angle of a full steer
+
+
+def throttle_control(repl, attr=2.0, threshold=4.0):
+    '''
+    compute throttle and brake from the repulsive and the attractive force, sigmoid of their difference
+    repl: repulsive forces, scalar or array
+    return: throttle, brake, ranged [0.0, 1.0], of the shape of repl
+    '''
+    x = attr - np.asarray(repl, dtype=np.float64)
+    sigmoid = np.round(1.0 / (1.0 + np.exp(-np.clip(x, -threshold, threshold))), 3)
+    throttle = np.where(x > threshold, 1.0, np.where(x < -threshold, 0.0, sigmoid))
+    brake = np.where(x < -threshold, 1.0, 0.0)
+    return throttle, brake
+
+
+def repulsive_forces(location, yaw, extent, distance_threshold=20.0, gain=2500.0, lateral_margin=0.5, min_gap=0.5,
+                     block=256):
+    '''
+    compute the repulsive force of every vehicle from the vehicles ahead of it
+    location: (n, 2) or (n, 3) world positions
+    yaw: (n,) degrees
+    extent: (n, 3) half extents of the bounding boxes
+    distance_threshold: gaps beyond this push back with 0
+    lateral_margin: a vehicle is ahead when it overlaps the own width widened by this much on both sides
+    block: rows of the (n, n) arrays computed at once, bounds the memory for large n
+    return: (n,) forces, >= 0
+    '''
+    location = np.asarray(location, dtype=np.float64)[:, :2]
+    extent = np.asarray(extent, dtype=np.float64)
+    theta = np.radians(yaw)
+    cos, sin = np.cos(theta), np.sin(theta)
+    n = location.shape[0]
+    force = np.zeros(n)
+    for start in range(0, n, block):
+        rows = slice(start, min(start + block, n))
+        # every other vehicle in the frame of each vehicle of the block, (b, n)
+        dx = location[None, :, 0] - location[rows, 0, None]
+        dy = location[None, :, 1] - location[rows, 1, None]
+        ahead = cos[rows, None] * dx + sin[rows, None] * dy
+        side = cos[rows, None] * dy - sin[rows, None] * dx
+        gap = np.maximum(ahead - extent[rows, 0, None] - extent[None, :, 0], min_gap)
+        corridor = np.abs(side) < extent[rows, 1, None] + extent[None, :, 1] + lateral_margin
+        near = (ahead > 0) & corridor & (gap < distance_threshold)
+        near[np.arange(rows.stop - start), np.arange(start, rows.stop)] = False
+        # the force along the heading, the vehicle ahead pushes back in proportion to its bearing's cosine
+        distance = np.hypot(ahead, side)
+        potential = gain * (1.0 / gap - 1.0 / distance_threshold) / gap * ahead / np.maximum(distance, 1e-6)
+        force[rows] = np.sum(np.where(near, potential, 0.0), axis=1)
+    return force
+
+
+def pursuit_steer(location, yaw, extent, target):
+    '''
+    compute the steer towards a target point with pure pursuit
+    location, target: (n, 2) or (n, 3) world positions
+    yaw: (n,) degrees
+    return: (n,) steer, ranged [-1.0, 1.0]
+    '''
+    location = np.asarray(location, dtype=np.float64)
+    target = np.asarray(target, dtype=np.float64)
+    offset = target[:, :2] - location[:, :2]
+    bearing = np.arctan2(offset[:, 1], offset[:, 0]) - np.radians(yaw)
+    lookahead = np.maximum(np.hypot(offset[:, 0], offset[:, 1]), 1e-6)
+    wheelbase = 2.0 * WHEELBASE_RATIO * np.asarray(extent, dtype=np.float64)[:, 0]
+    angle = np.arctan2(2.0 * wheelbase * np.sin(bearing), lookahead)
+    return np.clip(angle / MAX_STEER_ANGLE, -1.0, 1.0)
+
+
+class FleetAPF(object):
+    """Throttle, brake and steer of the driven vehicles of an ActorStateTable"""
+
+    def __init__(self, attr=2.0, threshold=4.0, distance_threshold=20.0, gain=2500.0, lookahead=8.0):
+        '''
+        attr, threshold: attractive force and saturation of the throttle law
+        distance_threshold, gain: reach and strength of the repulsive potential
+        lookahead: meters to the lane waypoint the steering follows
+        '''
+        self.attr = attr
+        self.threshold = threshold
+        self.distance_threshold = distance_threshold
+        self.gain = gain
+        self.lookahead = lookahead
+        self.force = np.zeros(0)
+
+    def controls(self, states, targets, rows=None):
+        '''
+        states: ActorStateTable of all the vehicles that push
+        targets: (m, 2) or (m, 3) points each driven vehicle steers to
+        rows: (m,) rows of the driven vehicles in states, all of them if None
+        return: (m,) throttle, brake, steer
+        '''
+        force = repulsive_forces(states.location, states.yaw, states.extent, self.distance_threshold, self.gain)
+        driven = states if rows is None else states.select(rows)
+        self.force = force if rows is None else force[rows]
+        throttle, brake = throttle_control(self.force, self.attr, self.threshold)
+        steer = pursuit_steer(driven.location, driven.yaw, driven.extent, targets)
+        return throttle, brake, steer
+
+    def lane_targets(self, carla_map, states):
+        """Waypoint lookahead meters down the lane of every vehicle, its own location at a dead end"""
+        import carla
+        targets = np.array(states.location, dtype=np.float64)
+        for row, (x, y, z) in enumerate(states.location.tolist()):
+            waypoint = carla_map.get_waypoint(carla.Location(x, y, z))
+            ahead = waypoint.next(self.lookahead) if waypoint is not None else []
+            if ahead:
+                location = ahead[0].transform.location
+                targets[row] = location.x, location.y, location.z
+        return targets
+
+    def apply(self, client, carla_map, states, driven_ids=None):
+        '''
+        drive vehicles of the table for one tick, all controls in one batch
+        states: ActorStateTable of all the vehicles that push, e.g. every vehicle of the snapshot
+        driven_ids: ids of the vehicles to drive, the others are left to their own clients; all if None
+        return: (m,) throttle, brake, steer that were sent
+        '''
+        import carla
+        rows = None if driven_ids is None else np.flatnonzero(np.isin(states.ids, list(driven_ids)))
+        driven = states if rows is None else states.select(rows)
+        throttle, brake, steer = self.controls(states, self.lane_targets(carla_map, driven), rows)
+        client.apply_batch([
+            carla.command.ApplyVehicleControl(actor_id, carla.VehicleControl(throttle=t, steer=s, brake=b))
+            for actor_id, t, b, s in zip(driven.ids.tolist(), throttle.tolist(), brake.tolist(), steer.tolist())])
+        return throttle, brake, steer
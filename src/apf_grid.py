@@ -0,0 +1,184 @@
+"""Obstacle field of a static scene rasterized on a grid.
+
+APFPlanner.obstacle_sums splits the obstacle forces into sums that do not
+depend on the goal. ObstacleGrid samples them once over a road segment, a
+planning step then costs one bilinear lookup instead of a pass over all the
+obstacles. The attractive and road edge terms stay analytic, so the same grid
+serves any goal, and the total potential and force follow exactly from the
+interpolated sums.
+
+The sums grow like 1 / rho^2 towards an obstacle, which bilinear interpolation
+follows poorly: at 0.1 m cells the force is off by a few percent within 2 m of
+an obstacle and by orders of magnitude within 0.5 m, but by less than 0.2 %
+beyond 2 m. Cells within exact_radius of an obstacle are flagged, points in
+them and points off the grid fall back to the exact sums.
+
+Moving an obstacle re-samples only the cells within d0 of its old and its new
+position.
+"""
+
+import math
+
+import numpy as np
+
+CHANNELS = 3    # x and y of the sum of closeness / rho^3 * (position - obstacle), sum of closeness^2
+
+
+class ObstacleGrid(object):
+    """APFPlanner.obstacle_sums of a list of obstacles, sampled on a regular (x, y) grid"""
+
+    def __init__(self, planner, obstacles, x_range, y_range=None, resolution=0.1, exact_radius=2.0, dtype=np.float32,
+                 max_bytes=64 << 20, block_bytes=16 << 20):
+        '''
+        planner: APFPlanner, its d0 and gains are used
+        obstacles: (k, 2) points, extra columns are ignored
+        x_range, y_range: (low, high) extent of the grid in the road frame, y defaults to both lanes
+        resolution: cell size in meters, at 0.1 the force is within 0.2 % of the exact one beyond 2 m of the
+            obstacles, the error grows about with the square of the resolution
+        exact_radius: meters around every obstacle where the exact sums are used, 0 to interpolate everywhere
+        dtype: of the samples, float32 halves the memory of float64
+        max_bytes: larger grids are refused, coarsen the resolution or shorten the segment
+        block_bytes: temporaries of the sampling at most
+        '''
+        self.planner = planner
+        self.obstacles = np.array(obstacles, dtype=np.float64).reshape(-1, np.shape(obstacles)[-1])[:, :2]
+        if y_range is None:
+            y_range = (-planner.lane_width, planner.lane_width)
+        self.origin = np.array((x_range[0], y_range[0]), dtype=np.float64)
+        self._x0, self._y0 = float(x_range[0]), float(y_range[0])
+        self.resolution = float(resolution)
+        self.exact_radius = float(exact_radius)
+        nx = int(math.ceil((x_range[1] - x_range[0]) / resolution)) + 1
+        ny = int(math.ceil((y_range[1] - y_range[0]) / resolution)) + 1
+        size = nx * ny * CHANNELS * np.dtype(dtype).itemsize
+        if size > max_bytes:
+            raise ValueError('a %d x %d grid takes %.1f MB, more than max_bytes %.1f MB' % (
+                nx, ny, size / 1048576.0, max_bytes / 1048576.0))
+        self.block_bytes = block_bytes
+        self.values = np.zeros((nx, ny, CHANNELS), dtype=dtype)
+        self._flat = memoryview(self.values.reshape(-1))
+        self.near = np.zeros((nx, ny), dtype=bool)
+        self._near = memoryview(self.near.reshape(-1))
+        self._fill(slice(0, nx), slice(0, ny))
+
+    @property
+    def shape(self):
+        return self.values.shape[:2]
+
+    @property
+    def nbytes(self):
+        return self.values.nbytes
+
+    def move(self, index, position):
+        '''
+        move one obstacle and re-sample the cells it affects
+        position: (2,) new point
+        return: number of cells sampled
+        '''
+        old = self.obstacles[index].copy()
+        self.obstacles[index] = position[:2]
+        cells = 0
+        # the flags of the old position are cleared as well, the window covers them
+        reach = max(self.planner.d0, self.exact_radius + self.resolution) + self.resolution
+        for center in (old, self.obstacles[index]):
+            low = np.floor((center - reach - self.origin) / self.resolution).astype(int)
+            high = np.ceil((center + reach - self.origin) / self.resolution).astype(int) + 1
+            low = np.maximum(low, 0)
+            high = np.minimum(high, self.shape)
+            if np.all(high > low):
+                self._fill(slice(low[0], high[0]), slice(low[1], high[1]))
+                cells += int(np.prod(high - low))
+        return cells
+
+    def sample(self, x, y):
+        '''
+        interpolate the sums at one point
+        return: sum x, sum y, sum of squares as floats, None off the grid and near an obstacle
+        '''
+        nx, ny = self.shape
+        fx = (x - self._x0) / self.resolution
+        fy = (y - self._y0) / self.resolution
+        if not (0 <= fx <= nx - 1 and 0 <= fy <= ny - 1):
+            return None
+        ix, iy = min(int(fx), nx - 2), min(int(fy), ny - 2)
+        if self._near[ix * ny + iy]:
+            return None
+        tx, ty = fx - ix, fy - iy
+        w00, w01, w10, w11 = (1 - tx) * (1 - ty), (1 - tx) * ty, tx * (1 - ty), tx * ty
+        # indexing the flat memoryview gives python floats, much cheaper than numpy on a 2 x 2 window
+        v, a = self._flat, (ix * ny + iy) * CHANNELS
+        b, c = a + CHANNELS, a + ny * CHANNELS
+        d = c + CHANNELS
+        return (w00 * v[a] + w01 * v[b] + w10 * v[c] + w11 * v[d],
+                w00 * v[a + 1] + w01 * v[b + 1] + w10 * v[c + 1] + w11 * v[d + 1],
+                w00 * v[a + 2] + w01 * v[b + 2] + w10 * v[c + 2] + w11 * v[d + 2])
+
+    def lookup(self, points):
+        '''
+        interpolate the sums at many points, exact ones off the grid and near the obstacles
+        points: (..., 2)
+        return: (..., 2) sums, (...) sums of squares
+        '''
+        points = np.asarray(points, dtype=np.float64)
+        nx, ny = self.shape
+        f = (points - self.origin) / self.resolution
+        inside = (f[..., 0] >= 0) & (f[..., 0] <= nx - 1) & (f[..., 1] >= 0) & (f[..., 1] <= ny - 1)
+        ix = np.clip(f[..., 0].astype(np.int64), 0, nx - 2)
+        iy = np.clip(f[..., 1].astype(np.int64), 0, ny - 2)
+        inside &= ~self.near[ix, iy]
+        tx = np.clip(f[..., 0] - ix, 0, 1)[..., None]
+        ty = np.clip(f[..., 1] - iy, 0, 1)[..., None]
+        v = self.values
+        values = (v[ix, iy] * (1 - tx) + v[ix + 1, iy] * tx) * (1 - ty) + \
+            (v[ix, iy + 1] * (1 - tx) + v[ix + 1, iy + 1] * tx) * ty
+        values = values.astype(np.float64)
+        if not np.all(inside):
+            sums, squares = self.planner.obstacle_sums(points[~inside], self.obstacles)
+            values[~inside] = np.concatenate((sums, squares[..., None]), axis=-1)
+        return values[..., :2], values[..., 2]
+
+    def force(self, points, goal):
+        """APFPlanner.force from the grid"""
+        sums, squares = self.lookup(points)
+        return self.planner.force_from_sums(points, goal, sums, squares)
+
+    def potential(self, points, goal):
+        """APFPlanner.potential from the grid"""
+        _, squares = self.lookup(points)
+        return self.planner.potential_from_sums(points, goal, squares)
+
+    def plan(self, start, goal):
+        """APFPlanner.plan with grid lookups"""
+        return self.planner.plan(start, goal, self.obstacles, field=self)
+
+    def _fill(self, rows, columns):
+        """Samples the exact sums on a window of cells, a block of rows at a time"""
+        ys = self.origin[1] + self.resolution * np.arange(columns.start, columns.stop)
+        # the largest temporary is (rows, columns, obstacles, 2) float64
+        per_row = max(1, ys.shape[0] * max(1, self.obstacles.shape[0]) * 2 * 8 * 2)
+        block = max(1, self.block_bytes // per_row)
+        for start in range(rows.start, rows.stop, block):
+            stop = min(start + block, rows.stop)
+            xs = self.origin[0] + self.resolution * np.arange(start, stop)
+            points = np.stack(np.meshgrid(xs, ys, indexing='ij'), axis=-1)
+            sums, squares = self.planner.obstacle_sums(points, self.obstacles)
+            self.values[start:stop, columns, :2] = sums
+            self.values[start:stop, columns, 2] = squares
+        self._flag_near(rows, columns)
+
+    def _flag_near(self, rows, columns):
+        """Flags the cells of a window whose interpolation window comes within exact_radius of an obstacle"""
+        self.near[rows, columns] = False
+        if self.exact_radius <= 0:
+            return
+        reach = self.exact_radius + 1.5 * self.resolution
+        for x, y in self.obstacles.tolist():
+            low_x = max(rows.start, int(math.ceil((x - reach - self._x0) / self.resolution)))
+            high_x = min(rows.stop, int(math.floor((x + reach - self._x0) / self.resolution)) + 1)
+            low_y = max(columns.start, int(math.ceil((y - reach - self._y0) / self.resolution)))
+            high_y = min(columns.stop, int(math.floor((y + reach - self._y0) / self.resolution)) + 1)
+            if low_x >= high_x or low_y >= high_y:
+                continue
+            dx = self._x0 + self.resolution * np.arange(low_x, high_x) - x
+            dy = self._y0 + self.resolution * np.arange(low_y, high_y) - y
+            self.near[low_x:high_x, low_y:high_y] |= dx[:, None] ** 2 + dy[None, :] ** 2 <= reach * reach
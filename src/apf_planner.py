@@ -0,0 +1,277 @@
+"""Artificial potential field (APF) path planner on a straight two lane road.
+
+The road frame has x along the road and y across it, the lane divider on y = 0
+and the two lanes of width lane_width on either side. A point vehicle is
+pulled to the goal and pushed away from the obstacles and the road edges:
+
+    attractive      eta_att * (goal - p)
+    obstacle        for every obstacle closer than d0, away from it
+                    eta_rep_ob * (1 / rho - 1 / d0) * rho_g^n / rho^2
+                    plus towards the goal, so the goal is reachable next to an obstacle
+                    n / 2 * eta_rep_ob * (1 / rho - 1 / d0)^2 * rho_g^(n - 1)
+    road edge       across the road only, always towards the centre of the own lane and 0 on it,
+                    exponential in the outer half of a lane, quadratic in the inner half
+
+rho is the distance to an obstacle and rho_g to the goal. Every step moves
+step meters along the total force, the forces of all obstacles are one array
+expression.
+
+Where the forces cancel the planner stalls or oscillates in place. The net
+displacement over the last `window` steps detects it, then one of the escapes
+runs:
+
+    virtual     an obstacle is added next to where the vehicle got stuck, for the rest of the plan
+    random      escape_steps steps with a random direction added to the force
+    wall        up to escape_steps steps along the obstacles' equipotential, on the side facing
+                the goal, until the obstacles no longer push away from the goal
+
+After max_escapes escapes a stall ends the plan, so a plan never costs more than
+it takes to notice that the goal is out of reach.
+"""
+
+import collections
+import math
+
+import numpy as np
+
+Plan = collections.namedtuple('Plan', [
+    'path',         # (m, 2) positions from the start, the last one within step of the goal if converged
+    'converged',    # the goal was reached
+    'iterations',   # steps taken
+    'escapes',      # local minima escaped from
+])
+ESCAPES = ('virtual', 'random', 'wall')
+
+
+class APFPlanner(object):
+    """Gains and road of the classic APF lane change planner"""
+
+    def __init__(self, eta_att=5.0, eta_rep_ob=15.0, eta_rep_edge=50.0, d0=20.0, step=0.5, max_iter=300,
+                 lane_width=3.5, vehicle_width=1.8, speed=1.0, n=1, escape='virtual', window=10, min_progress=0.25,
+                 max_escapes=5, escape_steps=20, seed=None):
+        '''
+        eta_att, eta_rep_ob, eta_rep_edge: gains of the attractive, obstacle and road edge forces
+        d0: obstacles farther than this do not push
+        step: meters moved per iteration
+        max_iter: iterations at most
+        speed: of the vehicle, scales the exponential road edge force
+        n: exponent of the goal distance in the obstacle force
+        escape: one of ESCAPES, or None to stop at the first stall
+        window, min_progress: a stall is less than min_progress * window * step of progress over window steps
+        max_escapes: escapes per plan, the next stall ends it
+        escape_steps: steps of a random or wall escape
+        seed: of the random escape
+        '''
+        if escape is not None and escape not in ESCAPES:
+            raise ValueError('unknown escape %r, expected one of %s' % (escape, ', '.join(ESCAPES)))
+        self.eta_att = eta_att
+        self.eta_rep_ob = eta_rep_ob
+        self.eta_rep_edge = eta_rep_edge
+        self.d0 = d0
+        self.step = step
+        self.max_iter = max_iter
+        self.lane_width = lane_width
+        self.vehicle_width = vehicle_width
+        self.speed = speed
+        self.n = n
+        self.escape = escape
+        self.window = window
+        self.min_progress = min_progress
+        self.max_escapes = max_escapes
+        self.escape_steps = escape_steps
+        self.rng = np.random.default_rng(seed)
+
+    def force(self, position, goal, obstacles):
+        '''
+        compute the total force
+        position: (..., 2) points in the road frame
+        goal: (2,) point
+        obstacles: (k, 2) points
+        return: (..., 2) forces
+        '''
+        sums, squares = self.obstacle_sums(position, obstacles)
+        return self.force_from_sums(position, goal, sums, squares)
+
+    def potential(self, position, goal, obstacles):
+        '''
+        compute the total potential, force is its negative gradient
+        return: (...) potentials
+        '''
+        _, squares = self.obstacle_sums(position, obstacles)
+        return self.potential_from_sums(position, goal, squares)
+
+    def obstacle_sums(self, position, obstacles, mask=None):
+        '''
+        compute the part of the obstacle forces that does not depend on the goal
+        position: (..., 2) points
+        obstacles: (k, 2) points, or (..., k, 2) obstacles of every point
+        mask: optional boolean (..., k), the obstacles that are False are ignored
+        return: (..., 2) sums of closeness / rho^3 * (position - obstacle), (...) sums of closeness^2,
+                closeness being 1 / rho - 1 / d0 within d0 of an obstacle and 0 beyond
+        '''
+        away = np.asarray(position, dtype=np.float64)[..., None, :] - np.asarray(obstacles, dtype=np.float64)
+        rho = np.maximum(np.sqrt(np.sum(away * away, axis=-1)), 1e-9)
+        closeness = np.maximum(1.0 / rho - 1.0 / self.d0, 0.0)
+        if mask is not None:
+            closeness = np.where(mask, closeness, 0.0)
+        return np.sum((closeness / (rho * rho * rho))[..., None] * away, axis=-2), np.sum(closeness * closeness, axis=-1)
+
+    def force_from_sums(self, position, goal, sums, squares):
+        '''
+        compute the total force from the obstacle sums of the positions
+        return: (..., 2) forces
+        '''
+        position = np.asarray(position, dtype=np.float64)
+        to_goal = np.asarray(goal, dtype=np.float64) - position
+        rho_g = np.maximum(np.sqrt(np.sum(to_goal * to_goal, axis=-1)), 1e-9)
+        push = (self.eta_rep_ob * rho_g ** self.n)[..., None] * sums
+        pull = (0.5 * self.n * self.eta_rep_ob * squares * rho_g ** (self.n - 2))[..., None] * to_goal
+        total = self.eta_att * to_goal + push + pull
+        total[..., 1] += self.edge_force(position[..., 1])
+        return total
+
+    def potential_from_sums(self, position, goal, squares):
+        '''
+        compute the total potential from the obstacle sums of squares of the positions
+        return: (...) potentials
+        '''
+        position = np.asarray(position, dtype=np.float64)
+        to_goal = np.asarray(goal, dtype=np.float64) - position
+        rho_g2 = np.sum(to_goal * to_goal, axis=-1)
+        return 0.5 * self.eta_att * rho_g2 + 0.5 * self.eta_rep_ob * squares * rho_g2 ** (0.5 * self.n) + \
+            self.edge_potential(position[..., 1])
+
+    def edge_force(self, y, lane_width=None):
+        '''
+        compute the force of the road edges across the road
+        y: (...) lateral positions
+        lane_width: optional (...) lane widths of the positions, defaults to the planner's
+        return: (...) forces along y, 0 on the lane centres and where the vehicle straddles an edge or the divider
+        '''
+        y = np.asarray(y, dtype=np.float64)
+        d, half = self.lane_width if lane_width is None else np.asarray(lane_width), 0.5 * self.vehicle_width
+        side = np.abs(y)
+        # from the edge or from the divider, back to the lane centre
+        off = side - 0.5 * d
+        outer = (0.0 < off) & (side <= d - half)
+        inner = (half < side) & (off <= 0.0)
+        magnitude = np.where(outer, self.eta_rep_edge * self.speed * np.expm1(off),
+                             np.where(inner, -self.eta_rep_edge * off * off / 3.0, 0.0))
+        return -np.sign(y) * magnitude
+
+    def edge_potential(self, y, lane_width=None):
+        '''
+        compute the potential of the road edges, edge_force is its negative derivative
+        y: (...) lateral positions
+        lane_width: optional (...) lane widths of the positions, defaults to the planner's
+        return: (...) potentials, 0 on the lane centres
+        '''
+        d, half = self.lane_width if lane_width is None else np.asarray(lane_width), 0.5 * self.vehicle_width
+        side = np.clip(np.abs(np.asarray(y, dtype=np.float64)), half, d - half)
+        inner = np.maximum(0.5 * d - side, 0.0)
+        outer = np.maximum(side - 0.5 * d, 0.0)
+        return self.eta_rep_edge * (inner ** 3 / 9.0 + self.speed * (np.expm1(outer) - outer))
+
+    def plan(self, start, goal, obstacles, field=None):
+        '''
+        follow the normalized force from start until the goal is within one step
+        start, goal: (2,) points in the road frame
+        obstacles: (k, 2) points, extra columns are ignored
+        field: optional apf_grid.ObstacleGrid of these obstacles, its lookups replace the obstacle sums inside it
+        return: Plan
+        '''
+        gx, gy = float(goal[0]), float(goal[1])
+        obstacles = np.asarray(obstacles, dtype=np.float64).reshape(-1, np.shape(obstacles)[-1])
+        # points as complex numbers, the obstacle forces of a step are a handful of operations on one array
+        others = obstacles[:, 0] + 1j * obstacles[:, 1]
+        virtual = np.zeros(0, dtype=np.complex128)
+        step2 = self.step * self.step
+        stall2 = (self.min_progress * self.window * self.step) ** 2
+        path = np.empty((self.max_iter + 1, 2))
+        x, y = path[0] = float(start[0]), float(start[1])
+        escapes, watched, escaping, walk = 0, 0, 0, None
+        for i in range(self.max_iter):
+            dx, dy = gx - x, gy - y
+            rho_g2 = dx * dx + dy * dy
+            if rho_g2 <= step2:
+                return Plan(path[:i + 1], True, i, escapes)
+
+            # progress over the window, restarted after every escape
+            if escaping == 0 and watched >= self.window:
+                px, py = x - path[i - self.window, 0], y - path[i - self.window, 1]
+                if px * px + py * py < stall2:
+                    if self.escape is None or escapes == self.max_escapes:
+                        return Plan(path[:i + 1], False, i, escapes)
+                    escapes += 1
+                    watched = 0
+                    if self.escape == 'virtual':
+                        # beside the stall point, on a random side, so that a symmetric stall is broken as well
+                        center = path[i - self.window:i + 1].mean(axis=0)
+                        side = self.step * self.rng.choice((-1.0, 1.0)) / max(rho_g2 ** 0.5, 1e-9)
+                        virtual = np.append(virtual, complex(center[0] - side * dy, center[1] + side * dx))
+                    else:
+                        escaping = self.escape_steps
+                        if self.escape == 'random':
+                            walk = np.exp(1j * self.rng.uniform(-np.pi, np.pi, self.escape_steps))
+
+            sample = field.sample(x, y) if field is not None else None
+            if sample is None:
+                sx, sy, squares = self._sums_scalar(x, y, others)
+            else:
+                sx, sy, squares = sample
+            if virtual.shape[0]:
+                vx, vy, v2 = self._sums_scalar(x, y, virtual)
+                sx, sy, squares = sx + vx, sy + vy, squares + v2
+            rho_g = rho_g2 ** 0.5
+            scale = self.eta_rep_ob * rho_g ** self.n
+            push_x, push_y = scale * sx, scale * sy
+            pull = 0.5 * self.n * squares * scale / rho_g2
+            fx = self.eta_att * dx + push_x + pull * dx
+            fy = self.eta_att * dy + self._edge_scalar(y) + push_y + pull * dy
+
+            if escaping:
+                escaping -= 1
+                if self.escape == 'random':
+                    # the forces still keep the vehicle off the obstacles, the walk only shakes it loose
+                    norm = (fx * fx + fy * fy) ** 0.5
+                    if norm < 1e-12:
+                        fx, fy = walk[escaping].real, walk[escaping].imag
+                    else:
+                        fx, fy = fx / norm + walk[escaping].real, fy / norm + walk[escaping].imag
+                elif push_x * dx + push_y * dy <= 0:
+                    # perpendicular to the push of the obstacles, until they stop standing between vehicle and goal
+                    nx, ny = (push_x, push_y) if push_x * push_x + push_y * push_y > 1e-24 else (fx, fy)
+                    fx, fy = (-ny, nx) if nx * dy - ny * dx > 0 else (ny, -nx)
+                else:
+                    escaping = 0
+            norm = (fx * fx + fy * fy) ** 0.5
+            if norm < 1e-12:
+                return Plan(path[:i + 1], False, i, escapes)
+            x += self.step * fx / norm
+            y += self.step * fy / norm
+            path[i + 1] = x, y
+            watched += 1
+        dx, dy = gx - x, gy - y
+        return Plan(path, dx * dx + dy * dy <= step2, self.max_iter, escapes)
+
+    def _sums_scalar(self, x, y, others):
+        """obstacle_sums of one position, others are the obstacles as complex numbers"""
+        if others.shape[0] == 0:
+            return 0.0, 0.0, 0.0
+        away = complex(x, y) - others
+        rho = np.maximum(np.abs(away), 1e-9)
+        closeness = np.maximum(1.0 / rho - 1.0 / self.d0, 0.0)
+        sums = complex(np.dot(closeness / (rho * rho * rho), away))
+        return sums.real, sums.imag, float(np.dot(closeness, closeness))
+
+    def _edge_scalar(self, y):
+        """edge_force of one lateral position, without the overhead of numpy on scalars"""
+        d, half, side = self.lane_width, 0.5 * self.vehicle_width, abs(y)
+        off = side - 0.5 * d
+        if 0.0 < off and side <= d - half:
+            magnitude = self.eta_rep_edge * self.speed * math.expm1(off)
+        elif half < side and off <= 0.0:
+            magnitude = -self.eta_rep_edge * off * off / 3.0
+        else:
+            return 0.0
+        return -magnitude if y > 0 else magnitude
@@ -0,0 +1,334 @@
+#!/usr/bin/env python
+
+"""Sweep the APF gains and throttle law over a grid or a Latin hypercube of parameters.
+
+Two modes:
+
+    planner   APFPlanner on the lane change scene of self_driving_copy.py (ground truth
+              obstacles), parameters eta_att, eta_rep_ob, eta_rep_edge, d0, step, n
+    replay    recorded lidar frames through the SemanticLidarSensor pipeline once, then the
+              force filter and throttle law of every parameter set, parameters attr,
+              threshold (SemanticLidarSensor._vehicle_throttle_control) and window (median filter)
+
+Parameters are given as name=start:stop:num (linspace) or name=a,b,c for a grid,
+name=start:stop with --lhs N for a Latin hypercube of N runs. The runs go to a
+process pool, every finished run is appended to the csv right away and runs
+already in the csv are skipped, so an interrupted sweep resumes where it
+stopped.
+
+    python apf_sweep.py planner --param eta_att=2:8:4 --param d0=10:30:5 -o planner.csv
+    python apf_sweep.py planner --lhs 500 --param eta_rep_ob=5:50 --param eta_rep_edge=10:100 -o lhs.csv
+    python apf_sweep.py replay data.pkl --param attr=0:4:5 --param threshold=2:8:4 -o replay.csv
+"""
+
+import argparse
+import concurrent.futures
+import csv
+import itertools
+import logging
+import os
+import time
+
+import numpy as np
+
+from apf_fleet import throttle_control
+from apf_planner import APFPlanner
+from streaming_filters import RollingMedian
+
+# lane change scene of self_driving_copy.py, road frame
+LANE_WIDTH = 3.5
+VEHICLE_WIDTH = 1.8
+OBSTACLES = np.array([[15, 7 / 4], [30, -3 / 2], [45, 3 / 2], [60, -3 / 4], [80, 3 / 2]])
+START = (0.0, -LANE_WIDTH / 4)
+GOAL = (99.0, LANE_WIDTH / 4)
+
+PLANNER_PARAMS = dict(eta_att=5.0, eta_rep_ob=15.0, eta_rep_edge=50.0, d0=20.0, step=0.5, n=1)
+PLANNER_METRICS = ('converged', 'iterations', 'escapes', 'path_length', 'min_clearance', 'jerk', 'seconds')
+REPLAY_PARAMS = dict(attr=2.0, threshold=4.0, window=11)
+REPLAY_METRICS = ('frames', 'mean_throttle', 'brake_ratio', 'switches', 'jerk', 'min_clearance', 'seconds')
+
+
+# ==============================================================================
+# -- sampling ------------------------------------------------------------------
+# ==============================================================================
+
+
+def parse_param(spec):
+    '''
+    parse name=start:stop[:num] or name=a,b,c
+    return: name, list of values or (start, stop) range
+    '''
+    name, _, values = spec.partition('=')
+    if not values:
+        raise ValueError('parameter %r should be name=start:stop[:num] or name=a,b,c' % spec)
+    if ',' in values:
+        return name, [float(v) for v in values.split(',')]
+    bounds = [float(v) for v in values.split(':')]
+    if len(bounds) == 3:
+        return name, list(np.linspace(bounds[0], bounds[1], int(bounds[2])))
+    if len(bounds) == 2:
+        return name, tuple(bounds)
+    return name, [bounds[0]]
+
+
+def grid_runs(params):
+    """Every combination of the listed values"""
+    names = list(params)
+    for values in params.values():
+        if isinstance(values, tuple):
+            raise ValueError('a grid needs start:stop:num or a list of values, use --lhs for ranges')
+    return [dict(zip(names, combination)) for combination in itertools.product(*params.values())]
+
+
+def lhs_runs(params, count, seed=0):
+    """Latin hypercube of count runs over the (start, stop) ranges, a list of values is picked from at random"""
+    rng = np.random.default_rng(seed)
+    columns = {}
+    for name, values in params.items():
+        # one sample in each of count equal strata, the strata shuffled per parameter
+        u = (rng.permutation(count) + rng.uniform(size=count)) / count
+        if isinstance(values, tuple):
+            columns[name] = values[0] + u * (values[1] - values[0])
+        else:
+            columns[name] = np.asarray(values)[np.minimum((u * len(values)).astype(int), len(values) - 1)]
+    return [{name: float(columns[name][i]) for name in params} for i in range(count)]
+
+
+# ==============================================================================
+# -- runs ----------------------------------------------------------------------
+# ==============================================================================
+
+
+def run_planner(params):
+    '''
+    plan the lane change scene with one set of parameters
+    return: dict of PLANNER_METRICS
+    '''
+    values = dict(PLANNER_PARAMS, **params)
+    values['n'] = int(round(values['n']))
+    planner = APFPlanner(lane_width=LANE_WIDTH, vehicle_width=VEHICLE_WIDTH, seed=0, **values)
+    started = time.perf_counter()
+    plan = planner.plan(START, GOAL, OBSTACLES)
+    seconds = time.perf_counter() - started
+    path = plan.path
+    steps = np.diff(path, axis=0)
+    clearance = np.sqrt(np.min(np.sum((path[:, None, :] - OBSTACLES[None]) ** 2, axis=-1)))
+    # third difference of positions sampled every step, jerk per step^3 of travel
+    third = np.diff(path, n=3, axis=0)
+    jerk = float(np.sqrt(np.mean(np.sum(third * third, axis=1)))) if third.shape[0] else 0.0
+    return dict(converged=int(plan.converged), iterations=plan.iterations, escapes=plan.escapes,
+                path_length=float(np.sum(np.hypot(steps[:, 0], steps[:, 1]))), min_clearance=float(clearance),
+                jerk=jerk, seconds=seconds)
+
+
+_replay_forces = None
+_replay_nearest = None
+
+
+def _init_replay(forces, nearest):
+    """Pool initializer, the frames are processed once and shared by every run of a worker"""
+    global _replay_forces, _replay_nearest
+    _replay_forces, _replay_nearest = forces, nearest
+
+
+def run_replay(params):
+    '''
+    filter the replayed forces and apply the throttle law with one set of parameters
+    return: dict of REPLAY_METRICS
+    '''
+    values = dict(REPLAY_PARAMS, **params)
+    started = time.perf_counter()
+    median = RollingMedian(int(round(values['window'])))
+    filtered = np.array([median.update(force) for force in _replay_forces.tolist()])
+    throttle, brake = throttle_control(filtered, values['attr'], values['threshold'])
+    seconds = time.perf_counter() - started
+    command = throttle - brake
+    third = np.diff(command, n=3)
+    return dict(frames=len(command), mean_throttle=float(np.mean(throttle)) if len(command) else 0.0,
+                brake_ratio=float(np.mean(brake > 0)) if len(command) else 0.0,
+                switches=int(np.sum(np.diff(brake > 0))),
+                jerk=float(np.sqrt(np.mean(third * third))) if third.shape[0] else 0.0,
+                min_clearance=float(np.min(_replay_nearest)) if len(_replay_nearest) else float('inf'),
+                seconds=seconds)
+
+
+def _run_chunk(args):
+    mode, chunk = args
+    run = run_planner if mode == 'planner' else run_replay
+    return [(index, params, run(params)) for index, params in chunk]
+
+
+def replay_forces(paths, extent):
+    '''
+    push recorded frames through SemanticLidarSensor once
+    return: (frames,) raw repulsive forces, (frames,) distance of the nearest vehicle point
+    '''
+    # only this mode needs the CARLA client scripts
+    import lidar_apf
+    from lidar_replay import ReplayVehicle, load_frames, replay
+    from manual_control_joystick import SemanticLidarSensor
+
+    frames = list(itertools.chain.from_iterable(load_frames(path) for path in paths))
+    lidar = SemanticLidarSensor(ReplayVehicle(tuple(extent)), 'Semantic Lidar Sweep', visualize=False, threaded=False)
+    results = replay(lidar, frames)
+    nearest = []
+    for data in frames:
+        objects = lidar_apf.vehicle_forces(data, lidar.bbox).objects
+        nearest.append(float(np.min(objects.nearest)) if len(objects.nearest) else float('inf'))
+    lidar.sensor.destroy()
+    return results['force'], np.array(nearest)
+
+
+# ==============================================================================
+# -- results -------------------------------------------------------------------
+# ==============================================================================
+
+
+def drop_partial_row(path):
+    '''
+    cut a row that a killed sweep left half written, so appends start on a fresh line
+    return: bytes dropped
+    '''
+    if not os.path.exists(path) or os.path.getsize(path) == 0:
+        return 0
+    with open(path, 'rb+') as f:
+        size = f.seek(0, os.SEEK_END)
+        end = size
+        # rows are short, look back in small blocks for the last newline
+        while end > 0:
+            start = max(0, end - 4096)
+            f.seek(start)
+            block = f.read(end - start)
+            newline = block.rfind(b'\n')
+            if newline >= 0:
+                end = start + newline + 1
+                break
+            end = start
+        f.truncate(end)
+    return size - end
+
+
+def completed_runs(path, names):
+    '''
+    read the runs already in a result table, rows with missing or unparsable fields are left to be run again
+    return: {run index: parameter values}
+    '''
+    if not os.path.exists(path) or os.path.getsize(path) == 0:
+        return {}
+    with open(path, newline='') as f:
+        reader = csv.DictReader(f)
+        missing = [name for name in names if name not in (reader.fieldnames or ())]
+        if missing:
+            raise ValueError('%s was written by another sweep, it has no column %s' % (path, ', '.join(missing)))
+        runs = {}
+        for row in reader:
+            if None in row or None in row.values():
+                continue
+            try:
+                runs[int(row['run'])] = tuple(float(row[name]) for name in names)
+            except ValueError:
+                continue
+        return runs
+
+
+def main():
+    argparser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    argparser.add_argument(
+        'mode',
+        choices=['planner', 'replay'],
+        help='sweep the planner gains, or the throttle law over replayed lidar frames')
+    argparser.add_argument(
+        'frames',
+        nargs='*',
+        help='lidar recordings or pickled frames of the replay mode')
+    argparser.add_argument(
+        '-p', '--param',
+        action='append',
+        default=[],
+        metavar='SPEC',
+        help='name=start:stop:num or name=a,b,c; name=start:stop with --lhs')
+    argparser.add_argument(
+        '--lhs',
+        metavar='N',
+        type=int,
+        help='sample N runs from a Latin hypercube instead of the full grid')
+    argparser.add_argument(
+        '--seed',
+        default=0,
+        type=int,
+        help='seed of the Latin hypercube (default: 0)')
+    argparser.add_argument(
+        '-j', '--workers',
+        default=os.cpu_count() or 1,
+        type=int,
+        help='processes (default: all cores, %(default)s)')
+    argparser.add_argument(
+        '--chunk',
+        default=16,
+        type=int,
+        help='runs per task handed to a worker (default: 16)')
+    argparser.add_argument(
+        '--extent',
+        nargs=3,
+        default=(2.39588976, 1.081725, 0.74383003),
+        type=float,
+        metavar=('X', 'Y', 'Z'),
+        help='bounding box extent of the own vehicle in the replay mode (default: Tesla Model 3)')
+    argparser.add_argument(
+        '-o', '--out',
+        default='apf_sweep.csv',
+        metavar='PATH',
+        help='result table, runs already in it are skipped (default: apf_sweep.csv)')
+    args = argparser.parse_args()
+
+    logging.basicConfig(format='%(levelname)s: %(message)s', level=logging.INFO)
+    defaults, metrics = (PLANNER_PARAMS, PLANNER_METRICS) if args.mode == 'planner' else (REPLAY_PARAMS, REPLAY_METRICS)
+    params = dict(parse_param(spec) for spec in args.param)
+    unknown = set(params) - set(defaults)
+    if unknown:
+        argparser.error('unknown %s parameters %s, expected some of %s' % (
+            args.mode, ', '.join(sorted(unknown)), ', '.join(defaults)))
+    if args.mode == 'replay' and not args.frames:
+        argparser.error('the replay mode needs lidar frames')
+    runs = lhs_runs(params, args.lhs, args.seed) if args.lhs else grid_runs(params)
+    names = list(params)
+
+    if drop_partial_row(args.out):
+        logging.warning('dropped the half written last row of %s', args.out)
+    done = completed_runs(args.out, names)
+    for index, values in done.items():
+        if index < len(runs) and not np.allclose(values, [runs[index][name] for name in names]):
+            raise SystemExit('%s holds run %d with other parameters, write to another file' % (args.out, index))
+    pending = [(index, params) for index, params in enumerate(runs) if index not in done]
+    logging.info('%d runs, %d done already, %d to go on %d workers', len(runs), len(done), len(pending), args.workers)
+    if not pending:
+        return
+
+    initializer, initargs = None, ()
+    if args.mode == 'replay':
+        initializer, initargs = _init_replay, replay_forces(args.frames, args.extent)
+    chunks = [(args.mode, pending[i:i + args.chunk]) for i in range(0, len(pending), args.chunk)]
+
+    started = time.perf_counter()
+    new_file = not os.path.exists(args.out) or os.path.getsize(args.out) == 0
+    with open(args.out, 'a', newline='') as f, \
+            concurrent.futures.ProcessPoolExecutor(args.workers, initializer=initializer, initargs=initargs) as pool:
+        writer = csv.writer(f)
+        if new_file:
+            writer.writerow(['run'] + names + list(metrics))
+        finished = 0
+        futures = [pool.submit(_run_chunk, chunk) for chunk in chunks]
+        for future in concurrent.futures.as_completed(futures):
+            rows = future.result()
+            for index, values, result in rows:
+                writer.writerow([index] + [values[name] for name in names] + [result[name] for name in metrics])
+            # every finished chunk goes to disk at once, an interrupted sweep only loses the running ones
+            f.flush()
+            finished += len(rows)
+            logging.info('%d / %d runs', finished, len(pending))
+    logging.info('swept %d runs in %.1f s, results in %s', len(pending), time.perf_counter() - started, args.out)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,72 @@
+#!/usr/bin/env python
+
+"""Benchmark the lidar force pipeline on the NumPy and the CuPy backend.
+
+The NumPy path never leaves the host. The CuPy path is the one the sensor
+callback used to take: copy the vehicle points to the device, compute there,
+and copy the points, colors and force back for Open3D and the controller.
+"""
+
+import argparse
+import pickle
+import time
+
+import numpy as np
+
+import apf_backend
+import lidar_apf
+
+MODEL3_BBOX = np.array([2.89588976, 1.581725, 1.24383003])
+
+
+def run_pipeline(data, colors):
+    """One callback worth of work, ending with host copies of everything the callback hands out"""
+    forces = lidar_apf.vehicle_forces(data, MODEL3_BBOX)
+    vehicle_color = lidar_apf.colorize(forces, colors)
+    return forces.force, apf_backend.asnumpy(forces.points), apf_backend.asnumpy(vehicle_color)
+
+
+def benchmark(backend, data, frames, warmup=10):
+    xp = apf_backend.select_backend(backend)
+    colors = xp.asarray(lidar_apf.VEHICLE_COLORS)
+    for _ in range(warmup):
+        run_pipeline(data, colors)
+    timings = np.empty(frames)
+    for i in range(frames):
+        start = time.perf_counter()
+        run_pipeline(data, colors)
+        timings[i] = time.perf_counter() - start
+    return timings * 1e3
+
+
+def main():
+    argparser = argparse.ArgumentParser(
+        description=__doc__)
+    argparser.add_argument(
+        '--data',
+        default='data.pkl',
+        help='pickled semantic lidar frame (default: data.pkl)')
+    argparser.add_argument(
+        '-n', '--frames',
+        default=1000,
+        type=int,
+        help='number of timed frames per backend (default: 1000)')
+    args = argparser.parse_args()
+
+    data = pickle.load(open(args.data, 'rb'))
+    print('%d points, %d vehicle points' % (data.shape[0], np.count_nonzero(data['ObjTag'] == lidar_apf.VEHICLE_TAG)))
+
+    backends = ['numpy']
+    if apf_backend.cupy is not None:
+        backends.append('cupy')
+    else:
+        print('cupy not found, skipping the host-device transfer path')
+
+    for backend in backends:
+        timings = benchmark(backend, data, args.frames)
+        print('%-6s mean %.3f ms  p50 %.3f ms  p95 %.3f ms  (%.0f frames/s)' % (
+            backend, timings.mean(), np.percentile(timings, 50), np.percentile(timings, 95), 1e3 / timings.mean()))
+
+
+if __name__ == '__main__':
+    main()
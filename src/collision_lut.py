@@ -0,0 +1,164 @@
+"""Precomputed collision probability over the relative pose of a traffic vehicle.
+
+For fixed vehicle dimensions and sigma the probability only depends on the
+position (x, y) of the traffic vehicle in the ego frame and its relative yaw.
+CollisionTable samples collision_probability on a regular (x, y, yaw) grid and
+answers queries by trilinear interpolation. The yaw axis covers [0, pi], the
+octagon repeats with a period of pi. Tables are cached on disk, keyed by their
+parameters, so the build cost is only paid once per configuration.
+"""
+
+import concurrent.futures
+import hashlib
+import logging
+import math
+import os
+import time
+
+import numpy as np
+
+from collision_probability import collision_probability
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'apf_collision_lut')
+
+
+class CollisionTable(object):
+    """Trilinear interpolation of collision_probability on a (x, y, yaw) grid"""
+
+    def __init__(self, table, extent, step, angle_step, params, max_error=float('nan')):
+        '''
+        table: (nx, ny, na) probabilities, x and y from -extent to extent, yaw from 0 to pi
+        params: dict of ego_len, ego_wid, traffic_len, traffic_wid and sigma
+        max_error: largest difference to the exact probability found by the builder
+        '''
+        self.table = table
+        self.extent = extent
+        self.step = step
+        self.angle_step = angle_step
+        self.params = params
+        self.max_error = max_error
+
+    @classmethod
+    def build(cls, ego_len=4.8, ego_wid=1.8, traffic_len=4.8, traffic_wid=1.8, sigma=1.0,
+              step=0.1, angle_step=math.radians(2.0), margin=6.0, workers=1, check_points=20000):
+        '''
+        sample the exact probability on the grid
+        margin: the grid reaches this many sigma beyond the octagon, the probability is 0 outside
+        workers: number of processes sampling yaw slices in parallel
+        check_points: random poses the table is checked against the exact probability
+        '''
+        params = dict(ego_len=ego_len, ego_wid=ego_wid, traffic_len=traffic_len, traffic_wid=traffic_wid, sigma=sigma)
+        # the octagon of any yaw fits in the circle through the corners of both boxes
+        reach = 0.5 * (math.hypot(ego_len, ego_wid) + math.hypot(traffic_len, traffic_wid)) + margin * sigma
+        n = int(math.ceil(reach / step))
+        extent = n * step
+        na = int(math.ceil(math.pi / angle_step))
+        angle_step = math.pi / na
+        axis = np.linspace(-extent, extent, 2 * n + 1)
+        angles = np.arange(na + 1) * angle_step
+
+        started = time.perf_counter()
+        if workers > 1:
+            with concurrent.futures.ProcessPoolExecutor(workers) as pool:
+                slices = list(pool.map(_build_slice, [(axis, angle, params) for angle in angles[:-1]]))
+        else:
+            slices = [_build_slice((axis, angle, params)) for angle in angles[:-1]]
+        # a yaw of pi is the same octagon as a yaw of 0
+        table = np.stack(slices + slices[:1], axis=-1).astype(np.float32)
+        elapsed = time.perf_counter() - started
+        lut = cls(table, extent, step, angle_step, params)
+
+        # trilinear interpolation is worst between the nodes, check random poses against the exact probability
+        rng = np.random.default_rng(0)
+        x, y = rng.uniform(-extent, extent, (2, check_points))
+        angle = rng.uniform(0.0, math.pi, check_points)
+        exact = collision_probability(x, y, angle, sigma=sigma, **_dimensions(params))
+        lut.max_error = float(np.max(np.abs(lut.lookup(x, y, angle) - exact)))
+        logging.info('collision table %s built in %.1f s, max error %.2e over %d random poses',
+                     table.shape, elapsed, lut.max_error, check_points)
+        return lut
+
+    @classmethod
+    def load_or_build(cls, cache_dir=DEFAULT_CACHE_DIR, **kwargs):
+        """Loads the table of these parameters from the cache, or builds and caches it"""
+        path = os.path.join(cache_dir, 'collision_lut_%s.npz' % _cache_key(kwargs))
+        if os.path.exists(path):
+            lut = cls.load(path)
+            logging.info('collision table loaded from %s, max error %.2e', path, lut.max_error)
+            return lut
+        lut = cls.build(**kwargs)
+        os.makedirs(cache_dir, exist_ok=True)
+        lut.save(path)
+        return lut
+
+    def save(self, path):
+        np.savez(path, table=self.table, extent=self.extent, step=self.step, angle_step=self.angle_step,
+                 max_error=self.max_error, **self.params)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as f:
+            params = {key: float(f[key]) for key in ('ego_len', 'ego_wid', 'traffic_len', 'traffic_wid', 'sigma')}
+            return cls(f['table'], float(f['extent']), float(f['step']), float(f['angle_step']), params,
+                       float(f['max_error']))
+
+    def lookup(self, x, y, angle):
+        '''
+        interpolate the probability of traffic vehicles at (x, y) in the ego frame
+        angle: yaw of the traffic vehicles relative to the ego vehicle, in radians
+        return: probability as a float, or an array of the broadcast shape of the arguments
+        '''
+        if np.ndim(x) == 0 and np.ndim(y) == 0 and np.ndim(angle) == 0:
+            return self._lookup_one(float(x), float(y), float(angle))
+        nx, ny, na = self.table.shape
+        fx = (np.asarray(x, dtype=np.float64) + self.extent) / self.step
+        fy = (np.asarray(y, dtype=np.float64) + self.extent) / self.step
+        fa = (np.asarray(angle, dtype=np.float64) % math.pi) / self.angle_step
+        outside = (fx < 0) | (fx > nx - 1) | (fy < 0) | (fy > ny - 1)
+
+        ix = np.clip(fx.astype(np.int64), 0, nx - 2)
+        iy = np.clip(fy.astype(np.int64), 0, ny - 2)
+        ia = np.clip(fa.astype(np.int64), 0, na - 2)
+        tx, ty, ta = np.clip(fx - ix, 0, 1), np.clip(fy - iy, 0, 1), fa - ia
+        t = self.table
+        lower = (t[ix, iy, ia] * (1 - tx) + t[ix + 1, iy, ia] * tx) * (1 - ty) + \
+            (t[ix, iy + 1, ia] * (1 - tx) + t[ix + 1, iy + 1, ia] * tx) * ty
+        upper = (t[ix, iy, ia + 1] * (1 - tx) + t[ix + 1, iy, ia + 1] * tx) * (1 - ty) + \
+            (t[ix, iy + 1, ia + 1] * (1 - tx) + t[ix + 1, iy + 1, ia + 1] * tx) * ty
+        return np.where(outside, 0.0, lower * (1 - ta) + upper * ta)
+
+    def _lookup_one(self, x, y, angle):
+        """Same as lookup for a single pose, without the overhead of numpy on scalars"""
+        nx, ny, na = self.table.shape
+        fx = (x + self.extent) / self.step
+        fy = (y + self.extent) / self.step
+        if not (0 <= fx <= nx - 1 and 0 <= fy <= ny - 1):
+            return 0.0
+        fa = (angle % math.pi) / self.angle_step
+        ix, iy, ia = min(int(fx), nx - 2), min(int(fy), ny - 2), min(int(fa), na - 2)
+        tx, ty, ta = fx - ix, fy - iy, fa - ia
+        c = self.table[ix:ix + 2, iy:iy + 2, ia:ia + 2].tolist()
+        lower = (c[0][0][0] * (1 - tx) + c[1][0][0] * tx) * (1 - ty) + (c[0][1][0] * (1 - tx) + c[1][1][0] * tx) * ty
+        upper = (c[0][0][1] * (1 - tx) + c[1][0][1] * tx) * (1 - ty) + (c[0][1][1] * (1 - tx) + c[1][1][1] * tx) * ty
+        return lower * (1 - ta) + upper * ta
+
+
+def _dimensions(params):
+    return {key: params[key] for key in ('ego_len', 'ego_wid', 'traffic_len', 'traffic_wid')}
+
+
+def _build_slice(args):
+    """Probabilities of one yaw over the (x, y) grid"""
+    axis, angle, params = args
+    x, y = np.meshgrid(axis, axis, indexing='ij')
+    return collision_probability(x, y, angle, sigma=params['sigma'], **_dimensions(params))
+
+
+def _cache_key(kwargs):
+    """Digest of the build parameters, defaults included"""
+    defaults = dict(ego_len=4.8, ego_wid=1.8, traffic_len=4.8, traffic_wid=1.8, sigma=1.0,
+                    step=0.1, angle_step=math.radians(2.0), margin=6.0)
+    defaults.update((key, value) for key, value in kwargs.items() if key in defaults)
+    # bumped when collision_probability changes, version 2 is the true Minkowski octagon
+    text = 'version=2,' + ','.join('%s=%.9g' % item for item in sorted(defaults.items()))
+    return hashlib.sha1(text.encode()).hexdigest()[:16]
@@ -0,0 +1,117 @@
+"""Probability that a traffic vehicle overlaps the ego vehicle.
+
+The position of the traffic vehicle in the ego frame is a 2-D Gaussian, the
+vehicles overlap when its center falls into the Minkowski octagon of the two
+bounding boxes. The Gaussian mass of a polygon is computed in closed form: the
+polygon is whitened, split into triangles fanning out of the mean, and every
+triangle is the difference of two right triangles whose mass is given by
+Owen's T function.
+
+The baseline integrated the same probability numerically over an octagon
+built with the traffic box turned by 90 degrees, a 6.6 x 6.6 m square for two
+aligned 4.8 x 1.8 m cars instead of their 9.6 x 3.6 m Minkowski sum. The
+octagon here is the true Minkowski sum, so the probabilities of side by side
+vehicles are lower than the baseline's.
+"""
+
+import math
+
+import numpy as np
+from scipy.special import owens_t
+
+_TINY = 1e-300
+
+
+def octagon_vertices(angle, ego_len=4.8, ego_wid=1.8, traffic_len=4.8, traffic_wid=1.8):
+    '''
+    compute the Minkowski octagons of the ego and the traffic bounding boxes, centered on the ego vehicle
+    angle: yaw of the traffic vehicle relative to the ego vehicle, in radians
+    all arguments are scalars or arrays broadcasting to a common shape (...)
+    return: (..., 8, 2) vertices, counter clockwise, aligned boxes give a rectangle with repeated edge points
+    '''
+    angle = np.asarray(angle, dtype=np.float64)
+    traffic_len = np.asarray(traffic_len, dtype=np.float64)
+    traffic_wid = np.asarray(traffic_wid, dtype=np.float64)
+    # the boxes are symmetric, a yaw in [pi/2, pi) is the box with length and width swapped turned by yaw - pi/2
+    angle = angle % math.pi
+    swap = angle >= 0.5 * math.pi
+    angle = np.where(swap, angle - 0.5 * math.pi, angle)
+    traffic_len, traffic_wid = np.where(swap, traffic_wid, traffic_len), np.where(swap, traffic_len, traffic_wid)
+
+    # with the traffic yaw in [0, pi/2) the edges of both boxes sorted by direction alternate, the traffic
+    # length axis u first; walk them from the corner that supports the direction just below that edge
+    c, s = np.cos(angle), np.sin(angle)
+    ux, uy = c * traffic_len, s * traffic_len           # traffic length edge
+    vx, vy = -s * traffic_wid, c * traffic_wid          # traffic width edge
+    x0 = 0.5 * (ego_len - ux - vx)
+    y0 = -0.5 * (ego_wid + uy + vy)
+    edges = ((ux, uy), (0.0, ego_wid), (vx, vy), (-ego_len, 0.0), (-ux, -uy), (0.0, -ego_wid), (-vx, -vy))
+
+    octagon = np.empty(np.broadcast(x0, y0, ux, vy).shape + (8, 2))
+    octagon[..., 0, 0] = x0
+    octagon[..., 0, 1] = y0
+    for i, (dx, dy) in enumerate(edges):
+        octagon[..., i + 1, 0] = octagon[..., i, 0] + dx
+        octagon[..., i + 1, 1] = octagon[..., i, 1] + dy
+    return octagon
+
+
+def polygon_probability(vertices, mean, sigma=1.0):
+    '''
+    compute the mass of 2-D Gaussians inside polygons
+    vertices: (..., k, 2) vertices of simple polygons, counter clockwise
+    mean: (..., 2) means of the Gaussians
+    sigma: standard deviations (...) of isotropic Gaussians, or (..., 2, 2) covariance matrices
+    return: probability as a float, or a (...) array for batched arguments, ranged [0.0, 1.0]
+    '''
+    points = np.asarray(vertices, dtype=np.float64) - np.asarray(mean, dtype=np.float64)[..., None, :]
+    sigma = np.asarray(sigma, dtype=np.float64)
+    if sigma.ndim < 2:
+        points = points / sigma[..., None, None]
+    else:
+        # whiten by the inverse of the Cholesky factor, the mass of the polygon is kept by the linear map
+        chol = np.linalg.cholesky(sigma)[..., None, :, :]
+        x = points[..., 0] / chol[..., 0, 0]
+        y = (points[..., 1] - chol[..., 1, 0] * x) / chol[..., 1, 1]
+        points = np.stack((x, y), axis=-1)
+    mass = _fan_mass(points, np.concatenate((points[..., 1:, :], points[..., :1, :]), axis=-2))
+    return float(mass) if mass.ndim == 0 else mass
+
+
+def collision_probability(x, y, angle, ego_len=4.8, ego_wid=1.8, traffic_len=4.8, traffic_wid=1.8, sigma=1.0):
+    '''
+    compute the probability that traffic vehicles at (x, y) in the ego frame overlap the ego vehicle
+    angle: yaw of the traffic vehicles relative to the ego vehicle, in radians
+    sigma: standard deviation of the positions, or (2, 2) covariance matrices
+    all arguments are scalars or arrays of N neighbours, evaluated in one vectorized pass
+    return: probability as a float, or an (N,) array, ranged [0.0, 1.0]
+    '''
+    octagon = octagon_vertices(angle, ego_len, ego_wid, traffic_len, traffic_wid)
+    mean = np.empty(np.broadcast(x, y).shape + (2,))
+    mean[..., 0] = x
+    mean[..., 1] = y
+    return polygon_probability(octagon, mean, sigma)
+
+
+def _fan_mass(start, end):
+    '''
+    sum the signed standard normal mass of the triangles (origin, start, end)
+    start, end: (..., k, 2) edges of whitened polygons
+    return: (...) polygon masses
+    '''
+    sx, sy, ex, ey = start[..., 0], start[..., 1], end[..., 0], end[..., 1]
+    dx, dy = ex - sx, ey - sy
+    length = np.maximum(np.hypot(dx, dy), _TINY)
+    cross = sx * ey - sy * ex
+    # distance of the origin to the edge's line, and the positions of the ends along it from the foot point,
+    # an edge through the origin gets h = _TINY and a mass of zero
+    h = np.maximum(np.abs(cross) / length, _TINY)
+    t_start = (sx * dx + sy * dy) / length
+    t_end = (ex * dx + ey * dy) / length
+    mass = _right_triangle_mass(h, t_end) - _right_triangle_mass(h, t_start)
+    return (np.sign(cross) * mass).sum(axis=-1)
+
+
+def _right_triangle_mass(h, t):
+    """Signed mass of the right triangle (origin, foot of the edge at distance h, point t along the edge)"""
+    return np.arctan2(t, h) / (2 * math.pi) - owens_t(h, t / h)
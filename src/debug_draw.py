@@ -0,0 +1,111 @@
+"""Collects world.debug draw calls and flushes them once per frame.
+
+Every carla.DebugHelper call is a round trip to the server. DebugDraw queues
+the requests of a frame and on flush():
+
+    - drops requests that repeat an item drawn before and still visible for
+      more than `refresh` seconds (same kind, rounded location, text, color)
+    - keeps the `max_per_flush` requests of highest priority, the rest is
+      dropped and counted
+    - issues the remaining calls together
+
+Requests may come from several threads (sensor callbacks and the game loop),
+flush() from one of them.
+"""
+
+import itertools
+import math
+import threading
+import time
+
+
+class DebugDraw(object):
+    """Per frame queue in front of a carla.DebugHelper"""
+
+    def __init__(self, debug, max_per_flush=100, refresh=0.1, quantum=0.05, clock=time.monotonic):
+        '''
+        debug: carla.DebugHelper, e.g. world.debug
+        max_per_flush: draw calls issued per flush at most
+        refresh: an item still visible for longer than this is not drawn again
+        quantum: locations are rounded to this many meters to recognise repeated items
+        '''
+        self.debug = debug
+        self.max_per_flush = max_per_flush
+        self.refresh = refresh
+        self.quantum = quantum
+        self.clock = clock
+        self.drawn = 0
+        self.skipped = 0        # repeated items that were still visible
+        self.dropped = 0        # requests over max_per_flush
+        self._pending = []
+        self._expiry = {}       # key -> time the last drawn item of this key disappears
+        self._lock = threading.Lock()
+        self._order = itertools.count()
+
+    def point(self, location, size=0.1, color=None, life_time=-1.0, persistent_lines=True, priority=0, key=None):
+        kwargs = dict(size=size, life_time=life_time, persistent_lines=persistent_lines)
+        self._queue('draw_point', (location,), kwargs, color, priority,
+                    key if key is not None else self._key('point', location, size, color))
+
+    def string(self, location, text, draw_shadow=False, color=None, life_time=-1.0, priority=0, key=None):
+        kwargs = dict(draw_shadow=draw_shadow, life_time=life_time)
+        self._queue('draw_string', (location, text), kwargs, color, priority,
+                    key if key is not None else self._key('string', location, text, color))
+
+    def line(self, begin, end, thickness=0.1, color=None, life_time=-1.0, persistent_lines=True, priority=0,
+             key=None):
+        kwargs = dict(thickness=thickness, life_time=life_time, persistent_lines=persistent_lines)
+        self._queue('draw_line', (begin, end), kwargs, color, priority,
+                    key if key is not None else self._key('line', begin, self._rounded(end), thickness, color))
+
+    def flush(self):
+        '''
+        issue the queued requests of this frame
+        return: number of draw calls made
+        '''
+        with self._lock:
+            pending, self._pending = self._pending, []
+        now = self.clock()
+
+        # one request per key, the most important one
+        requests = {}
+        for request in pending:
+            key = request[3]
+            if key not in requests or request[0] > requests[key][0]:
+                requests[key] = request
+        fresh = [r for r in requests.values() if self._expiry.get(r[3], -math.inf) - now <= self.refresh]
+        self.skipped += len(pending) - len(fresh)
+        fresh.sort(key=lambda r: (-r[0], r[1]))
+        self.dropped += max(0, len(fresh) - self.max_per_flush)
+
+        for _, _, method, key, args, kwargs in fresh[:self.max_per_flush]:
+            getattr(self.debug, method)(*args, **kwargs)
+            life_time = kwargs['life_time']
+            # a negative life time is permanent, 0 lasts one frame
+            self._expiry[key] = math.inf if life_time < 0 else now + life_time
+        drawn = min(len(fresh), self.max_per_flush)
+        self.drawn += drawn
+
+        if len(self._expiry) > 8 * self.max_per_flush:
+            self._expiry = {key: expiry for key, expiry in self._expiry.items() if expiry > now}
+        return drawn
+
+    def _queue(self, method, args, kwargs, color, priority, key):
+        if color is not None:
+            kwargs['color'] = color
+        with self._lock:
+            self._pending.append((priority, next(self._order), method, key, args, kwargs))
+
+    def _key(self, kind, location, *extra):
+        return (kind, self._rounded(location)) + tuple(_color_key(value) for value in extra)
+
+    def _rounded(self, location):
+        q = self.quantum
+        return round(location.x / q), round(location.y / q), round(location.z / q)
+
+
+def _color_key(value):
+    """carla.Color is not hashable, use its channels"""
+    if hasattr(value, 'r'):
+        return value.r, value.g, value.b, value.a
+    return value
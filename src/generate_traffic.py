@@ -29,6 +29,9 @@ import argparse
 import logging
 from numpy import random
 
+from actor_state import ActorStateTable, ExtentCache
+from apf_fleet import FleetAPF
+
 def get_actor_blueprints(world, filter, generation):
     bps = world.get_blueprint_library().filter(filter)
 
@@ -148,6 +151,11 @@ def main():
         action='store_true',
         default=False,
         help='Activate no rendering mode')
+    argparser.add_argument(
+        '--apf',
+        action='store_true',
+        default=False,
+        help='Drive every vehicle with the ground truth APF controller instead of the traffic manager')
 
     args = argparser.parse_args()
 
@@ -245,7 +253,7 @@ def main():
 
             # spawn the cars and set their autopilot and light state all together
             batch.append(SpawnActor(blueprint, transform)
-                .then(SetAutopilot(FutureActor, True, traffic_manager.get_port())))
+                .then(SetAutopilot(FutureActor, not args.apf, traffic_manager.get_port())))
 
         for response in client.apply_batch_sync(batch, synchronous_master):
             if response.error:
@@ -343,11 +351,20 @@ def main():
         # Example of how to use Traffic Manager parameters
         traffic_manager.global_percentage_speed_difference(30.0)
 
+        fleet = FleetAPF() if args.apf else None
+        extents = ExtentCache(world)
+        carla_map = world.get_map()
         while True:
             if not args.asynch and synchronous_master:
                 world.tick()
+                snapshot = world.get_snapshot()
             else:
-                world.wait_for_tick()
+                snapshot = world.wait_for_tick()
+            if fleet is not None:
+                # every vehicle of the snapshot pushes, the hero included, only the spawned ones are driven
+                pushing = ActorStateTable.from_snapshot(snapshot, extents.vehicles(actor.id for actor in snapshot),
+                                                        extents)
+                fleet.apply(client, carla_map, pushing, vehicles_list)
 
     finally:
 
@@ -13,8 +13,6 @@ import os
 os.environ['FOR_DISABLE_CONSOLE_CTRL_HANDLER'] = '1'
 import sys
 import time
-import math
-from scipy import integrate
 try:
     sys.path.append(glob.glob('../carla/dist/carla-*%d.%d-%s.egg' % (
         sys.version_info.major,
@@ -31,9 +29,18 @@ import argparse
 import logging
 import numpy
 from numpy import random
+
+from actor_state import ActorStateTable, ExtentCache
+from apf_fleet import FleetAPF
+from collision_lut import CollisionTable
+from collision_probability import collision_probability
+from debug_draw import DebugDraw
+from rigid_transform import RigidTransform
+from risk_horizon import RiskHorizon
+from telemetry_log import TelemetryLog
+from spatial_index import UniformGrid
+
 random.seed(4)
-def getlinearline(p1, p2):
-    return lambda x: (x-p1[0])/(p2[0]-p1[0])*(p2[1]-p1[1])+p1[1]
 
 def get_actor_blueprints(world, filter, generation):
     bps = world.get_blueprint_library().filter(filter)
@@ -154,6 +161,60 @@ def main():
         action='store_true',
         default=False,
         help='Activate no rendering mode')
+    argparser.add_argument(
+        '--collision-lut',
+        action='store_true',
+        default=False,
+        help='Interpolate collision probabilities from a precomputed table (cached on disk)')
+    argparser.add_argument(
+        '--lut-workers',
+        metavar='N',
+        default=1,
+        type=int,
+        help='Processes building the collision probability table (default: 1)')
+    argparser.add_argument(
+        '--max-draws',
+        metavar='N',
+        default=100,
+        type=int,
+        help='Debug draw calls per tick at most, the least important are dropped (default: 100)')
+    argparser.add_argument(
+        '--horizon-steps',
+        metavar='K',
+        default=6,
+        type=int,
+        help='Future steps the collision risk is predicted over (default: 6)')
+    argparser.add_argument(
+        '--horizon-dt',
+        metavar='S',
+        default=0.5,
+        type=float,
+        help='Seconds between the predicted steps (default: 0.5)')
+    argparser.add_argument(
+        '--motion-model',
+        choices=['ctrv', 'cv'],
+        default='ctrv',
+        help='Prediction with constant turn rate and velocity, or constant velocity (default: ctrv)')
+    argparser.add_argument(
+        '--risk-budget',
+        metavar='S',
+        default=0.005,
+        type=float,
+        help='Seconds per tick for the predicted risk at most, the closest vehicles first (default: 0.005)')
+    argparser.add_argument(
+        '--telemetry',
+        metavar='PATH',
+        default='telemetry.bin',
+        help='Binary log of the per vehicle risk, read with telemetry_log.py (default: telemetry.bin)')
+    argparser.add_argument(
+        '-v', '--verbose',
+        action='store_true',
+        help='Also print the ego and per vehicle state every tick')
+    argparser.add_argument(
+        '--apf',
+        action='store_true',
+        default=False,
+        help='Drive every vehicle with the ground truth APF controller instead of the traffic manager')
 
     args = argparser.parse_args()
 
@@ -162,6 +223,7 @@ def main():
     vehicles_list = []
     walkers_list = []
     all_id = []
+    telemetry = None
     client = carla.Client(args.host, args.port)
     client.set_timeout(20.0)
     synchronous_master = False
@@ -256,7 +318,7 @@ def main():
 
             #spawn the cars and set their autopilot and light state all together
             batch.append(SpawnActor(blueprint, transform)
-             .then(SetAutopilot(FutureActor, True, traffic_manager.get_port())))
+             .then(SetAutopilot(FutureActor, not args.apf, traffic_manager.get_port())))
 
         for response in client.apply_batch_sync(batch, synchronous_master):
             if response.error:
@@ -296,14 +358,28 @@ def main():
         traffic_len = 4.8
         traffic_wid = 1.8
         sigma = 1
+        collision_lut = None
+        if args.collision_lut:
+            collision_lut = CollisionTable.load_or_build(
+                ego_len=ego_len, ego_wid=ego_wid, traffic_len=traffic_len, traffic_wid=traffic_wid, sigma=sigma,
+                workers=args.lut_workers)
         # spectator = world.get_spectator()
         # camera_bp = world.get_blueprint_library().find('sensor.camera.rgb')
 
+        extents = ExtentCache(world)
+        grid = UniformGrid(cell_size=R / 2)
+        fleet = FleetAPF() if args.apf else None
+        carla_map = world.get_map()
+        draw = DebugDraw(world.debug, max_per_flush=args.max_draws)
+        telemetry = TelemetryLog(args.telemetry)
+        horizon = RiskHorizon(steps=args.horizon_steps, dt=args.horizon_dt, model=args.motion_model, sigma=sigma,
+                              budget=args.risk_budget)
         while True:
             if not args.asynch and synchronous_master:
                 world.tick()
+                snapshot = world.get_snapshot()
             else:
-                world.wait_for_tick()
+                snapshot = world.wait_for_tick()
 
 
             # actor_list = world.get_actors(vehicles_list)
@@ -317,21 +393,27 @@ def main():
             # camera_transform = carla.Transform(carla.Location(x=1.5, z=2.4))
             # camera = world.spawn_actor(camera_bp, camera_transform, attach_to=player)
             # spectator.set_transform(camera.get_transform())
-            matrix = player.get_transform().get_matrix()
 
-            actor_list = world.get_actors(vehicles_list)
-            # ego = actor_list.find(vehicles_list[0])
-            player_info = player.get_transform()
-            inverse_matrix = numpy.linalg.inv(matrix)
-            print('player', player_info.location, player.get_velocity())
-
-            orientation = [player.get_transform().rotation.roll, player.get_transform().rotation.pitch, player.get_transform().rotation.yaw-player.get_transform().rotation.yaw]
-
-
-            player_location = [[player_info.location.x], [player_info.location.y], [player_info.location.z],[1]]
-            player_velocity = [[player.get_velocity().x], [player.get_velocity().y], [player.get_velocity().z], [0]]
-            player_final_location = numpy.dot(inverse_matrix,player_location)
-            player_final_velocity = numpy.dot(inverse_matrix,player_velocity)
+            # one snapshot per tick, every actor state below is read from its arrays instead of per actor getters
+            states = ActorStateTable.from_snapshot(snapshot, vehicles_list, extents)
+            if fleet is not None:
+                # every vehicle of the snapshot pushes, the hero included, only the spawned ones are driven
+                pushing = ActorStateTable.from_snapshot(snapshot, extents.vehicles(actor.id for actor in snapshot),
+                                                        extents)
+                fleet.apply(client, carla_map, pushing, vehicles_list)
+            # the hero is usually driven by another client, so it is read on its own rather than from vehicles_list
+            ego = ActorStateTable.from_snapshot(snapshot, [player.id], extents)
+            if len(ego) == 0:
+                continue
+            player_info = snapshot.find(player.id).get_transform()
+            # inverted analytically once per tick, then every location and velocity is mapped in one matmul
+            ego_to_world = RigidTransform.from_carla(player_info)
+            world_to_ego = ego_to_world.inverse()
+            if args.verbose:
+                print('player', player_info.location, ego.velocity[0])
+
+            player_final_location = world_to_ego.apply_points(ego.location[0])
+            player_final_velocity = world_to_ego.apply_vectors(ego.velocity[0])
             #
             # spectator_location = [[player_final_location[0][0]  ], [player_final_location[1][0]+20],
             #                       [player_final_location[2][0]+20], [1]]
@@ -344,77 +426,60 @@ def main():
             # spectator = world.get_spectator()
             # transform = player.get_transform()
             # spectator.set_transform(carla.Transform(transform.location + carla.Location(z=20), carla.Rotation(pitch=-90)))
-            for n in range(6):
-                future_location= [[player_final_location[0][0]+3*n], [player_final_location[1][0]], [player_final_location[2][0]],[1]]
-
+            future_location = player_final_location + numpy.outer(3 * numpy.arange(6), (1, 0, 0))
+            for future_real_location in ego_to_world.apply_points(future_location):
+                future_real_location_carla = carla.Location(*future_real_location)
+                draw.point(future_real_location_carla, size=0.1, color=carla.Color(r=0, g=255, b=0), life_time=5, priority=2)
 
-                future_real_location = numpy.dot(matrix,future_location)
-                future_real_location_carla = carla.Location(future_real_location[0][0], future_real_location[1][0], future_real_location[2][0])
-                world.debug.draw_point(future_real_location_carla, size=0.1, color=carla.Color(r=0, g=255, b=0), life_time=5)
+            if args.verbose:
+                print('player', 'location:', player_final_location[0], player_final_location[1], player_final_location[2],  'velocity:', player_final_velocity[0], player_final_velocity[1], player_final_velocity[2])
 
-            print('player', 'location:', player_final_location[0][0], player_final_location[1][0], player_final_location[2][0],  'velocity:', player_final_velocity[0][0], player_final_velocity[1][0], player_final_velocity[2][0])
-
-            world.debug.draw_point(player_info.location, size=0.1, color=carla.Color(r=255, g=0, b=0), life_time=5)
+            draw.point(player_info.location, size=0.1, color=carla.Color(r=255, g=0, b=0), life_time=5, priority=3)
             # world.debug.draw_string(player_info.location, '^', draw_shadow=False, color=carla.Color(r=255, g=0, b=0), life_time=0)
-            vehicles = []
             # print(manual_control_joystick_copy.game_loop().location)
-            for a in range(len(vehicles_list)):
-                actor = actor_list.find(vehicles_list[a])
-                #print('id: ', vehicles_list[1], ego.get_location(), ego.get_velocity())
-                # print('id: ', vehicles_list[a], actor.get_location(), actor.get_velocity())
-                # with open('C:/carla/WindowsNoEditor/PythonAPI/examples/src/data/location.txt', 'a+') as f:
-                #     print('id: ', vehicles_list[a], actor.get_location(), actor.get_velocity(), file=f)
-                if ((player.get_location().x-actor.get_location().x)**2+(player.get_location().y-actor.get_location().y)**2) <= (R**2):
-                    # actor.apply_control(carla.VehicleControl(throttle=0, brake=1))
-                    print('actorOrientation: ', actor.get_transform().rotation.yaw-player.get_transform().rotation.yaw)
-                #     print('id: ', vehicles_list[a], actor.get_location(), actor.get_velocity(), len(vehicles))
-                    vehicles.append(vehicles_list[a])
-                    actor_location = [[actor.get_location().x], [actor.get_location().y], [actor.get_location().z], [1]]
-                    actor_velocity =[[actor.get_velocity().x], [actor.get_velocity().y], [actor.get_velocity().z], [0]]
-                    # print(actor.get_transform().rotation)
-                    actor_final_location = numpy.dot(inverse_matrix, actor_location)
-                    actor_final_velocity = numpy.dot(inverse_matrix, actor_velocity)
-                    u = actor_final_velocity[0]
-                    v = actor_final_velocity[1]
-
-                    edgP1 = [ego_len / 2, ego_wid / 2]
-                    edgP2 = [-ego_len / 2, ego_wid / 2]
-                    edgP3 = [ego_len / 2, -ego_wid / 2]
-                    edgP4 = [-ego_len / 2, -ego_wid / 2]
-                    diagLen = 0.5 * (traffic_len ** 2 + traffic_wid ** 2) ** (1 / 2)
-                    angle = (actor.get_transform().rotation.yaw-player.get_transform().rotation.yaw)/180*(math.pi)
-                    angle2 = 0.5 * math.pi - angle
-                    angle3 = math.atan(traffic_wid / traffic_len)
-                    angle4 = math.pi - angle - angle3
-                    angle5 = 0.5 * math.pi
-                    octagon1 = [edgP1[0] + math.sin(angle4) * diagLen, edgP1[1] - math.cos(angle4) * diagLen]
-                    octagon2 = [octagon1[0] - math.sin(angle2) * traffic_wid, octagon1[1] + math.cos(angle2) * traffic_wid]
-                    octagon8 = [edgP1[0] + math.sin(angle4) * diagLen, edgP1[1] - math.cos(angle4) * diagLen - ego_wid]
-                    octagon3 = [octagon1[0] - math.sin(angle2) * traffic_wid - ego_len, octagon1[1] + math.cos(angle2) * traffic_wid]
-                    octagon4 = [-octagon8[0], -octagon8[1]]
-                    octagon5 = [octagon4[0], octagon4[1] - ego_wid]
-                    octagon6 = [-octagon2[0], -octagon2[1]]
-                    octagon7 = [-octagon2[0] + ego_len, -octagon2[1]]
-                    x = actor_final_location[0]
-                    y = actor_final_location[1]
-                    f = lambda y1, x1: 1 / (2 * math.pi * sigma ** 2) * math.exp(-0.5 * ((x1 - x) ** 2 / (sigma) ** 2 + (y1 - y) ** 2 / sigma ** 2))
-                    al1 = integrate.dblquad(f, octagon4[0], octagon6[0], getlinearline(octagon5, octagon6), getlinearline(octagon4, octagon3))
-                    al2 = integrate.dblquad(f, octagon6[0], octagon3[0], octagon6[1], getlinearline(octagon4, octagon3))
-                    al3 = integrate.dblquad(f, octagon3[0], octagon7[0], octagon6[1], octagon3[1])
-                    al4 = integrate.dblquad(f, octagon7[0], octagon2[0], getlinearline(octagon7, octagon8), octagon2[1])
-                    al5 = integrate.dblquad(f, octagon2[0], octagon1[0], getlinearline(octagon7, octagon8), getlinearline(octagon2, octagon1))
-                    all = [al1[0] + al2[0] + al3[0] + al4[0] + al5[0]]
-                    probability = round(all[0],4)
-
+            grid.update(states.location[:, :2])
+            rows, _ = grid.radius(ego.location[0, :2], R)
+            neighbours = states.select(numpy.sort(rows))
+            vehicles = neighbours.ids.tolist()
+            player_yaw = ego.yaw[0]
+            if args.verbose:
+                for yaw in neighbours.yaw:
+                    print('actorOrientation: ', yaw - player_yaw)
 
+            if len(neighbours):
+                # all neighbours at once: ego frame poses, octagons and probabilities are a few array operations
+                actor_final_location = world_to_ego.apply_points(neighbours.location)
+                actor_final_velocity = world_to_ego.apply_vectors(neighbours.velocity)
+                angle = numpy.radians(neighbours.yaw - player_yaw)
+                # Gaussian mass over the Minkowski octagon of both bounding boxes, in closed form or from the table
+                if collision_lut is not None:
+                    probabilities = collision_lut.lookup(actor_final_location[:, 0], actor_final_location[:, 1], angle)
+                else:
+                    probabilities = collision_probability(
+                        actor_final_location[:, 0], actor_final_location[:, 1], angle,
+                        ego_len, ego_wid, traffic_len, traffic_wid, sigma)
+                probabilities = numpy.round(probabilities, 4)
+                # the same octagons over the predicted poses of the next seconds, in one batch
+                risk, risk_time = horizon.evaluate(ego, neighbours, ego_len, ego_wid, traffic_len, traffic_wid)
+                risk = numpy.round(risk, 4)
+                telemetry.append(snapshot.frame, states.timestamp, neighbours.ids, actor_final_location,
+                                 actor_final_velocity, neighbours.yaw - player_yaw, probabilities, risk, risk_time)
 
-                    print('id: ', vehicles_list[a], 'location:', actor_final_location[0][0], actor_final_location[1][0], actor_final_location[2][0], 'velocity:', actor_final_velocity[0][0], actor_final_velocity[1][0], actor_final_velocity[2][0], 'probability:', probability)
-                    world.debug.draw_point(actor.get_location(), size=0.1, color=carla.Color(r=0, g=0, b=255), life_time=5)
-                    world.debug.draw_string(actor.get_location(), str(probability),  draw_shadow=False, color=carla.Color(r=255, g=0, b=0), life_time=0.5)
+                for i, probability in enumerate(probabilities):
+                    location = carla.Location(*neighbours.location[i])
+                    if args.verbose:
+                        print('id: ', vehicles[i], 'location:', actor_final_location[i, 0], actor_final_location[i, 1], actor_final_location[i, 2], 'velocity:', actor_final_velocity[i, 0], actor_final_velocity[i, 1], actor_final_velocity[i, 2], 'probability:', probability, 'risk:', risk[i], 'at:', risk_time[i])
+                    # the likelier the collision the more important the label, one label per vehicle at a time
+                    draw.point(location, size=0.1, color=carla.Color(r=0, g=0, b=255), life_time=5, priority=1)
+                    label = str(probability) if numpy.isnan(risk_time[i]) else '%s / %s in %.1fs' % (probability, risk[i], risk_time[i])
+                    draw.string(location, label,  draw_shadow=False, color=carla.Color(r=255, g=0, b=0), life_time=0.5,
+                                priority=1 + numpy.fmax(probability, risk[i]), key=('probability', vehicles[i]))
 
 
 
-            print(len(vehicles))
+            draw.flush()
+            if args.verbose:
+                print(len(vehicles))
 
 
 
@@ -426,6 +491,8 @@ def main():
 
 
     finally:
+        if telemetry is not None:
+            telemetry.close()
 
         if not args.asynch and synchronous_master:
             settings = world.get_settings()
@@ -0,0 +1,84 @@
+"""Repulsive force of the artificial potential field (APF) from semantic lidar frames.
+
+Shared by ``SemanticLidarSensor`` and the offline tools, runs on whichever
+array module ``apf_backend`` selected.
+"""
+
+import collections
+
+import numpy as np
+
+import apf_backend
+from lidar_grouping import object_forces
+
+# layout of carla.SemanticLidarMeasurement.raw_data
+LIDAR_DTYPE = np.dtype([
+    ('x', np.float32), ('y', np.float32), ('z', np.float32),
+    ('CosAngle', np.float32), ('ObjIdx', np.uint32), ('ObjTag', np.uint32)])
+VEHICLE_TAG = 10
+VEHICLE_COLORS = np.array([
+    (0, 100, 100),                  # inside bounding box (own vehicle)
+    (255, 50, 50),                  # outside bounding box (other vehicle)
+    (255, 0, 0),
+    (0, 255, 0),
+    (0, 0, 255),
+    (255, 255, 0),
+    (255, 0, 255),
+    (0, 255, 255),
+    (255, 255, 255),
+    (255, 100, 100),
+    (100, 255, 100),
+    (100, 100, 255),
+]) / 255.0
+
+FrameForces = collections.namedtuple('FrameForces', [
+    'points',       # (n, 3) vehicle points, y negated for Open3D
+    'own_mask',     # (n,) points of the own vehicle
+    'objects',      # lidar_grouping.ObjectForces of the other vehicles
+    'force',        # total repulsive force as a python float
+])
+
+
+def parse_frame(raw_data):
+    """Views the raw buffer of a semantic lidar measurement as a structured array"""
+    return np.frombuffer(raw_data, dtype=LIDAR_DTYPE)
+
+
+def vehicle_forces(data, bbox, threshold=20.0):
+    '''
+    compute the repulsive force of the other vehicles seen in one lidar frame
+    data: structured array with LIDAR_DTYPE, on the host
+    bbox: half extent of the own vehicle's bounding box around the sensor
+    return: FrameForces, arrays are of the selected backend
+    '''
+    xp = apf_backend.xp
+    # filter to get vehicle points, parsing structured arrays is only supported by numpy
+    data = data[data['ObjTag'] == VEHICLE_TAG]
+
+    # We're negating the y to correclty visualize a world that matches
+    # what we see in Unreal since Open3D uses a right-handed coordinate system
+    points = xp.asarray(np.stack((data['x'], -data['y'], data['z']), axis=1))
+    cos_angle = xp.asarray(data['CosAngle'])
+    obj_idx = xp.asarray(data['ObjIdx'])
+
+    # filter point cloud within bounding box (own vehicle) and outside (other vehicles),
+    # one column at a time, a reduction over the 3 columns of each row costs several times more
+    own_mask = xp.abs(points[:, 0]) <= bbox[0]
+    own_mask &= xp.abs(points[:, 1]) <= bbox[1]
+    own_mask &= xp.abs(points[:, 2]) <= bbox[2]
+    out_box_mask = xp.logical_not(own_mask)
+
+    # compute a repulsive force from other vehicles, grouped by object instance
+    objects = object_forces(obj_idx[out_box_mask], points[out_box_mask], cos_angle[out_box_mask], threshold, xp=xp)
+    return FrameForces(points=points, own_mask=own_mask, objects=objects, force=float(xp.sum(objects.force)))
+
+
+def colorize(frame, colors):
+    '''
+    color every vehicle point by object instance
+    colors: (k, 3) palette of the selected backend, the first color is reserved for the own vehicle
+    '''
+    xp = apf_backend.xp
+    labels = xp.zeros(frame.points.shape[0], dtype=xp.int64)
+    labels[xp.logical_not(frame.own_mask)] = 1 + frame.objects.labels % (colors.shape[0] - 1)
+    return colors[labels]
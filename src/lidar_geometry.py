@@ -0,0 +1,41 @@
+"""Ray layout of a rotating CARLA lidar.
+
+Every return is identified by the ray that produced it: its channel (laser)
+and the azimuth bin of the sweep. Both are recovered from the point itself,
+since the lidar only reports rays that hit something.
+"""
+
+import collections
+import math
+
+import numpy as np
+
+
+class LidarGeometry(collections.namedtuple('LidarGeometry', ['channels', 'upper_fov', 'lower_fov', 'azimuth_bins'])):
+    """Channels over [lower_fov, upper_fov] degrees, azimuth_bins rays per channel and revolution"""
+
+    @classmethod
+    def from_attributes(cls, attributes, rotation_frequency):
+        '''
+        attributes: lidar blueprint attributes, as used by SemanticLidarSensor.generate_lidar_bp
+        rotation_frequency: revolutions per second
+        '''
+        channels = int(attributes['channels'])
+        rays = float(attributes['points_per_second']) / (channels * rotation_frequency)
+        return cls(
+            channels=channels,
+            upper_fov=float(attributes['upper_fov']),
+            lower_fov=float(attributes['lower_fov']),
+            azimuth_bins=int(math.ceil(rays)))
+
+
+def ray_index(x, y, z, geometry, xp=np):
+    '''
+    recover the ray of every return, points are in the sensor frame
+    return: channel (0 is the lowest laser) and azimuth bin (0 is the rear, counter-clockwise), as int arrays
+    '''
+    elevation = xp.degrees(xp.arctan2(z, xp.sqrt(x * x + y * y)))
+    spacing = (geometry.upper_fov - geometry.lower_fov) / max(geometry.channels - 1, 1)
+    channel = xp.clip(xp.rint((elevation - geometry.lower_fov) / spacing), 0, geometry.channels - 1).astype(xp.int64)
+    azimuth = xp.floor((xp.arctan2(y, x) + math.pi) * (geometry.azimuth_bins / (2 * math.pi))).astype(xp.int64)
+    return channel, azimuth % geometry.azimuth_bins
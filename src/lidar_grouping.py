@@ -0,0 +1,69 @@
+"""Instance-aware grouping of semantic lidar points.
+
+The semantic lidar tags every point with the id of the object it hit
+(``ObjIdx``), so points can be grouped per object with a single sort instead
+of clustering them by pairwise distance. Static vehicles that are part of the
+map (e.g. parked cars) are not actors and all share ``ObjIdx == 0``.
+"""
+
+import collections
+
+import numpy as np
+
+ObjectForces = collections.namedtuple('ObjectForces', [
+    'ids',          # (k,) ObjIdx of every object, ascending
+    'counts',       # (k,) number of points per object
+    'centroids',    # (k, 3) mean point of every object
+    'nearest',      # (k,) distance of the closest point of every object
+    'force',        # (k,) repulsive force summed over every object
+    'labels',       # (n,) index into the arrays above for every input point
+])
+
+
+def repulsive_force(distances, threshold=20.0, xp=np):
+    """Per-point repulsive force, normalized over the whole frame"""
+    return 1e5 * (threshold - distances) / xp.sum(distances * distances * distances) / threshold
+
+
+def object_forces(obj_idx, points, cos_angle, threshold=20.0, xp=np):
+    '''
+    group points by ObjIdx and compute per object statistics in one pass
+    obj_idx: (n,) object id of every point
+    points: (n, 3) point positions relative to the sensor
+    cos_angle: (n,) cosine of the incident angle of every point
+    return: ObjectForces, whose force sums up to the total repulsive force
+    '''
+    n = points.shape[0]
+    if n == 0:
+        return ObjectForces(
+            ids=xp.zeros(0, dtype=obj_idx.dtype),
+            counts=xp.zeros(0, dtype=xp.int64),
+            centroids=xp.zeros((0, 3), dtype=points.dtype),
+            nearest=xp.zeros(0, dtype=points.dtype),
+            force=xp.zeros(0, dtype=points.dtype),
+            labels=xp.zeros(0, dtype=xp.int64))
+
+    distances = xp.sqrt(xp.sum(points * points, axis=1))
+    force = repulsive_force(distances, threshold, xp=xp) * cos_angle
+
+    # sort by object, then by distance, so the first point of a group is its nearest one
+    order = xp.lexsort(xp.stack((distances, obj_idx.astype(xp.int64))))
+    sorted_idx = obj_idx[order]
+    first = xp.ones(n, dtype=bool)
+    first[1:] = sorted_idx[1:] != sorted_idx[:-1]
+    starts = xp.flatnonzero(first)
+
+    labels = xp.empty(n, dtype=xp.int64)
+    labels[order] = xp.cumsum(first) - 1
+    k = starts.shape[0]
+    counts = xp.bincount(labels, minlength=k)
+    centroids = xp.stack([xp.bincount(labels, weights=points[:, i], minlength=k) for i in range(3)], axis=1)
+    centroids /= counts[:, None]
+
+    return ObjectForces(
+        ids=sorted_idx[starts],
+        counts=counts,
+        centroids=centroids,
+        nearest=distances[order[starts]],
+        force=xp.bincount(labels, weights=force, minlength=k),
+        labels=labels)
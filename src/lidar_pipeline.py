@@ -0,0 +1,88 @@
+"""Processing of lidar frames off the CARLA sensor callback thread.
+
+The callback only copies the frame into a single slot mailbox. A worker thread
+takes the freshest frame, so when processing falls behind the stale frames are
+dropped (and counted) instead of piling up, and the controller always acts on
+the latest data.
+"""
+
+import logging
+import threading
+import time
+
+
+class LatestFrameMailbox(object):
+    """Single slot mailbox, putting a frame replaces the one not taken yet"""
+
+    def __init__(self):
+        self._condition = threading.Condition()
+        self._item = None
+        self._closed = False
+        self.dropped = 0
+
+    def put(self, item):
+        with self._condition:
+            if self._item is not None:
+                self.dropped += 1
+            self._item = item
+            self._condition.notify()
+
+    def get(self, timeout=None):
+        '''
+        wait for the freshest frame
+        return: the frame, or None if the mailbox is closed or the timeout expired
+        '''
+        with self._condition:
+            self._condition.wait_for(lambda: self._item is not None or self._closed, timeout)
+            item, self._item = self._item, None
+            return item
+
+    def close(self):
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+
+
+class FrameWorker(object):
+    """Runs process(frame) on a worker thread for the latest frame submitted"""
+
+    def __init__(self, process, name='FrameWorker'):
+        self._process = process
+        self.mailbox = LatestFrameMailbox()
+        self.processed = 0
+        self.errors = 0                 # frames process() raised on, logged and skipped
+        self.queue_latency = 0.0        # seconds between submit() and the start of processing
+        self.compute_latency = 0.0      # seconds spent in process()
+        self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self._thread.start()
+
+    @property
+    def dropped(self):
+        return self.mailbox.dropped
+
+    def submit(self, frame):
+        """Hands a frame to the worker, never blocks"""
+        self.mailbox.put((time.perf_counter(), frame))
+
+    def stop(self):
+        self.mailbox.close()
+        self._thread.join()
+
+    def _run(self):
+        while True:
+            item = self.mailbox.get()
+            if item is None:
+                return
+            submitted, frame = item
+            start = time.perf_counter()
+            try:
+                self._process(frame)
+            except Exception:
+                # one bad frame must not stop the controller from acting on the next ones
+                self.errors += 1
+                logging.exception('%s failed to process a frame', self._thread.name)
+                continue
+            end = time.perf_counter()
+            self.queue_latency = start - submitted
+            self.compute_latency = end - start
+            self.processed += 1
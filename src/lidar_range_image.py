@@ -0,0 +1,98 @@
+"""Range image view of a lidar sweep.
+
+Returns are scattered into a (channels, azimuth bins) image by the ray that
+produced them, see lidar_geometry.ray_index. Neighbours in the sweep become
+neighbouring pixels, so ground segmentation and clustering are image
+operations that are linear in the number of points.
+"""
+
+import numpy as np
+from scipy.sparse import coo_matrix
+from scipy.sparse.csgraph import connected_components
+
+from lidar_geometry import ray_index
+
+
+class RangeImage(object):
+    """Range, position and point index of the closest return of every ray"""
+
+    def __init__(self, geometry, x, y, z):
+        '''
+        geometry: lidar_geometry.LidarGeometry of the sensor
+        x, y, z: (n,) points in the sensor frame
+        '''
+        self.geometry = geometry
+        shape = (geometry.channels, geometry.azimuth_bins)
+        x, y, z = np.asarray(x, dtype=np.float32), np.asarray(y, dtype=np.float32), np.asarray(z, dtype=np.float32)
+        self.channel, self.azimuth = ray_index(x, y, z, geometry)
+        ranges = np.sqrt(x * x + y * y + z * z)
+
+        # a ray may get more than one point after rounding, keep the closest: the first of its cell by range
+        cell = self.channel * geometry.azimuth_bins + self.azimuth
+        order = np.lexsort((ranges, cell))
+        cells, first = np.unique(cell[order], return_index=True)
+        self.index = np.full(shape, -1, dtype=np.int64)
+        self.index.flat[cells] = order[first]
+
+        valid = self.index >= 0
+        self.range = np.full(shape, np.inf, dtype=np.float32)
+        self.range[valid] = ranges[self.index[valid]]
+        self.xyz = np.full(shape + (3,), np.nan, dtype=np.float32)
+        self.xyz[valid] = np.stack((x, y, z), axis=1)[self.index[valid]]
+
+    @classmethod
+    def from_frame(cls, geometry, data):
+        """Builds the image of a structured lidar frame with x, y and z fields"""
+        return cls(geometry, data['x'], data['y'], data['z'])
+
+    @property
+    def valid(self):
+        return self.index >= 0
+
+    def ground_mask(self, sensor_height, max_slope=10.0, max_height=0.3):
+        '''
+        label the ground rays by the slope between vertically adjacent returns
+        sensor_height: height of the sensor above the ground, in meters
+        max_slope: steepest slope still considered ground, in degrees
+        max_height: the lowest return of a column is ground if it is this close to the ground
+        return: (channels, azimuth bins) bool image
+        '''
+        z = self.xyz[..., 2]
+        planar = np.hypot(self.xyz[..., 0], self.xyz[..., 1])
+        with np.errstate(invalid='ignore'):
+            slope = np.degrees(np.arctan2(np.abs(z[1:] - z[:-1]), np.abs(planar[1:] - planar[:-1])))
+            near_ground = z + sensor_height < max_height
+        flat = np.zeros(self.index.shape, dtype=bool)
+        flat[1:] = slope < max_slope
+        flat[0] = near_ground[0]
+        # a flat step only counts as ground if it starts close to the ground
+        return np.logical_and(flat, near_ground)
+
+    def components(self, max_gap=0.5, mask=None):
+        '''
+        cluster the image, neighbouring rays (azimuth wraps around) are connected
+        if their ranges differ by less than max_gap meters
+        mask: optional bool image of the rays to cluster, e.g. the non-ground ones
+        return: (channels, azimuth bins) int image of component labels, -1 for rays without return
+        '''
+        valid = self.valid if mask is None else np.logical_and(self.valid, mask)
+        rows, cols = self.index.shape
+        cells = np.arange(rows * cols).reshape(rows, cols)
+        with np.errstate(invalid='ignore'):
+            horizontal = valid & np.roll(valid, -1, axis=1) & \
+                (np.abs(self.range - np.roll(self.range, -1, axis=1)) < max_gap)
+            vertical = valid[:-1] & valid[1:] & (np.abs(self.range[:-1] - self.range[1:]) < max_gap)
+        sources = np.concatenate((cells[horizontal], cells[:-1][vertical]))
+        targets = np.concatenate((np.roll(cells, -1, axis=1)[horizontal], cells[1:][vertical]))
+        graph = coo_matrix((np.ones(sources.shape[0], dtype=np.int8), (sources, targets)), shape=(rows * cols,) * 2)
+        _, labels = connected_components(graph, directed=False)
+
+        # renumber so that components of valid rays are 0..k-1
+        labels = labels.reshape(rows, cols)
+        _, labels[valid] = np.unique(labels[valid], return_inverse=True)
+        labels[np.logical_not(valid)] = -1
+        return labels
+
+    def point_labels(self, image):
+        """Looks up a per ray image for every point the image was built from"""
+        return image[self.channel, self.azimuth]
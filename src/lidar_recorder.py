@@ -0,0 +1,153 @@
+"""Continuous recorder for semantic lidar frames.
+
+A recording is a directory with two files:
+
+    points.bin   chunks of frames, every chunk stores one column after another
+                 (x of all its frames, then y, ... ObjTag), all columns are 4 bytes wide
+    frames.bin   one FRAME_DTYPE record per frame: frame number, timestamp, ego
+                 transform, point count and the byte offset of every column
+
+Frames are handed to a background thread in chunks, so the sensor callback only
+copies the buffer it gets from CARLA. LidarRecording memory-maps both files,
+columns() returns every column of a frame as a view into the mapping without
+copies, indexing and iteration give frames as LIDAR_DTYPE arrays.
+"""
+
+import logging
+import os
+import queue
+import threading
+
+import numpy as np
+
+from lidar_apf import LIDAR_DTYPE
+
+COLUMNS = LIDAR_DTYPE.names
+FRAME_DTYPE = np.dtype([
+    ('frame', np.int64), ('timestamp', np.float64),
+    ('x', np.float64), ('y', np.float64), ('z', np.float64),
+    ('pitch', np.float64), ('yaw', np.float64), ('roll', np.float64),
+    ('count', np.int64), ('offset', np.int64, (len(COLUMNS),))])
+POINTS_FILE = 'points.bin'
+FRAMES_FILE = 'frames.bin'
+
+
+class LidarRecorder(object):
+    """Appends semantic lidar frames to a recording on a background thread"""
+
+    def __init__(self, path, chunk_frames=20, max_pending_chunks=64):
+        os.makedirs(path, exist_ok=True)
+        self.path = path
+        self.chunk_frames = chunk_frames
+        self.recorded = 0
+        self.dropped = 0
+        self._chunk = []
+        self._queue = queue.Queue(maxsize=max_pending_chunks)
+        self._points_file = open(os.path.join(path, POINTS_FILE), 'wb')
+        self._frames_file = open(os.path.join(path, FRAMES_FILE), 'wb')
+        self._thread = threading.Thread(target=self._write_loop, name='LidarRecorder', daemon=True)
+        self._thread.start()
+
+    def record(self, data, frame, timestamp, transform=None):
+        '''
+        queue one frame for writing, never blocks on disk
+        data: structured array with LIDAR_DTYPE, copied since CARLA reuses the buffer
+        transform: carla.Transform of the ego vehicle
+        '''
+        header = np.zeros((), dtype=FRAME_DTYPE)
+        header['frame'] = frame
+        header['timestamp'] = timestamp
+        header['count'] = data.shape[0]
+        if transform is not None:
+            header['x'], header['y'], header['z'] = transform.location.x, transform.location.y, transform.location.z
+            header['pitch'], header['yaw'], header['roll'] = \
+                transform.rotation.pitch, transform.rotation.yaw, transform.rotation.roll
+        self._chunk.append((header, np.array(data, dtype=LIDAR_DTYPE)))
+        if len(self._chunk) >= self.chunk_frames:
+            self._submit()
+
+    def close(self):
+        """Writes the frames still pending and waits for the writer thread"""
+        if self._thread is None:
+            return
+        self._submit()
+        self._queue.put(None)
+        self._thread.join()
+        self._thread = None
+        self._points_file.close()
+        self._frames_file.close()
+        logging.info('recorded %d lidar frames to %s, dropped %d', self.recorded, self.path, self.dropped)
+
+    def _submit(self):
+        if not self._chunk:
+            return
+        chunk, self._chunk = self._chunk, []
+        try:
+            self._queue.put_nowait(chunk)
+        except queue.Full:
+            self.dropped += len(chunk)
+
+    def _write_loop(self):
+        offset = self._points_file.tell()
+        while True:
+            chunk = self._queue.get()
+            if chunk is None:
+                return
+            headers = np.stack([header for header, _ in chunk])
+            for c, name in enumerate(COLUMNS):
+                for i, (_, data) in enumerate(chunk):
+                    headers['offset'][i, c] = offset
+                    column = np.ascontiguousarray(data[name])
+                    self._points_file.write(column.tobytes())
+                    offset += column.nbytes
+            self._frames_file.write(headers.tobytes())
+            self._points_file.flush()
+            self._frames_file.flush()
+            self.recorded += len(chunk)
+
+
+class LidarRecording(object):
+    """Read access to a recording, frames are column views into memory-mapped files"""
+
+    def __init__(self, path):
+        self.path = path
+        self.frames = self._memmap(os.path.join(path, FRAMES_FILE), FRAME_DTYPE)
+        self._points = self._memmap(os.path.join(path, POINTS_FILE), np.uint8)
+
+    @staticmethod
+    def _memmap(path, dtype):
+        dtype = np.dtype(dtype)
+        if os.path.getsize(path) == 0:
+            return np.zeros(0, dtype=dtype)
+        # a frame that is being written may be incomplete, ignore it
+        count = os.path.getsize(path) // dtype.itemsize
+        return np.memmap(path, dtype=dtype, mode='r', shape=(count,))
+
+    def __len__(self):
+        return self.frames.shape[0]
+
+    def __getitem__(self, i):
+        return self.frame(i)
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self.frame(i)
+
+    def columns(self, i):
+        """Returns {column name: read-only view} of frame i"""
+        header = self.frames[i]
+        count = int(header['count'])
+        columns = {}
+        for c, name in enumerate(COLUMNS):
+            dtype = LIDAR_DTYPE.fields[name][0]
+            start = int(header['offset'][c])
+            columns[name] = self._points[start:start + count * dtype.itemsize].view(dtype)
+        return columns
+
+    def frame(self, i):
+        """Returns frame i as a structured array with LIDAR_DTYPE, this one is a copy"""
+        columns = self.columns(i)
+        data = np.empty(int(self.frames[i]['count']), dtype=LIDAR_DTYPE)
+        for name in COLUMNS:
+            data[name] = columns[name]
+        return data
@@ -0,0 +1,228 @@
+#!/usr/bin/env python
+
+"""Replay recorded semantic lidar frames through SemanticLidarSensor.
+
+The sensor, its blueprint, the world and the parent vehicle are replaced by
+stand-ins, so the real sensor callback runs without a CARLA server, as fast as
+the frames can be processed. Every frame reports the repulsive force, its
+filtered value (the median column, see streaming_filters) and the
+throttle/brake computed by the APF controller.
+"""
+
+import argparse
+import collections
+import itertools
+import logging
+import os
+import pickle
+import time
+
+import numpy as np
+
+import apf_backend
+import lidar_apf
+from lidar_recorder import LidarRecording
+from manual_control_joystick import SemanticLidarSensor
+from streaming_filters import DEFAULT_FORCE_FILTER
+
+# extent of the Tesla Model 3, the default vehicle of manual_control_joystick.py
+MODEL3_EXTENT = (2.39588976, 1.081725, 0.74383003)
+
+REPLAY_DTYPE = np.dtype([
+    ('frame', np.int64), ('points', np.int64),
+    ('force', np.float64), ('median', np.float64),
+    ('throttle', np.float64), ('brake', np.float64),
+    ('compute', np.float64)])
+
+Vector3D = collections.namedtuple('Vector3D', ['x', 'y', 'z'])
+BoundingBox = collections.namedtuple('BoundingBox', ['location', 'extent'])
+
+
+# ==============================================================================
+# -- stand-ins -----------------------------------------------------------------
+# ==============================================================================
+
+
+class ReplayMeasurement(object):
+    """Mimics carla.SemanticLidarMeasurement"""
+
+    def __init__(self, data, frame, timestamp, transform=None):
+        self.raw_data = np.ascontiguousarray(data, dtype=lidar_apf.LIDAR_DTYPE)
+        self.frame = frame
+        self.timestamp = timestamp
+        self.transform = transform
+
+    def __len__(self):
+        return self.raw_data.shape[0]
+
+
+class ReplayBlueprint(object):
+    def __init__(self, blueprint_id):
+        self.id = blueprint_id
+        self.attributes = {}
+
+    def set_attribute(self, key, value):
+        self.attributes[key] = value
+
+
+class ReplayBlueprintLibrary(object):
+    def find(self, blueprint_id):
+        return ReplayBlueprint(blueprint_id)
+
+
+class ReplaySensor(object):
+    """Mimics a carla.Sensor, frames are pushed with emit() instead of the server"""
+
+    def __init__(self, blueprint, transform, parent):
+        self.blueprint = blueprint
+        self.transform = transform
+        self.parent = parent
+        self._callback = None
+
+    def listen(self, callback):
+        self._callback = callback
+
+    def is_listening(self):
+        return self._callback is not None
+
+    def emit(self, measurement):
+        if self._callback is not None:
+            self._callback(measurement)
+
+    def stop(self):
+        self._callback = None
+
+    def destroy(self):
+        self._callback = None
+
+
+class ReplayWorld(object):
+    def get_blueprint_library(self):
+        return ReplayBlueprintLibrary()
+
+    def spawn_actor(self, blueprint, transform, attach_to=None):
+        return ReplaySensor(blueprint, transform, attach_to)
+
+
+class ReplayVehicle(object):
+    """Mimics the parent carla.Vehicle, keeps the last control applied by the sensor"""
+
+    def __init__(self, extent=MODEL3_EXTENT, actor_id=0):
+        self.id = actor_id
+        self.bounding_box = BoundingBox(location=Vector3D(0.0, 0.0, extent[2]), extent=Vector3D(*extent))
+        self.control = None
+        self._world = ReplayWorld()
+
+    def get_world(self):
+        return self._world
+
+    def apply_control(self, control):
+        self.control = control
+
+
+# ==============================================================================
+# -- replay --------------------------------------------------------------------
+# ==============================================================================
+
+
+def load_frames(path):
+    """Opens a LidarRecording directory, or loads a pickled frame or a pickled list of frames"""
+    if os.path.isdir(path):
+        return LidarRecording(path)
+    with open(path, 'rb') as f:
+        frames = pickle.load(f)
+    if isinstance(frames, np.ndarray):
+        frames = [frames]
+    return [np.asarray(frame, dtype=lidar_apf.LIDAR_DTYPE) for frame in frames]
+
+
+def replay(lidar, frames, delta=0.05):
+    '''
+    push frames through the sensor callback, one after another
+    lidar: SemanticLidarSensor attached to a ReplayVehicle
+    frames: iterable of structured arrays with LIDAR_DTYPE
+    return: structured array with REPLAY_DTYPE, one row per frame
+    '''
+    results = []
+    for i, data in enumerate(frames):
+        start = time.perf_counter()
+        lidar.sensor.emit(ReplayMeasurement(data, frame=i, timestamp=i * delta))
+        compute = time.perf_counter() - start
+        results.append((i, data.shape[0], lidar.vehicle_repl_force, lidar.median, lidar.throttle, lidar.brake, compute))
+        lidar.render()
+    return np.array(results, dtype=REPLAY_DTYPE)
+
+
+def main():
+    argparser = argparse.ArgumentParser(
+        description=__doc__)
+    argparser.add_argument(
+        'frames',
+        nargs='+',
+        help='lidar recordings or pickled semantic lidar frames, replayed in order')
+    argparser.add_argument(
+        '--repeat',
+        default=1,
+        type=int,
+        help='replay the frames this many times (default: 1)')
+    argparser.add_argument(
+        '--extent',
+        nargs=3,
+        default=MODEL3_EXTENT,
+        type=float,
+        metavar=('X', 'Y', 'Z'),
+        help='bounding box extent of the own vehicle (default: Tesla Model 3)')
+    argparser.add_argument(
+        '-a', '--autopilot',
+        action='store_true',
+        help='apply the computed control to the stand-in vehicle')
+    argparser.add_argument(
+        '--backend',
+        default='numpy',
+        choices=apf_backend.BACKENDS,
+        help='array backend of the lidar force pipeline (default: numpy)')
+    argparser.add_argument(
+        '--force-filter',
+        action='append',
+        metavar='SPEC',
+        help='filter of the repulsive force, e.g. median:11, median:2s, ema:0.2, kalman:0.5:4; '
+             'repeat to run several, the first drives the throttle (default: %s)' % DEFAULT_FORCE_FILTER)
+    argparser.add_argument(
+        '-o', '--out',
+        metavar='PATH',
+        help='write the per frame results to a csv file')
+    argparser.add_argument(
+        '-v', '--verbose',
+        action='store_true',
+        help='print every frame')
+    args = argparser.parse_args()
+
+    logging.basicConfig(format='%(levelname)s: %(message)s', level=logging.INFO)
+    apf_backend.select_backend(args.backend)
+
+    sources = [load_frames(path) for path in args.frames]
+    frames = itertools.chain.from_iterable(sources * args.repeat)
+    vehicle = ReplayVehicle(tuple(args.extent))
+    lidar = SemanticLidarSensor(vehicle, 'Semantic Lidar Replay', autopilot=args.autopilot, visualize=False,
+                                threaded=False, force_filters=args.force_filter or (DEFAULT_FORCE_FILTER,))
+
+    start = time.perf_counter()
+    results = replay(lidar, frames)
+    elapsed = time.perf_counter() - start
+
+    if args.verbose:
+        for row in results:
+            print('frame %6d  points %6d  force %9.2f  median %9.2f  throttle %.3f  brake %.3f' % (
+                row['frame'], row['points'], row['force'], row['median'], row['throttle'], row['brake']))
+    if args.out:
+        np.savetxt(args.out, results, delimiter=',', header=','.join(REPLAY_DTYPE.names), comments='',
+                   fmt=['%d', '%d', '%.4f', '%.4f', '%.3f', '%.3f', '%.6f'])
+
+    print('replayed %d frames in %.3f s (%.0f frames/s), compute mean %.3f ms  p95 %.3f ms' % (
+        len(results), elapsed, len(results) / elapsed,
+        1e3 * results['compute'].mean(), 1e3 * np.percentile(results['compute'], 95)))
+    lidar.sensor.destroy()
+
+
+if __name__ == '__main__':
+    main()
@@ -39,6 +39,8 @@ try:
 except ImportError:
     raise RuntimeError('cannot import PIL, make sure "Pillow" package is installed')
 
+from rigid_transform import RigidTransform
+
 VIRIDIS = np.array(cm.get_cmap('viridis').colors)
 VID_RANGE = np.linspace(0.0, 1.0, VIRIDIS.shape[0])
 
@@ -166,25 +168,14 @@ def tutorial(args):
             # focus on the 3D points.
             intensity = np.array(p_cloud[:, 3])
 
-            # Point cloud in lidar sensor space array of shape (3, p_cloud_size).
-            local_lidar_points = np.array(p_cloud[:, :3]).T
-
-            # Add an extra 1.0 at the end of each 3d point so it becomes of
-            # shape (4, p_cloud_size) and it can be multiplied by a (4, 4) matrix.
-            local_lidar_points = np.r_[
-                local_lidar_points, [np.ones(local_lidar_points.shape[1])]]
-
-            # This (4, 4) matrix transforms the points from lidar space to world space.
-            lidar_2_world = lidar.get_transform().get_matrix()
-
-            # Transform the points from lidar space to world space.
-            world_points = np.dot(lidar_2_world, local_lidar_points)
-
-            # This (4, 4) matrix transforms the points from world to sensor coordinates.
-            world_2_camera = np.array(camera.get_transform().get_inverse_matrix())
+            # Lidar space to world space, then world space to camera space,
+            # composed once so the point cloud is transformed in one product.
+            lidar_2_world = RigidTransform.from_carla(lidar.get_transform())
+            world_2_camera = RigidTransform.from_carla(camera.get_transform()).inverse()
+            lidar_2_camera = world_2_camera.compose(lidar_2_world)
 
-            # Transform the points from world space to camera space.
-            sensor_points = np.dot(world_2_camera, world_points)
+            # Point cloud in camera space, array of shape (3, p_cloud_size).
+            sensor_points = lidar_2_camera.apply_points(p_cloud[:, :3]).T
 
             # New we must change from UE4's coordinate system to an "standard"
             # camera coordinate system (the same used by OpenCV):
@@ -0,0 +1,170 @@
+"""Out-of-process viewer for the semantic lidar and its repulsive force.
+
+The Open3D window and the matplotlib force plot run in their own process. The
+sensor publishes point and color buffers and force samples through shared
+memory; publishing is a copy into the mapping and never waits for the viewer.
+
+Points are guarded by a sequence counter (odd while being written), the viewer
+retries if the counter moved while it was copying. Force samples go to a ring
+buffer with a monotonic write counter.
+"""
+
+import multiprocessing
+import time
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from telemetry_plot import TelemetryPlot
+
+SAMPLE_FIELDS = ('frame', 'force', 'median', 'throttle', 'brake')
+
+
+class LidarViewer(object):
+    """Owns the shared buffers and the viewer process"""
+
+    def __init__(self, hint, max_points=100000, max_samples=4096):
+        self.max_points = max_points
+        self.max_samples = max_samples
+        self._shm = [
+            shared_memory.SharedMemory(create=True, size=8 * 4),
+            shared_memory.SharedMemory(create=True, size=4 * 3 * max_points),
+            shared_memory.SharedMemory(create=True, size=4 * 3 * max_points),
+            shared_memory.SharedMemory(create=True, size=8 * len(SAMPLE_FIELDS) * max_samples)]
+        self._header, self._points, self._colors, self._samples = _views(self._shm, max_points, max_samples)
+        self._header[:] = 0
+
+        context = multiprocessing.get_context('spawn')
+        self._stop = context.Event()
+        self._process = context.Process(
+            target=_viewer_main,
+            args=(hint, [shm.name for shm in self._shm], max_points, max_samples, self._stop),
+            name='LidarViewer',
+            daemon=True)
+        self._process.start()
+
+    def publish_points(self, points, colors):
+        """Copies (n, 3) points and colors into the shared buffers, extra points are dropped"""
+        n = min(points.shape[0], self.max_points)
+        self._header[0] += 1
+        self._points[:n] = points[:n]
+        self._colors[:n] = colors[:n]
+        self._header[1] = n
+        self._header[0] += 1
+
+    def publish_sample(self, *values):
+        """Appends one force sample, with one value per SAMPLE_FIELDS"""
+        count = self._header[2]
+        self._samples[count % self.max_samples] = values
+        self._header[2] = count + 1
+
+    def close(self):
+        self._stop.set()
+        self._process.join(timeout=2.0)
+        if self._process.is_alive():
+            self._process.terminate()
+        del self._header, self._points, self._colors, self._samples
+        for shm in self._shm:
+            shm.close()
+            shm.unlink()
+
+
+def _views(shm, max_points, max_samples):
+    header = np.ndarray((4,), dtype=np.int64, buffer=shm[0].buf)    # sequence, points, samples, unused
+    points = np.ndarray((max_points, 3), dtype=np.float32, buffer=shm[1].buf)
+    colors = np.ndarray((max_points, 3), dtype=np.float32, buffer=shm[2].buf)
+    samples = np.ndarray((max_samples, len(SAMPLE_FIELDS)), dtype=np.float64, buffer=shm[3].buf)
+    return header, points, colors, samples
+
+
+def _read_points(header, points, colors):
+    """Consistent copy of the published points, or None if they are being written"""
+    sequence = header[0]
+    if sequence % 2:
+        return None
+    n = header[1]
+    copy = points[:n].copy(), colors[:n].copy()
+    return copy if header[0] == sequence else None
+
+
+def _add_open3d_axis(vis, o3d):
+    """Add a small 3D axis on Open3D Visualizer"""
+    axis = o3d.geometry.LineSet()
+    axis.points = o3d.utility.Vector3dVector(np.array([
+        [0.0, 0.0, 0.0],
+        [1.0, 0.0, 0.0],
+        [0.0, 1.0, 0.0],
+        [0.0, 0.0, 1.0]]))
+    axis.lines = o3d.utility.Vector2iVector(np.array([
+        [0, 1],
+        [0, 2],
+        [0, 3]]))
+    axis.colors = o3d.utility.Vector3dVector(np.array([
+        [1.0, 0.0, 0.0],
+        [0.0, 1.0, 0.0],
+        [0.0, 0.0, 1.0]]))
+    vis.add_geometry(axis)
+
+
+def _viewer_main(hint, names, max_points, max_samples, stop, period=0.02):
+    import matplotlib.pyplot as plt
+    import open3d as o3d
+
+    shm = [shared_memory.SharedMemory(name=name) for name in names]
+    header, points, colors, samples = _views(shm, max_points, max_samples)
+
+    vis = o3d.visualization.Visualizer()
+    vis.create_window(
+        window_name=hint,
+        width=1920,
+        height=1080,
+        left=480,
+        top=270)
+    vis.get_render_option().background_color = [0.05, 0.05, 0.05]
+    vis.get_render_option().point_size = 1
+    vis.get_render_option().show_coordinate_frame = True
+    _add_open3d_axis(vis, o3d)
+    point_list = o3d.geometry.PointCloud()
+    geometry_added = False
+
+    plt.ion()
+    fig = plt.figure(hint)
+    telemetry = TelemetryPlot(fig)
+    plt.show(block=False)
+
+    sequence = -1
+    plotted = 0
+    try:
+        while not stop.is_set():
+            start = time.perf_counter()
+            if header[0] != sequence:
+                copy = _read_points(header, points, colors)
+                if copy is not None:
+                    sequence = header[0]
+                    point_list.points = o3d.utility.Vector3dVector(copy[0].astype(np.float64))
+                    point_list.colors = o3d.utility.Vector3dVector(copy[1].astype(np.float64))
+                    if not geometry_added:
+                        vis.add_geometry(point_list)
+                        geometry_added = True
+                    vis.update_geometry(point_list)
+            if not vis.poll_events():
+                break
+            vis.update_renderer()
+
+            # plotting repulsive force and control history
+            count = header[2]
+            if count > plotted:
+                new = samples[np.arange(max(plotted, count - max_samples), count) % max_samples]
+                telemetry.push(new[:, 1:])
+                telemetry.draw()
+                plotted = count
+            else:
+                fig.canvas.flush_events()
+
+            time.sleep(max(0.0, period - (time.perf_counter() - start)))
+    finally:
+        vis.destroy_window()
+        plt.close(fig)
+        del header, points, colors, samples
+        for s in shm:
+            s.close()
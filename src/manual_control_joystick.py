@@ -64,9 +64,6 @@ from __future__ import print_function
 import glob
 import os
 import sys
-import pickle
-
-import matplotlib.pyplot as plt
 
 try:
     sys.path.append(glob.glob('../carla/dist/carla-*%d.%d-%s.egg' % (
@@ -95,10 +92,7 @@ random.seed(74)
 import re
 import weakref
 import cv2
-import open3d as o3d
 import time
-from statistics import median
-import scipy.cluster.hierarchy as hcluster
 
 try:
     import pygame
@@ -149,11 +143,16 @@ try:
 except ImportError:
     raise RuntimeError('cannot import numpy, make sure numpy package is installed')
 
-try:
-    import cupy as cp
-    print('cupy import success')
-except ImportError:
-    print('cupy not found, using numpy')
+import apf_backend
+import apf_fleet
+import lidar_apf
+from actor_state import ActorStateTable
+from debug_draw import DebugDraw
+from lidar_pipeline import FrameWorker
+from lidar_recorder import LidarRecorder
+from lidar_viewer import LidarViewer
+from spatial_index import UniformGrid
+from streaming_filters import DEFAULT_FORCE_FILTER, make_filter
 
 
 # ==============================================================================
@@ -204,7 +203,7 @@ def get_actor_blueprints(world, filter, generation):
 
 
 class World(object):
-    def __init__(self, carla_world, hud, args):
+    def __init__(self, carla_world, hud, args, lidar_recorder=None):
         self.world = carla_world
         self.sync = args.sync
         self.actor_role_name = args.rolename
@@ -221,6 +220,7 @@ class World(object):
         self.camera_right = None
         self.camera_back = None
         self.semantic_lidar = None
+        self.lidar_recorder = lidar_recorder
         self.collision_sensor = None
         self.lane_invasion_sensor = None
         self.gnss_sensor = None
@@ -232,6 +232,7 @@ class World(object):
         self._actor_filter = args.filter
         self._actor_generation = args.generation
         self._gamma = args.gamma
+        self._force_filters = args.force_filter or (DEFAULT_FORCE_FILTER,)
         self.restart()
         self.world.on_tick(hud.on_world_tick)
         self.recording_enabled = False
@@ -301,7 +302,8 @@ class World(object):
         self.camera_left = SideViewSensor(self.player, "Left Camera", 1)
         self.camera_right = SideViewSensor(self.player, "Right Camera", 2)
         self.camera_back = SideViewSensor(self.player, "Back Camera", 3)
-        self.semantic_lidar = SemanticLidarSensor(self.player, "Semantic Lidar")
+        self.semantic_lidar = SemanticLidarSensor(self.player, "Semantic Lidar", recorder=self.lidar_recorder,
+                                                  force_filters=self._force_filters)
         self.collision_sensor = CollisionSensor(self.player, self.hud)
         self.lane_invasion_sensor = LaneInvasionSensor(self.player, self.hud)
         self.gnss_sensor = GnssSensor(self.player)
@@ -374,6 +376,8 @@ class World(object):
     def destroy(self):
         if self.radar_sensor is not None:
             self.toggle_radar()
+        if self.semantic_lidar is not None:
+            self.semantic_lidar.stop()
         sensors = [
             self.camera_manager.sensor,
             self.camera_left.sensor,
@@ -738,6 +742,7 @@ class HUD(object):
         self._show_info = True
         self._info_text = []
         self._server_clock = pygame.time.Clock()
+        self._vehicle_grid = UniformGrid(cell_size=50.0)
 
     def on_world_tick(self, timestamp):
         self._server_clock.tick()
@@ -778,6 +783,14 @@ class HUD(object):
             'GNSS:% 24s' % ('(% 2.6f, % 3.6f)' % (world.gnss_sensor.lat, world.gnss_sensor.lon)),
             'Height:  % 18.0f m' % t.location.z,
             '']
+        lidar_worker = world.semantic_lidar.worker
+        if lidar_worker is not None:
+            self._info_text += [
+                'Lidar queue:  % 13.1f ms' % (1e3 * lidar_worker.queue_latency),
+                'Lidar compute:% 13.1f ms' % (1e3 * lidar_worker.compute_latency),
+                'Lidar dropped:% 16d' % lidar_worker.dropped,
+                'Lidar errors: % 16d' % lidar_worker.errors,
+                '']
         if isinstance(c, carla.VehicleControl):
             self._info_text += [
                 ('Throttle:', c.throttle, 0.0, 1.0),
@@ -799,13 +812,14 @@ class HUD(object):
             'Number of vehicles: % 8d' % len(vehicles)]
         if len(vehicles) > 1:
             self._info_text += ['Nearby vehicles:']
-            distance = lambda l: math.sqrt(
-                (l.x - t.location.x) ** 2 + (l.y - t.location.y) ** 2 + (l.z - t.location.z) ** 2)
-            vehicles = [(distance(x.get_location()), x) for x in vehicles if x.id != world.player.id]
-            for d, vehicle in sorted(vehicles, key=lambda vehicles: vehicles[0]):
-                if d > 200.0:
-                    break
-                vehicle_type = get_actor_display_name(vehicle, truncate=22)
+            # locations come from one snapshot, the grid only looks at the cells around the player
+            vehicles = [x for x in vehicles if x.id != world.player.id]
+            states = ActorStateTable.from_snapshot(world.world.get_snapshot(), [x.id for x in vehicles])
+            by_id = {x.id: x for x in vehicles}
+            self._vehicle_grid.update(states.location)
+            rows, distances = self._vehicle_grid.radius((t.location.x, t.location.y, t.location.z), 200.0, sort=True)
+            for row, d in zip(rows, distances):
+                vehicle_type = get_actor_display_name(by_id[int(states.ids[row])], truncate=22)
                 self._info_text.append('% 4dm %s' % (d, vehicle_type))
 
     def toggle_info(self):
@@ -977,10 +991,10 @@ class SideViewSensor(object):
             return
         # render an image and show in cv2
         image.convert(cc.Raw)
-        array = cp.frombuffer(image.raw_data, dtype=cp.dtype("uint8"))
-        array = cp.reshape(array, (image.height, image.width, 4))
+        array = np.frombuffer(image.raw_data, dtype=np.dtype("uint8"))
+        array = np.reshape(array, (image.height, image.width, 4))
         array = array[:, :, :3]
-        self.image = cp.asnumpy(array)
+        self.image = array
 
 
 
@@ -991,21 +1005,16 @@ class SideViewSensor(object):
 
 class SemanticLidarSensor(object):
     VEHICLE_ID = 10
-    VEHICLE_COLORS = cp.array([
-        (0, 100, 100),                  # inside bounding box (own vehicle)
-        (255, 50, 50),                  # outside bounding box (other vehicle)
-        (255, 0, 0),
-        (0, 255, 0),
-        (0, 0, 255),
-        (255, 255, 0),
-        (255, 0, 255),
-        (0, 255, 255),
-        (255, 255, 255),
-        (255, 100, 100),
-        (100, 255, 100),
-        (100, 100, 255),
-    ]) / 255.0
-    LABEL_COLORS = cp.array([
+    LIDAR_ATTRIBUTES = {
+        'upper_fov': 10.0,
+        'lower_fov': -25.0,
+        'channels': 64,
+        'range': 60,
+        'points_per_second': 560000,
+    }
+    LIDAR_DELTA = 0.05
+    VEHICLE_COLORS = lidar_apf.VEHICLE_COLORS
+    LABEL_COLORS = np.array([
         (255, 255, 255),  # None
         (70, 70, 70),  # Building
         (100, 40, 40),  # Fences
@@ -1031,13 +1040,22 @@ class SemanticLidarSensor(object):
         (145, 170, 100),  # Terrain
     ]) / 255.0  # normalize each channel [0-1] since is what Open3D uses
 
-    def __init__(self, parent_actor, hint):
+    def __init__(self, parent_actor, hint, autopilot=False, visualize=True, recorder=None, threaded=True,
+                 force_filters=(DEFAULT_FORCE_FILTER,)):
         self.sensor = None
         self.image = None
         # self.sensor_r = None
-        self.history = collections.deque(maxlen=11)
+        # the first filter drives the throttle, the others are only kept for comparison
+        self.filters = [make_filter(spec, 1.0 / SemanticLidarSensor.LIDAR_DELTA) for spec in force_filters]
+        self.filtered = [0] * len(self.filters)
         self.vehicle_repl_force = 0
         self.median = 0
+        self.throttle = 0
+        self.brake = 0
+        self.viewer = None
+        self.recorder = recorder
+        self.autopilot = autopilot
+        self.worker = None
         self._parent = parent_actor
         self.hint = hint
         self.frame = 0
@@ -1047,89 +1065,46 @@ class SemanticLidarSensor(object):
             self._parent.bounding_box.extent.z + 0.5,
         ])
         print('bbox: ', self.bbox)
+        self._vehicle_colors = apf_backend.xp.asarray(SemanticLidarSensor.VEHICLE_COLORS)
 
         lidar_transform = carla.Transform(carla.Location(x=-0.5, z=1.8))
 
         world = self._parent.get_world()
-        lidar_bp = SemanticLidarSensor.generate_lidar_bp(world)
+        lidar_bp = SemanticLidarSensor.generate_lidar_bp(world, SemanticLidarSensor.LIDAR_DELTA)
         self.sensor = world.spawn_actor(lidar_bp, lidar_transform, attach_to=self._parent)
 
-        self.point_list = o3d.geometry.PointCloud()
         # We need to pass the lambda a weak reference to self to avoid circular
         # reference.
         weak_self = weakref.ref(self)
+        if threaded:
+            # only the freshest frame is processed, stale ones are dropped
+            self.worker = FrameWorker(lambda data: SemanticLidarSensor._process_frame(weak_self, data), name=hint)
         self.sensor.listen(lambda data: SemanticLidarSensor._semantic_lidar_callback(weak_self, data))
 
-        self.vis = o3d.visualization.Visualizer()
-        self.vis.create_window(
-            window_name=self.hint,
-            width=1920,
-            height=1080,
-            left=480,
-            top=270)
-        self.vis.get_render_option().background_color = [0.05, 0.05, 0.05]
-        self.vis.get_render_option().point_size = 1
-        self.vis.get_render_option().show_coordinate_frame = True
-        self.add_open3d_axis()
-
-        plt.ion()
-        self.ax: plt.Axes = None
-        self.fig: plt.Figure = None
-        self.fig, self.ax = plt.subplots()
-        self.x_interval = 100
-        self.ax.set_xlim(-self.x_interval, self.x_interval)
-        self.fig.canvas.draw()
-        plt.show(block=False)
+        if visualize:
+            # Open3D and the force plot run in their own process, publishing never waits for them
+            self.viewer = LidarViewer(self.hint)
 
     @staticmethod
     def generate_lidar_bp(world, delta = 0.05):
         """Generates a CARLA blueprint based on the script parameters"""
         lidar_bp = world.get_blueprint_library().find('sensor.lidar.ray_cast_semantic')
 
-        lidar_bp.set_attribute('upper_fov', '10.0')
-        lidar_bp.set_attribute('lower_fov', '-25.0')
-        lidar_bp.set_attribute('channels', '64')
-        lidar_bp.set_attribute('range', '60')
+        for key, value in SemanticLidarSensor.LIDAR_ATTRIBUTES.items():
+            lidar_bp.set_attribute(key, str(value))
         lidar_bp.set_attribute('rotation_frequency', str(1.0 / delta))
-        lidar_bp.set_attribute('points_per_second', '560000')
         return lidar_bp
 
-    def add_open3d_axis(self):
-        """Add a small 3D axis on Open3D Visualizer"""
-        axis = o3d.geometry.LineSet()
-        axis.points = o3d.utility.Vector3dVector(np.array([
-            [0.0, 0.0, 0.0],
-            [1.0, 0.0, 0.0],
-            [0.0, 1.0, 0.0],
-            [0.0, 0.0, 1.0]]))
-        axis.lines = o3d.utility.Vector2iVector(np.array([
-            [0, 1],
-            [0, 2],
-            [0, 3]]))
-        axis.colors = o3d.utility.Vector3dVector(np.array([
-            [1.0, 0.0, 0.0],
-            [0.0, 1.0, 0.0],
-            [0.0, 0.0, 1.0]]))
-        self.vis.add_geometry(axis)
+    def stop(self):
+        if self.worker is not None:
+            self.worker.stop()
+            self.worker = None
+        if self.viewer is not None:
+            self.viewer.close()
+            self.viewer = None
 
     def render(self):
-        if self.frame == 2:
-            self.vis.add_geometry(self.point_list)
-        self.vis.update_geometry(self.point_list)
-
-        self.vis.poll_events()
-        self.vis.update_renderer()
-        self.ax.set_xlim(self.frame - self.x_interval, self.frame + self.x_interval)
-        # if self.vehicle_repl_force > -10:
-
-        # plotting repulsive force history
-        self.ax.plot([self.frame], [self.vehicle_repl_force], 'ro')
-        self.ax.plot([self.frame], [self.median], 'bo')
-        plt.draw()
-        plt.pause(0.01)
-
-        # # This can fix Open3D jittering issues:
-        # time.sleep(0.005)
+        # drawing happens in the viewer process
         self.frame += 1
 
     @staticmethod
@@ -1138,99 +1113,66 @@ class SemanticLidarSensor(object):
         compute the vehicle's throttle based on repl force and attr force
         return: throttle value, ranged [0.0, 1.0]
         '''
-        x = attr - repl
-        if x > threshold:
-            return 1, 0
-        elif x < -threshold:
-            return 0, 1
-        return round(1 / (1 + math.exp(-x)), 3), 0 # sigmoid function
+        # the same sigmoid law drives the whole fleet in apf_fleet
+        throttle, brake = apf_fleet.throttle_control(repl, attr, threshold)
+        return float(throttle), float(brake)
 
 
     @staticmethod
-    def _semantic_lidar_callback(weak_self, point_cloud, autopilot = False, save_sample = False):
+    def _semantic_lidar_callback(weak_self, point_cloud):
+        """Hands the frame over to the worker, or processes it right away without one"""
+        self = weak_self()
+        if not self:
+            return
+        data = lidar_apf.parse_frame(point_cloud.raw_data)
+        if self.recorder is not None:                               # keep every frame for offline analysis
+            self.recorder.record(data, point_cloud.frame, point_cloud.timestamp, self._parent.get_transform())
+        if self.worker is None:
+            SemanticLidarSensor._process_frame(weak_self, data)
+        else:
+            # CARLA reuses the buffer once the callback returns
+            self.worker.submit(np.array(data))
+
+    @staticmethod
+    def _process_frame(weak_self, data):
         """Prepares a point cloud with semantic segmentation
         colors ready to be consumed by Open3D"""
         self = weak_self()
+        if not self:
+            return
 
-        # bounding box limits, two points, forming diagonal of the box
-        lim_l = cp.array(-1 * self.bbox)
-        lim_r = cp.array(self.bbox)
+        # compute a repulsive force from other vehicles, ignore own vehicle, errors are logged by the worker
+        forces = lidar_apf.vehicle_forces(data, self.bbox)
+        sum_force = forces.force
 
-        try:
-            # 2d parsing is not supported by cupy yet
-            # so use numpy to parse, and then convert to cupy to handle heavy computation
-            data = np.frombuffer(point_cloud.raw_data, dtype=np.dtype([
-                ('x', np.float32), ('y', np.float32), ('z', np.float32),
-                ('CosAngle', np.float32), ('ObjIdx', np.uint32), ('ObjTag', np.uint32)]))
-            if self.frame == 100 and save_sample:                       # save a sample for inspection
-                print('pickle!')
-                pickle.dump(data, open('data.pkl', 'wb'))
-
-            # filter to get vehicle points
-            data = data[np.in1d(data['ObjTag'], np.array([10]))]
-
-            # convert numpy to cupy
-            vehicle_pts_cos = cp.array(data['CosAngle'])
-            # vehicle_pts_sin = cp.sqrt(1 - vehicle_pts_cos ** 2)
-
-            # We're negating the y to correclty visualize a world that matches
-            # what we see in Unreal since Open3D uses a right-handed coordinate system
-            vehicle_pts = cp.array([data['x'], -data['y'], data['z']]).T
-            assert vehicle_pts.shape[0] == vehicle_pts_cos.shape[0], \
-                f'pts{vehicle_pts.shape}!=cos{vehicle_pts_cos.shape}'
-
-            cluster_thresh = 0.75
-            clusters = hcluster.fclusterdata(cp.asnumpy(vehicle_pts), cluster_thresh, criterion="distance").astype(
-                np.uint8) + 1
-
-            # filter point cloud within bounding box (own vehicle) and outside (other vehicles)
-            bbox_mask = cp.all(cp.logical_and(lim_l <= vehicle_pts, vehicle_pts <= lim_r), axis=1)
-            # in_box_pc = vehicle_pc[bbox_mask]
-            out_box_pts = vehicle_pts[cp.logical_not(bbox_mask)]
-            out_box_pts_cos = vehicle_pts_cos[cp.logical_not(bbox_mask)]
-
-            # compute a repulsive force from other vehicles
-            # ignore own vehicle
-            distances = cp.sqrt(cp.sum(out_box_pts * out_box_pts, axis=1))
-
-            # calculate a sum force
-            threshold = 20
-            force = 1e5 * (threshold - distances) / cp.sum(distances*distances*distances) / threshold
-            sum_force = float(cp.sum(force*out_box_pts_cos))
-        except Exception as e:
-            raise e
-            exit(1)
-
-        # round to 2 decimal places, then maintain a fixed-length history for navigating
+        # round to 2 decimal places, then filter the force for navigating
         self.vehicle_repl_force = round(sum_force, 2)
         if self.vehicle_repl_force < -5:
             print(f'warning: repulsive negative {self.vehicle_repl_force}')
-        self.history.appendleft(self.vehicle_repl_force)
-        if len(self.history) < self.history.maxlen:
-            self.median = 0
-        else:
-            self.median = median(self.history)
+        self.filtered = [f.update(self.vehicle_repl_force) for f in self.filters]
+        self.median = self.filtered[0]
 
         # compute throttle based on repulsive force
-        if autopilot:
-            throttle, brake = SemanticLidarSensor._vehicle_throttle_control(self.median)
-            self._parent.apply_control(carla.VehicleControl(throttle=throttle, brake=brake, steer=0.0))
+        self.throttle, self.brake = SemanticLidarSensor._vehicle_throttle_control(self.median)
+        if self.autopilot:
+            self._parent.apply_control(carla.VehicleControl(throttle=self.throttle, brake=self.brake, steer=0.0))
         # points = np.array([data['x'], -data['y'], data['z']]).T
 
         # # An example of adding some noise to our data if needed:
         # points += np.random.uniform(-0.05, 0.05, size=points.shape)
 
         # Colorize the pointcloud based on the CityScapes color palette
-        labels = cp.logical_not(bbox_mask).astype(cp.uint8)  # np.array(data['ObjTag'])
-        labels *= (cp.array(clusters))
-        vehicle_color = SemanticLidarSensor.VEHICLE_COLORS[labels]
+        # one color per object instance, the first color is reserved for the own vehicle
+        vehicle_color = lidar_apf.colorize(forces, self._vehicle_colors)
 
         # # In case you want to make the color intensity depending
         # # of the incident ray angle, you can use:
         # int_color *= np.array(data['CosAngle'])[:, None]
 
-        self.point_list.points = o3d.utility.Vector3dVector(cp.asnumpy(vehicle_pts))
-        self.point_list.colors = o3d.utility.Vector3dVector(cp.asnumpy(vehicle_color))
+        if self.viewer is not None:
+            self.viewer.publish_points(apf_backend.asnumpy(forces.points), apf_backend.asnumpy(vehicle_color))
+            self.viewer.publish_sample(
+                self.frame, self.vehicle_repl_force, self.median, self.throttle, self.brake)
 
 # ==============================================================================
 # -- CollisionSensor -----------------------------------------------------------
@@ -1384,7 +1326,8 @@ class RadarSensor(object):
 
         self.velocity_range = 7.5  # m/s
         world = self._parent.get_world()
-        self.debug = world.debug
+        # one batch of draw calls per radar frame, the fastest detections first
+        self.debug = DebugDraw(world.debug, max_per_flush=150)
         bp = world.get_blueprint_library().find('sensor.other.radar')
         bp.set_attribute('horizontal_fov', str(35))
         bp.set_attribute('vertical_fov', str(20))
@@ -1429,12 +1372,14 @@ class RadarSensor(object):
             r = int(clamp(0.0, 1.0, 1.0 - norm_velocity) * 255.0)
             g = int(clamp(0.0, 1.0, 1.0 - abs(norm_velocity)) * 255.0)
             b = int(abs(clamp(- 1.0, 0.0, - 1.0 - norm_velocity)) * 255.0)
-            self.debug.draw_point(
+            self.debug.point(
                 radar_data.transform.location + fw_vec,
                 size=0.075,
                 life_time=0.06,
                 persistent_lines=False,
-                color=carla.Color(r, g, b))
+                color=carla.Color(r, g, b),
+                priority=abs(norm_velocity))
+        self.debug.flush()
 
 
 # ==============================================================================
@@ -1615,6 +1560,7 @@ def game_loop(args):
 
     world = None
     original_settings = None
+    lidar_recorder = LidarRecorder(args.record_lidar) if args.record_lidar else None
 
     try:
         client = carla.Client(args.host, args.port)
@@ -1645,7 +1591,7 @@ def game_loop(args):
         pygame.display.flip()
 
         hud = HUD(args.width, args.height)
-        world = World(sim_world, hud, args)
+        world = World(sim_world, hud, args, lidar_recorder)
         controller = KeyboardControl(world, args.autopilot)
 
         if args.sync:
@@ -1675,6 +1621,9 @@ def game_loop(args):
         if world is not None:
             world.destroy()
 
+        if lidar_recorder is not None:
+            lidar_recorder.close()
+
         pygame.quit()
 
 
@@ -1736,6 +1685,21 @@ def main():
         '--sync',
         action='store_true',
         help='Activate synchronous mode execution')
+    argparser.add_argument(
+        '--backend',
+        default='numpy',
+        choices=apf_backend.BACKENDS,
+        help='array backend of the lidar force pipeline (default: numpy)')
+    argparser.add_argument(
+        '--record-lidar',
+        metavar='DIR',
+        help='record every semantic lidar frame to this directory')
+    argparser.add_argument(
+        '--force-filter',
+        action='append',
+        metavar='SPEC',
+        help='filter of the repulsive force, e.g. median:11, median:2s, ema:0.2, kalman:0.5:4; '
+             'repeat to run several, the first drives the throttle (default: %s)' % DEFAULT_FORCE_FILTER)
     args = argparser.parse_args()
 
     args.width, args.height = [int(x) for x in args.res.split('x')]
@@ -1744,6 +1708,7 @@ def main():
     logging.basicConfig(format='%(levelname)s: %(message)s', level=log_level)
 
     logging.info('listening to server %s:%s', args.host, args.port)
+    apf_backend.select_backend(args.backend)
 
     print(__doc__)
 
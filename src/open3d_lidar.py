@@ -29,6 +29,9 @@ except IndexError:
 
 import carla
 
+from lidar_geometry import LidarGeometry
+from lidar_range_image import RangeImage
+
 VIRIDIS = np.array(cm.get_cmap('plasma').colors)
 VID_RANGE = np.linspace(0.0, 1.0, VIRIDIS.shape[0])
 LABEL_COLORS = np.array([
@@ -115,6 +118,34 @@ def semantic_lidar_callback(point_cloud, point_list):
     point_list.colors = o3d.utility.Vector3dVector(int_color)
 
 
+def range_image_callback(point_cloud, point_list, geometry, sensor_height, semantic):
+    """Prepares a point cloud colored by the obstacle clusters
+    of its range image, ready to be consumed by Open3D"""
+    if semantic:
+        data = np.frombuffer(point_cloud.raw_data, dtype=np.dtype([
+            ('x', np.float32), ('y', np.float32), ('z', np.float32),
+            ('CosAngle', np.float32), ('ObjIdx', np.uint32), ('ObjTag', np.uint32)]))
+        x, y, z = data['x'], data['y'], data['z']
+    else:
+        data = np.reshape(np.frombuffer(point_cloud.raw_data, dtype=np.dtype('f4')), (-1, 4))
+        x, y, z = data[:, 0], data[:, 1], data[:, 2]
+
+    # Segment the ground, then cluster the remaining rays
+    image = RangeImage(geometry, x, y, z)
+    ground = image.ground_mask(sensor_height)
+    labels = image.point_labels(image.components(mask=np.logical_not(ground)))
+
+    int_color = np.tile(LABEL_COLORS[0], (x.shape[0], 1))
+    int_color[image.point_labels(ground)] = LABEL_COLORS[7]
+    clustered = labels >= 0
+    int_color[clustered] = VIRIDIS[(labels[clustered] * 37) % VIRIDIS.shape[0]]
+
+    # We're negating the y to correclty visualize a world that matches
+    # what we see in Unreal since Open3D uses a right-handed coordinate system
+    point_list.points = o3d.utility.Vector3dVector(np.stack((x, -y, z), axis=1))
+    point_list.colors = o3d.utility.Vector3dVector(int_color)
+
+
 def generate_lidar_bp(arg, world, blueprint_library, delta):
     """Generates a CARLA blueprint based on the script parameters"""
     if arg.semantic:
@@ -189,7 +220,11 @@ def main(arg):
         lidar = world.spawn_actor(lidar_bp, lidar_transform, attach_to=vehicle)
 
         point_list = o3d.geometry.PointCloud()
-        if arg.semantic:
+        if arg.range_image:
+            geometry = LidarGeometry.from_attributes(vars(arg), 1.0 / delta)
+            sensor_height = lidar_transform.location.z
+            lidar.listen(lambda data: range_image_callback(data, point_list, geometry, sensor_height, arg.semantic))
+        elif arg.semantic:
             lidar.listen(lambda data: semantic_lidar_callback(data, point_list))
         else:
             lidar.listen(lambda data: lidar_callback(data, point_list))
@@ -261,6 +296,11 @@ if __name__ == "__main__":
         action='store_true',
         help='use the semantic lidar instead, which provides ground truth'
         ' information')
+    argparser.add_argument(
+        '--range-image',
+        action='store_true',
+        help='color the points by the ground and obstacle clusters'
+        ' segmented on the range image')
     argparser.add_argument(
         '--no-noise',
         action='store_true',
@@ -0,0 +1,67 @@
+"""Rigid transforms between the world and actor frames.
+
+A carla.Transform is a rotation followed by a translation, so its inverse is
+the transposed rotation and a rotated translation; no general 4x4 inverse is
+needed. Points and vectors are (n, 3) arrays mapped in one matrix product,
+vectors (velocities, directions) only get the rotation.
+"""
+
+import numpy as np
+
+
+def rotation_matrix(pitch, yaw, roll):
+    '''
+    compute the rotation of a carla.Rotation, same as the upper left block of carla.Transform.get_matrix()
+    pitch, yaw, roll: degrees
+    return: (3, 3) rotation matrix
+    '''
+    pitch, yaw, roll = np.radians((pitch, yaw, roll))
+    c_p, s_p = np.cos(pitch), np.sin(pitch)
+    c_y, s_y = np.cos(yaw), np.sin(yaw)
+    c_r, s_r = np.cos(roll), np.sin(roll)
+    return np.array([
+        [c_p * c_y, c_y * s_p * s_r - s_y * c_r, -c_y * s_p * c_r - s_y * s_r],
+        [s_y * c_p, s_y * s_p * s_r + c_y * c_r, -s_y * s_p * c_r + c_y * s_r],
+        [s_p, -c_p * s_r, c_p * c_r]])
+
+
+class RigidTransform(object):
+    """x -> rotation @ x + translation"""
+
+    def __init__(self, rotation, translation):
+        self.rotation = np.asarray(rotation, dtype=np.float64)
+        self.translation = np.asarray(translation, dtype=np.float64)
+
+    @classmethod
+    def from_pose(cls, location, pitch=0.0, yaw=0.0, roll=0.0):
+        """Transform from an actor's frame to the world, location is (x, y, z) and the angles are degrees"""
+        return cls(rotation_matrix(pitch, yaw, roll), location)
+
+    @classmethod
+    def from_carla(cls, transform):
+        """Same mapping as the carla.Transform, from its local frame to the world"""
+        location, rotation = transform.location, transform.rotation
+        return cls.from_pose((location.x, location.y, location.z), rotation.pitch, rotation.yaw, rotation.roll)
+
+    def inverse(self):
+        rotation = self.rotation.T
+        return RigidTransform(rotation, -rotation @ self.translation)
+
+    def compose(self, other):
+        """Transform applying other first, then self"""
+        return RigidTransform(self.rotation @ other.rotation, self.rotation @ other.translation + self.translation)
+
+    def matrix(self):
+        """(4, 4) homogeneous matrix"""
+        matrix = np.eye(4)
+        matrix[:3, :3] = self.rotation
+        matrix[:3, 3] = self.translation
+        return matrix
+
+    def apply_points(self, points):
+        """Maps (n, 3) or (3,) points"""
+        return np.asarray(points, dtype=np.float64) @ self.rotation.T + self.translation
+
+    def apply_vectors(self, vectors):
+        """Maps (n, 3) or (3,) vectors, e.g. velocities, only rotating them"""
+        return np.asarray(vectors, dtype=np.float64) @ self.rotation.T
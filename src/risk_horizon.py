@@ -0,0 +1,155 @@
+"""Collision risk of the neighbours over a prediction horizon.
+
+The ego vehicle and every neighbour are propagated over K future steps with a
+constant turn rate and velocity model (constant velocity when the yaw rate is
+ignored or 0). Step k of neighbour i becomes a pose relative to the predicted
+ego pose at that time, the relative position is a Gaussian whose covariance
+grows with the prediction time, faster along the direction of travel than
+across it. The probabilities of the whole (N, K) tensor come from one batched
+collision_probability call with a covariance per element.
+
+Elements whose mean is too far from the ego octagon for any mass to reach it
+are not evaluated. The remaining ones are evaluated within a time budget per
+tick, the neighbours that come closest first, the closest one even over the
+budget; the cost of an element is measured as it goes.
+"""
+
+import math
+import time
+
+import numpy as np
+
+from collision_probability import collision_probability
+
+_MIN_YAW_RATE = 1e-3    # radians per second, slower turns are propagated as straight lines
+
+
+def propagate(position, velocity, yaw, yaw_rate, times):
+    '''
+    predict planar poses, the velocity turns with the yaw rate and keeps its norm
+    position, velocity: (n, 2) in the world frame
+    yaw: (n,) heading of the bodies, radians
+    yaw_rate: (n,) radians per second, 0 for constant velocity
+    times: (k,) seconds ahead
+    return: (n, k, 2) positions, (n, k) yaws
+    '''
+    position = np.asarray(position, dtype=np.float64)
+    velocity = np.asarray(velocity, dtype=np.float64)
+    w = np.asarray(yaw_rate, dtype=np.float64)[:, None]
+    t = np.asarray(times, dtype=np.float64)[None, :]
+    turn = w * t
+    straight = np.abs(w) < _MIN_YAW_RATE
+    safe_w = np.where(straight, 1.0, w)
+    # integral of the turning velocity: sin(wt) / w along it, (1 - cos(wt)) / w to its left
+    along = np.where(straight, t, np.sin(turn) / safe_w)
+    left = np.where(straight, 0.5 * turn * t, (1.0 - np.cos(turn)) / safe_w)
+    vx, vy = velocity[:, 0:1], velocity[:, 1:2]
+    predicted = np.empty(turn.shape + (2,))
+    predicted[..., 0] = position[:, 0:1] + vx * along - vy * left
+    predicted[..., 1] = position[:, 1:2] + vy * along + vx * left
+    return predicted, np.asarray(yaw, dtype=np.float64)[:, None] + turn
+
+
+class RiskHorizon(object):
+    """Max collision probability of each neighbour over the next steps * dt seconds"""
+
+    def __init__(self, steps=6, dt=0.5, model='ctrv', sigma=1.0, along_growth=1.0, cross_growth=0.3,
+                 budget=0.005, margin=6.0):
+        '''
+        model: 'ctrv' turns with the measured yaw rates, 'cv' keeps the velocities
+        sigma: standard deviation of the relative position now, meters
+        along_growth, cross_growth: growth of the standard deviation of every vehicle's position along and across
+            its heading, meters per second of prediction
+        budget: seconds of evaluation per tick at most
+        margin: means farther than this many standard deviations from the octagon count as no risk
+        '''
+        if model not in ('ctrv', 'cv'):
+            raise ValueError('unknown motion model %r, expected ctrv or cv' % model)
+        self.times = dt * np.arange(1, steps + 1)
+        self.model = model
+        self.sigma = sigma
+        self.along_growth = along_growth
+        self.cross_growth = cross_growth
+        self.budget = budget
+        self.margin = margin
+        self.cost = 2e-5        # measured seconds per evaluated element
+        self.evaluated = 0      # elements evaluated in the last tick
+        self.skipped = 0        # neighbours left out of the last tick by the budget
+
+    def evaluate(self, ego, neighbours, ego_len=4.8, ego_wid=1.8, traffic_len=4.8, traffic_wid=1.8):
+        '''
+        compute the risk of the neighbours over the horizon
+        ego: ActorStateTable of the ego vehicle alone
+        neighbours: ActorStateTable of the traffic vehicles
+        traffic_len, traffic_wid: scalars or (n,) arrays
+        return: (n,) max probability, (n,) seconds ahead it is reached;
+                nan for neighbours over the budget, the time is nan when there is no risk
+        '''
+        n, k = len(neighbours), self.times.shape[0]
+        risk = np.zeros(n)
+        when = np.full(n, np.nan)
+        self.evaluated = self.skipped = 0
+        if n == 0:
+            return risk, when
+
+        turning = self.model == 'ctrv'
+        ego_position, ego_yaw = propagate(
+            ego.location[:, :2], ego.velocity[:, :2], np.radians(ego.yaw),
+            np.radians(ego.yaw_rate) if turning else np.zeros(1), self.times)
+        position, yaw = propagate(
+            neighbours.location[:, :2], neighbours.velocity[:, :2], np.radians(neighbours.yaw),
+            np.radians(neighbours.yaw_rate) if turning else np.zeros(n), self.times)
+
+        # (n, k) poses in the predicted ego frames
+        c, s = np.cos(ego_yaw), np.sin(ego_yaw)
+        offset = position - ego_position
+        x = c * offset[..., 0] + s * offset[..., 1]
+        y = c * offset[..., 1] - s * offset[..., 0]
+        angle = yaw - ego_yaw
+        traffic_len = np.broadcast_to(np.asarray(traffic_len, dtype=np.float64)[..., None], (n, k))
+        traffic_wid = np.broadcast_to(np.asarray(traffic_wid, dtype=np.float64)[..., None], (n, k))
+
+        # both positions drift, the neighbour's along its own heading, the ego's along its x axis
+        t2 = self.times * self.times
+        along2 = (self.along_growth * self.along_growth) * t2
+        cross2 = (self.cross_growth * self.cross_growth) * t2
+        ca, sa = np.cos(angle), np.sin(angle)
+        covariance = np.empty((n, k, 2, 2))
+        covariance[..., 0, 0] = self.sigma * self.sigma + along2 * (1.0 + ca * ca) + cross2 * sa * sa
+        covariance[..., 1, 1] = self.sigma * self.sigma + cross2 * (1.0 + ca * ca) + along2 * sa * sa
+        covariance[..., 0, 1] = covariance[..., 1, 0] = (along2 - cross2) * ca * sa
+
+        # no mass reaches the octagon from beyond its circumcircle plus margin times the largest deviation
+        reach = 0.5 * (math.hypot(ego_len, ego_wid) + np.hypot(traffic_len, traffic_wid))
+        deviation = np.sqrt(covariance[..., 0, 0] + covariance[..., 1, 1])
+        distance = np.hypot(x, y)
+        near = distance <= reach + self.margin * deviation
+
+        # the budget goes to the neighbours that come closest, whole horizons at a time
+        counts = near.sum(axis=1)
+        order = np.argsort(np.min(distance, axis=1), kind='stable')
+        order = order[counts[order] > 0]
+        capacity = int(self.budget / self.cost)
+        fits = np.cumsum(counts[order]) <= capacity
+        # the closest is always evaluated, so the cost keeps being measured and recovers after a slow tick
+        fits[:1] = True
+        over = order[~fits]
+        risk[over] = np.nan
+        self.skipped = over.shape[0]
+        near[over] = False
+
+        count = int(near.sum())
+        if count:
+            started = time.perf_counter()
+            probability = np.zeros((n, k))
+            probability[near] = collision_probability(
+                x[near], y[near], angle[near], ego_len, ego_wid, traffic_len[near], traffic_wid[near],
+                covariance[near])
+            # a single tick is noisy, average the cost over a few
+            self.cost = 0.8 * self.cost + 0.2 * (time.perf_counter() - started) / count
+            self.evaluated = count
+            rows = order[fits]
+            step = np.argmax(probability[rows], axis=1)
+            risk[rows] = probability[rows, step]
+            when[rows] = np.where(risk[rows] > 0, self.times[step], np.nan)
+        return risk, when
@@ -18,6 +18,10 @@ import time
 import numpy as np
 import cv2
 
+from apf_grid import ObstacleGrid
+from apf_planner import APFPlanner
+from rigid_transform import RigidTransform
+
 logging.basicConfig(stream=sys.stdout, level=logging.DEBUG)
 
 IM_WIDTH, IM_HEIGHT = 1920, 1080
@@ -78,9 +82,14 @@ def main():
 
         L = 4.7  # 车长
 
-        P0 = np.array(vehicle.get_location())  # 车辆起点位置，分别代表x,y,vx,vy
+        # 道路坐标系: 以出生点为原点, x 沿道路方向, y 指向右侧
+        road_to_world = RigidTransform.from_carla(sel_point)
+        world_to_road = road_to_world.inverse()
+
+        P0 = np.zeros(4)  # 车辆起点位置，分别代表x,y,vx,vy
 
         Pg = np.array([-52,111,0.6,0])  # 目标位置
+        Pg[:2] = world_to_road.apply_points([Pg[0], Pg[1], sel_point.location.z])[:2]
 
         # 障碍物位置
         Pobs = np.array([
@@ -108,6 +117,24 @@ def main():
 
         Num_iter = 300  # 最大循环迭代次数
 
+        planner = APFPlanner(Eta_att, Eta_rep_ob, Eta_rep_edge, d0, len_step, Num_iter,
+                             lane_width=d, vehicle_width=W, speed=np.hypot(Pg[2], Pg[3]), n=n)
+        # 静态场景: 障碍物斥力预先栅格化, 每步只需一次双线性插值
+        started = time.perf_counter()
+        try:
+            field = ObstacleGrid(planner, Pobs, (min(P0[0], Pg[0]) - d0, max(P0[0], Pg[0]) + d0), resolution=0.1)
+        except ValueError as error:
+            logging.warning('planning without the obstacle grid: %s', error)
+            field = None
+        logging.info('obstacle grid built in %.2f ms', 1e3 * (time.perf_counter() - started))
+        started = time.perf_counter()
+        plan = planner.plan(P0[:2], Pg[:2], Pobs[:, :2], field=field)
+        logging.info('planned %d steps in %.2f ms, converged: %s, local minima escaped: %d',
+                     plan.iterations, 1e3 * (time.perf_counter() - started), plan.converged, plan.escapes)
+        path = road_to_world.apply_points(np.c_[plan.path, np.zeros(len(plan.path))])
+        for x, y, z in path:
+            world.debug.draw_point(carla.Location(x, y, z + 0.5), size=0.1,
+                                   color=carla.Color(r=0, g=255, b=0), life_time=10)
 
 
         time.sleep(2)
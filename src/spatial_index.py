@@ -0,0 +1,120 @@
+"""Uniform grid over actor positions for radius and k-nearest queries.
+
+Points are bucketed by their (x, y) cell and kept sorted by cell key, so the
+points of a row of cells are one contiguous slice found by binary search. A
+query only looks at the cells overlapping its circle and filters those
+candidates by exact distance, the distance uses every column of the positions
+(2-D or 3-D).
+
+The grid is meant to be updated every tick from the same actors. When no point
+left its cell the order is kept as is, otherwise the previous order is the
+starting point of a stable sort, which is close to linear for the few points
+that moved.
+"""
+
+import numpy as np
+
+# cell coordinates are offset and packed into one int64 key, row major in x
+_OFFSET = 1 << 20
+_ROW = 1 << 21
+
+
+class UniformGrid(object):
+    """Sorted cell buckets of (n, 2) or (n, 3) positions"""
+
+    def __init__(self, cell_size=25.0):
+        self.cell_size = float(cell_size)
+        self.positions = np.zeros((0, 2))
+        self._keys = np.zeros(0, dtype=np.int64)        # cell key of every point
+        self._order = np.zeros(0, dtype=np.int64)       # points sorted by cell key
+        self._sorted_keys = np.zeros(0, dtype=np.int64)
+        self.resorted = 0                               # updates that had to sort, for diagnostics
+
+    def __len__(self):
+        return self.positions.shape[0]
+
+    def update(self, positions):
+        '''
+        rebuild the grid for new positions, rows should be the same actors as last time where possible
+        positions: (n, 2) or (n, 3) array, x and y are bucketed
+        '''
+        positions = np.asarray(positions, dtype=np.float64)
+        keys = self._cell_keys(positions)
+        same_points = keys.shape == self._keys.shape
+        self.positions = positions
+        if same_points and np.array_equal(keys, self._keys):
+            return
+        if same_points:
+            # nearly sorted already, a stable sort of the previous order only has to move the points that moved
+            order = self._order[np.argsort(keys[self._order], kind='stable')]
+        else:
+            order = np.argsort(keys, kind='stable')
+        self._keys = keys
+        self._order = order
+        self._sorted_keys = keys[order]
+        self.resorted += 1
+
+    def radius(self, center, r, sort=False):
+        '''
+        find the points within r of center
+        center: (2,) or (3,) position, same columns as the grid's positions
+        sort: order the result by distance, closest first
+        return: indices into the positions, distances
+        '''
+        center = np.asarray(center, dtype=np.float64)
+        candidates = self._candidates(center, r)
+        offset = self.positions[candidates] - center
+        distance = np.sqrt(np.sum(offset * offset, axis=1))
+        inside = distance <= r
+        indices, distance = candidates[inside], distance[inside]
+        if sort:
+            order = np.argsort(distance, kind='stable')
+            indices, distance = indices[order], distance[order]
+        return indices, distance
+
+    def knn(self, center, k, max_distance=np.inf):
+        '''
+        find the k points closest to center
+        max_distance: points farther than this are never returned
+        return: indices into the positions, distances, closest first; fewer than k if there are not enough points
+        '''
+        n = len(self)
+        if n == 0 or k <= 0:
+            return np.zeros(0, dtype=np.int64), np.zeros(0)
+        center = np.asarray(center, dtype=np.float64)
+        # the farthest any point can be, once the search circle covers it every point has been seen
+        far = np.max(np.abs(self.positions - center), axis=0)
+        limit = min(max_distance, float(np.sqrt(np.sum(far * far))) + self.cell_size)
+        r = self.cell_size
+        while True:
+            r = min(r, limit)
+            indices, distance = self.radius(center, r)
+            if indices.shape[0] >= k or r >= limit:
+                break
+            r *= 2.0
+        # the k closest of the points within r are the k closest overall since at least k are within r
+        if indices.shape[0] > k:
+            nearest = np.argpartition(distance, k - 1)[:k]
+            indices, distance = indices[nearest], distance[nearest]
+        order = np.argsort(distance, kind='stable')
+        return indices[order], distance[order]
+
+    def _cell_keys(self, positions):
+        cells = np.floor(positions[:, :2] / self.cell_size).astype(np.int64) + _OFFSET
+        return cells[:, 0] * _ROW + cells[:, 1]
+
+    def _candidates(self, center, r):
+        """Points of the cells overlapping the square around the circle"""
+        low = np.floor((center[:2] - r) / self.cell_size).astype(np.int64) + _OFFSET
+        high = np.floor((center[:2] + r) / self.cell_size).astype(np.int64) + _OFFSET
+        rows = np.arange(low[0], high[0] + 1) * _ROW
+        # one contiguous slice of the sorted keys per row of cells
+        starts = np.searchsorted(self._sorted_keys, rows + low[1], side='left')
+        ends = np.searchsorted(self._sorted_keys, rows + high[1], side='right')
+        lengths = ends - starts
+        total = int(lengths.sum())
+        if total == 0:
+            return np.zeros(0, dtype=np.int64)
+        # concatenate the slices without a python loop
+        positions = np.arange(total) - np.repeat(np.cumsum(lengths) - lengths, lengths) + np.repeat(starts, lengths)
+        return self._order[positions]
@@ -0,0 +1,192 @@
+"""Streaming filters for the repulsive force signal.
+
+Every filter takes one sample per lidar frame with update(value) and returns
+the filtered value, in O(log n) for the rolling median and O(1) otherwise.
+Filters are selected by a short spec string, see make_filter:
+
+    median:11       rolling median over 11 frames, 0 until the window is full
+    median:2s       rolling median over 2 seconds of frames
+    ema:0.2         exponential moving average with smoothing factor 0.2
+    ema:0.5s        exponential moving average with a 0.5 second time constant
+    kalman:0.5:4    1-D random walk Kalman filter, process / measurement variance
+"""
+
+import heapq
+import math
+
+FORCE_FILTERS = ('median', 'ema', 'kalman')
+DEFAULT_FORCE_FILTER = 'median:11'
+
+
+class RollingMedian(object):
+    """Median of the last `window` samples, two heaps with lazy deletion"""
+
+    def __init__(self, window=11, fill=0.0):
+        '''
+        window: number of samples
+        fill: returned until the window is full, None for the median of the samples so far
+        '''
+        if window < 1:
+            raise ValueError('window must be at least 1, got %d' % window)
+        self.window = window
+        self.fill = fill
+        self.value = fill
+        self._samples = [0.0] * window     # ring buffer of the window, to know which sample leaves
+        self._count = 0
+        self._low = []                      # max heap (negated) of the lower half
+        self._high = []                     # min heap of the upper half
+        self._low_size = 0                  # heap sizes without the samples pending deletion
+        self._high_size = 0
+        self._pending = {}                  # sample -> times it left the window but is still in a heap
+
+    @property
+    def ready(self):
+        return self._count >= self.window
+
+    def update(self, value):
+        value = float(value)
+        if self._count >= self.window:
+            self._remove(self._samples[self._count % self.window])
+        self._samples[self._count % self.window] = value
+        self._count += 1
+
+        if self._low and value <= -self._low[0] or not (self._high and value >= self._high[0]):
+            heapq.heappush(self._low, -value)
+            self._low_size += 1
+        else:
+            heapq.heappush(self._high, value)
+            self._high_size += 1
+        self._balance()
+        if len(self._low) + len(self._high) > 2 * self.window:
+            self._compact()
+
+        if self.ready or self.fill is None:
+            if self._low_size > self._high_size:
+                self.value = -self._low[0]
+            else:
+                self.value = (-self._low[0] + self._high[0]) / 2.0
+        return self.value
+
+    def _remove(self, value):
+        self._pending[value] = self._pending.get(value, 0) + 1
+        if value <= -self._low[0]:
+            self._low_size -= 1
+            if value == -self._low[0]:
+                self._prune(self._low, -1)
+        else:
+            self._high_size -= 1
+            if value == self._high[0]:
+                self._prune(self._high, 1)
+
+    def _prune(self, heap, sign):
+        """Pops the samples pending deletion from the top of a heap"""
+        while heap:
+            value = sign * heap[0]
+            count = self._pending.get(value, 0)
+            if not count:
+                return
+            if count == 1:
+                del self._pending[value]
+            else:
+                self._pending[value] = count - 1
+            heapq.heappop(heap)
+
+    def _compact(self):
+        """Rebuilds the heaps from the window, drops the buried samples pending deletion"""
+        samples = sorted(self._samples[:min(self._count, self.window)])
+        half = (len(samples) + 1) // 2
+        self._low = [-value for value in reversed(samples[:half])]
+        self._high = samples[half:]
+        self._low_size, self._high_size = len(self._low), len(self._high)
+        self._pending = {}
+
+    def _balance(self):
+        """Keeps the lower half equal to or one larger than the upper half"""
+        while self._low_size > self._high_size + 1:
+            heapq.heappush(self._high, -heapq.heappop(self._low))
+            self._low_size -= 1
+            self._high_size += 1
+            self._prune(self._low, -1)
+        while self._low_size < self._high_size:
+            heapq.heappush(self._low, -heapq.heappop(self._high))
+            self._low_size += 1
+            self._high_size -= 1
+            self._prune(self._high, 1)
+
+
+class EMA(object):
+    """Exponential moving average, starts at the first sample"""
+
+    def __init__(self, alpha=0.2):
+        if not 0.0 < alpha <= 1.0:
+            raise ValueError('alpha must be in (0, 1], got %g' % alpha)
+        self.alpha = alpha
+        self.value = None
+
+    @property
+    def ready(self):
+        return self.value is not None
+
+    def update(self, value):
+        if self.value is None:
+            self.value = float(value)
+        else:
+            self.value += self.alpha * (value - self.value)
+        return self.value
+
+
+class Kalman1D(object):
+    """Kalman filter of a scalar random walk observed with noise"""
+
+    def __init__(self, process_variance=0.5, measurement_variance=4.0):
+        '''
+        process_variance: variance the force drifts by per frame
+        measurement_variance: variance of the force measured in one frame
+        '''
+        self.q = process_variance
+        self.r = measurement_variance
+        self.value = None
+        self.variance = None
+
+    @property
+    def ready(self):
+        return self.value is not None
+
+    def update(self, value):
+        if self.value is None:
+            self.value, self.variance = float(value), self.r
+            return self.value
+        variance = self.variance + self.q
+        gain = variance / (variance + self.r)
+        self.value += gain * (value - self.value)
+        self.variance = (1.0 - gain) * variance
+        return self.value
+
+
+def _frames(text, rate):
+    """Parses a count of frames, or a duration in seconds with an 's' suffix"""
+    if text.endswith('s'):
+        return max(1, int(round(float(text[:-1]) * rate)))
+    return int(text)
+
+
+def make_filter(spec=DEFAULT_FORCE_FILTER, rate=20.0):
+    '''
+    build a filter from a spec string, see the module docstring
+    rate: frames per second, to convert durations
+    return: RollingMedian, EMA or Kalman1D
+    '''
+    name, _, params = spec.partition(':')
+    params = params.split(':') if params else []
+    if name == 'median':
+        return RollingMedian(_frames(params[0], rate) if params else 11)
+    if name == 'ema':
+        if not params:
+            return EMA()
+        if params[0].endswith('s'):
+            # alpha of a first order low pass with this time constant
+            return EMA(1.0 - math.exp(-1.0 / (float(params[0][:-1]) * rate)))
+        return EMA(float(params[0]))
+    if name == 'kalman':
+        return Kalman1D(*[float(p) for p in params])
+    raise ValueError('unknown force filter %r, expected one of %s' % (spec, ', '.join(FORCE_FILTERS)))
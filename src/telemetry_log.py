@@ -0,0 +1,193 @@
+"""Binary log of per tick, per neighbour risk telemetry.
+
+Every record has the fixed RECORD_DTYPE schema: frame, timestamp, actor id,
+pose and velocity relative to the ego vehicle, collision probability and the
+predicted risk. TelemetryLog.append() copies a batch of records into a
+preallocated ring buffer, a background thread periodically moves what is new
+in the ring to the file, so the control loop never formats text or waits on
+disk.
+
+The file is columnar:
+
+    header   MAGIC, uint32 length, JSON description of RECORD_DTYPE
+    blocks   int64 record count, then each column of the block one after another
+
+read_telemetry() turns a file back into one structured array, a block that is
+still being written is ignored.
+
+    python telemetry_log.py telemetry.bin
+"""
+
+import argparse
+import json
+import logging
+import os
+import struct
+import threading
+
+import numpy as np
+
+RECORD_DTYPE = np.dtype([
+    ('frame', np.int64), ('timestamp', np.float64), ('id', np.int64),
+    ('x', np.float32), ('y', np.float32), ('z', np.float32), ('yaw', np.float32),
+    ('vx', np.float32), ('vy', np.float32), ('vz', np.float32),
+    ('probability', np.float32), ('risk', np.float32), ('risk_time', np.float32)])
+MAGIC = b'APFTLM1\n'
+_COUNT = struct.Struct('<q')
+_LENGTH = struct.Struct('<I')
+
+
+class TelemetryLog(object):
+    """Ring buffer of RECORD_DTYPE records, written to a file on a background thread"""
+
+    def __init__(self, path, capacity=1 << 16, flush_interval=1.0):
+        '''
+        capacity: records the ring holds, appends are dropped while it is full of records not written yet
+        flush_interval: seconds between writes, the ring is also written once half full
+        '''
+        self.path = path
+        self.capacity = capacity
+        self.flush_interval = flush_interval
+        self.written = 0
+        self.dropped = 0
+        self._ring = np.zeros(capacity, dtype=RECORD_DTYPE)
+        self._head = 0          # records appended so far, the next one goes to _head % capacity
+        self._tail = 0          # records written so far
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._closing = False
+        self._file = open(path, 'wb')
+        header = json.dumps(RECORD_DTYPE.descr).encode()
+        self._file.write(MAGIC + _LENGTH.pack(len(header)) + header)
+        self._thread = threading.Thread(target=self._write_loop, name='TelemetryLog', daemon=True)
+        self._thread.start()
+
+    def append(self, frame, timestamp, ids, location, velocity, yaw, probability, risk=np.nan, risk_time=np.nan):
+        '''
+        queue one record per actor, never blocks on disk
+        ids: (n,) actor ids
+        location, velocity: (n, 3) in the ego frame
+        yaw: (n,) relative yaw, degrees
+        probability, risk, risk_time: (n,) or scalars
+        '''
+        n = len(ids)
+        if n == 0:
+            return
+        records = np.empty(n, dtype=RECORD_DTYPE)
+        records['frame'] = frame
+        records['timestamp'] = timestamp
+        records['id'] = ids
+        location = np.asarray(location)
+        velocity = np.asarray(velocity)
+        records['x'], records['y'], records['z'] = location[:, 0], location[:, 1], location[:, 2]
+        records['vx'], records['vy'], records['vz'] = velocity[:, 0], velocity[:, 1], velocity[:, 2]
+        records['yaw'] = yaw
+        records['probability'] = probability
+        records['risk'] = risk
+        records['risk_time'] = risk_time
+        with self._lock:
+            if self._head + n - self._tail > self.capacity:
+                self.dropped += n
+                return
+            start = self._head % self.capacity
+            first = min(n, self.capacity - start)
+            self._ring[start:start + first] = records[:first]
+            self._ring[:n - first] = records[first:]
+            self._head += n
+            half_full = self._head - self._tail >= self.capacity // 2
+        if half_full:
+            self._wake.set()
+
+    def close(self):
+        """Writes the records still in the ring and waits for the writer thread"""
+        if self._thread is None:
+            return
+        self._closing = True
+        self._wake.set()
+        self._thread.join()
+        self._thread = None
+        self._file.close()
+        logging.info('logged %d telemetry records to %s, dropped %d', self.written, self.path, self.dropped)
+
+    def _write_loop(self):
+        while True:
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            closing = self._closing
+            self._write_pending()
+            if closing:
+                return
+
+    def _write_pending(self):
+        with self._lock:
+            head = self._head
+        # only this thread moves the tail, the slots up to head are complete and not reused until it does
+        count = head - self._tail
+        if count == 0:
+            return
+        start = self._tail % self.capacity
+        first = min(count, self.capacity - start)
+        block = np.concatenate((self._ring[start:start + first], self._ring[:count - first]))
+        self._file.write(_COUNT.pack(count))
+        for name in RECORD_DTYPE.names:
+            self._file.write(np.ascontiguousarray(block[name]).tobytes())
+        self._file.flush()
+        with self._lock:
+            self._tail = head
+        self.written += count
+
+
+def read_telemetry(path):
+    '''
+    read a telemetry file
+    return: structured array with RECORD_DTYPE, the records in the order they were appended
+    '''
+    with open(path, 'rb') as f:
+        data = f.read()
+    if not data.startswith(MAGIC):
+        raise ValueError('%s is not a telemetry log' % path)
+    offset = len(MAGIC)
+    (length,) = _LENGTH.unpack_from(data, offset)
+    offset += _LENGTH.size
+    dtype = np.dtype([tuple(field) for field in json.loads(data[offset:offset + length].decode())])
+    offset += length
+
+    blocks = []
+    while offset + _COUNT.size <= len(data):
+        (count,) = _COUNT.unpack_from(data, offset)
+        end = offset + _COUNT.size + count * dtype.itemsize
+        if end > len(data):
+            break
+        block = np.empty(count, dtype=dtype)
+        position = offset + _COUNT.size
+        for name in dtype.names:
+            column = dtype.fields[name][0]
+            block[name] = np.frombuffer(data, dtype=column, count=count, offset=position)
+            position += count * column.itemsize
+        blocks.append(block)
+        offset = end
+    return np.concatenate(blocks) if blocks else np.zeros(0, dtype=dtype)
+
+
+def main():
+    argparser = argparse.ArgumentParser(description='Summary of a risk telemetry log')
+    argparser.add_argument('path', help='telemetry file written by generate_traffic_vehicle.py')
+    argparser.add_argument('--top', metavar='N', default=10, type=int,
+                           help='actors with the highest probability to list (default: 10)')
+    args = argparser.parse_args()
+
+    records = read_telemetry(args.path)
+    print('%d records, %d frames, %d actors, %.1f kB' % (
+        len(records), len(np.unique(records['frame'])), len(np.unique(records['id'])),
+        os.path.getsize(args.path) / 1024.0))
+    if len(records) == 0:
+        return
+    ids, rows = np.unique(records['id'], return_inverse=True)
+    highest = np.zeros(len(ids))
+    np.maximum.at(highest, rows, records['probability'])
+    for i in np.argsort(-highest)[:args.top]:
+        print('id: %d  max probability: %.4f' % (ids[i], highest[i]))
+
+
+if __name__ == '__main__':
+    main()
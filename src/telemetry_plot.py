@@ -0,0 +1,88 @@
+"""Fixed capacity telemetry plot of the repulsive force and the vehicle control.
+
+Samples go to preallocated ring buffers and the lines are updated in place with
+blitting, so the cost of a redraw depends on the capacity of the plot, not on
+how long the session has been running.
+"""
+
+import numpy as np
+
+# field: (axes, color, label)
+TELEMETRY_LINES = {
+    'force': (0, 'r', 'repulsive force'),
+    'median': (0, 'b', 'median'),
+    'throttle': (1, 'g', 'throttle'),
+    'brake': (1, 'k', 'brake'),
+}
+
+
+class TelemetryPlot(object):
+    """Last `capacity` samples of every field, the newest on the right"""
+
+    def __init__(self, fig, capacity=400, fields=('force', 'median', 'throttle', 'brake'), force_limits=(-5.0, 50.0)):
+        self.fig = fig
+        self.capacity = capacity
+        self.fields = fields
+        self.count = 0
+        self._values = np.full((len(fields), capacity), np.nan)
+        self._x = np.arange(-capacity + 1, 1)
+
+        force_ax, control_ax = fig.subplots(2, 1, sharex=True, gridspec_kw={'height_ratios': (3, 1)})
+        self.axes = (force_ax, control_ax)
+        force_ax.set_ylim(*force_limits)
+        force_ax.set_ylabel('force')
+        control_ax.set_ylim(-0.05, 1.05)
+        control_ax.set_ylabel('control')
+        control_ax.set_xlim(self._x[0], self._x[-1])
+        control_ax.set_xlabel('frames ago')
+        self.lines = []
+        for field in fields:
+            axes, color, label = TELEMETRY_LINES[field]
+            line, = self.axes[axes].plot(self._x, self._values[0], color, label=label, animated=True)
+            self.lines.append(line)
+        for ax in self.axes:
+            ax.legend(loc='upper left')
+        self._background = None
+        self.fig.canvas.mpl_connect('draw_event', self._on_draw)
+
+    def push(self, samples):
+        '''
+        append samples to the ring buffers
+        samples: (n, len(fields)) array, oldest first
+        '''
+        samples = np.asarray(samples, dtype=np.float64)[-self.capacity:]
+        index = (self.count + np.arange(samples.shape[0])) % self.capacity
+        self._values[:, index] = samples.T
+        self.count += samples.shape[0]
+
+    def draw(self):
+        """Updates the lines in place and blits them, the axes are only redrawn when a value leaves the force range"""
+        start = self.count % self.capacity
+        values = np.concatenate((self._values[:, start:], self._values[:, :start]), axis=1)
+        for line, value in zip(self.lines, values):
+            line.set_ydata(value)
+
+        force_ax = self.axes[0]
+        low, high = force_ax.get_ylim()
+        force = values[[i for i, field in enumerate(self.fields) if TELEMETRY_LINES[field][0] == 0]]
+        if force.size and np.any(np.isfinite(force)):
+            fmin, fmax = np.nanmin(force), np.nanmax(force)
+            if fmin < low or fmax > high:
+                margin = 0.1 * (max(fmax, high) - min(fmin, low))
+                force_ax.set_ylim(min(fmin, low) - margin, max(fmax, high) + margin)
+                self._background = None
+
+        canvas = self.fig.canvas
+        if self._background is None:
+            # full redraw, _on_draw grabs the new background
+            canvas.draw()
+        canvas.restore_region(self._background)
+        for line in self.lines:
+            line.axes.draw_artist(line)
+        canvas.blit(self.fig.bbox)
+        canvas.flush_events()
+
+    def _on_draw(self, event):
+        self._background = self.fig.canvas.copy_from_bbox(self.fig.bbox)
+        for line in self.lines:
+            line.axes.draw_artist(line)
@@ -9,7 +9,8 @@
 """
 Script that render multiple sensors in the same pygame window
 
-By default, it renders four cameras, one LiDAR and one Semantic LiDAR.
+By default, it renders four cameras, one LiDAR and one Semantic LiDAR,
+or the range image of the Semantic LiDAR with --range-image.
 It can easily be configure for any different number of sensors. 
 To do that, check lines 290-308.
 """
@@ -32,6 +33,8 @@ import random
 import time
 import numpy as np
 
+from lidar_geometry import LidarGeometry
+from lidar_range_image import RangeImage
 
 try:
     import pygame
@@ -150,6 +153,26 @@ class SensorManager:
             lidar.listen(self.save_semanticlidar_image)
 
             return lidar
+
+        elif sensor_type == 'RangeImage':
+            lidar_bp = self.world.get_blueprint_library().find('sensor.lidar.ray_cast_semantic')
+            lidar_bp.set_attribute('range', '100')
+
+            for key in sensor_options:
+                lidar_bp.set_attribute(key, sensor_options[key])
+
+            # channels and points_per_second are int attributes, as_float() does not cast them
+            attributes = {key: lidar_bp.get_attribute(key).as_float() for key in ('upper_fov', 'lower_fov', 'range')}
+            attributes.update((key, lidar_bp.get_attribute(key).as_int()) for key in ('channels', 'points_per_second'))
+            self.lidar_geometry = LidarGeometry.from_attributes(
+                attributes, lidar_bp.get_attribute('rotation_frequency').as_float())
+            self.lidar_range = attributes['range']
+
+            lidar = self.world.spawn_actor(lidar_bp, transform, attach_to=attached)
+
+            lidar.listen(self.save_range_image)
+
+            return lidar
         
         elif sensor_type == "Radar":
             radar_bp = self.world.get_blueprint_library().find('sensor.other.radar')
@@ -235,6 +258,26 @@ class SensorManager:
         self.time_processing += (t_end-t_start)
         self.tics_processing += 1
 
+    def save_range_image(self, image):
+        t_start = self.timer.time()
+
+        disp_size = self.display_man.get_display_size()
+
+        points = np.frombuffer(image.raw_data, dtype=np.dtype('f4'))
+        points = np.reshape(points, (int(points.shape[0] / 6), 6))
+        range_image = RangeImage(self.lidar_geometry, points[:, 0], points[:, 1], points[:, 2])
+
+        # closer is brighter, rays without return stay black; the highest channel on top
+        intensity = 255.0 * (1.0 - np.minimum(range_image.range, self.lidar_range) / self.lidar_range)
+        lidar_img = np.repeat(intensity[::-1].T[:, :, None], 3, axis=2).astype(np.uint8)
+
+        if self.display_man.render_enabled():
+            self.surface = pygame.transform.scale(pygame.surfarray.make_surface(lidar_img), disp_size)
+
+        t_end = self.timer.time()
+        self.time_processing += (t_end-t_start)
+        self.tics_processing += 1
+
     def save_radar_image(self, radar_data):
         t_start = self.timer.time()
         points = np.frombuffer(radar_data.raw_data, dtype=np.dtype('f4'))
@@ -300,7 +343,7 @@ def run_simulation(args, client):
 
         SensorManager(world, display_manager, 'LiDAR', carla.Transform(carla.Location(x=0, z=2.4)), 
                       vehicle, {'channels' : '64', 'range' : '100',  'points_per_second': '250000', 'rotation_frequency': '20'}, display_pos=[1, 0])
-        SensorManager(world, display_manager, 'SemanticLiDAR', carla.Transform(carla.Location(x=0, z=2.4)), 
+        SensorManager(world, display_manager, 'RangeImage' if args.range_image else 'SemanticLiDAR', carla.Transform(carla.Location(x=0, z=2.4)), 
                       vehicle, {'channels' : '64', 'range' : '100', 'points_per_second': '100000', 'rotation_frequency': '20'}, display_pos=[1, 2])
 
 
@@ -367,6 +410,10 @@ def main():
         metavar='WIDTHxHEIGHT',
         default='1280x720',
         help='window resolution (default: 1280x720)')
+    argparser.add_argument(
+        '--range-image',
+        action='store_true',
+        help='show the range image of the Semantic LiDAR instead of its top view')
 
     args = argparser.parse_args()
 